@@ -0,0 +1,460 @@
+# Backup Manifest
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import collections
+import gzip
+import hashlib
+import json
+import os
+import stat
+import time
+
+import deltaStorage
+import fileUtilities
+import runReport
+
+manifest_version = 1
+manifest_suffix = '.manifest'
+digest_version = 1
+digest_suffix = '.digest'
+# index of the files of a snapshot stored in packs, see packStore
+pack_index_suffix = '.packs'
+
+# suffixes of the files stored next to a snapshot directory that belong to it, they are renamed and removed
+# with the snapshot
+sidecar_suffixes = [manifest_suffix, digest_suffix, pack_index_suffix, deltaStorage.recipe_index_suffix]
+
+# an entry modified this close to the time its manifest was taken is treated as changed on the next run,
+# otherwise a write landing in the same timestamp tick as the scan would go unnoticed
+racy_window_ns = 2 * 1000000000
+
+# change event types yielded by the diff engines (see incrementalBackup.iter_changes)
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+DIR_ADDED = 'dir-added'
+DIR_REMOVED = 'dir-removed'
+
+# rel is the path relative to the compared roots, src and dst the full paths on each side
+ChangeEvent = collections.namedtuple('ChangeEvent', ['kind', 'rel', 'src', 'dst'])
+
+
+def manifest_path(snapshot_dir: str) -> str:
+    return os.path.normpath(snapshot_dir) + manifest_suffix
+
+
+def digest_path(snapshot_dir: str) -> str:
+    return os.path.normpath(snapshot_dir) + digest_suffix
+
+
+def snapshot_sidecars(snapshot_dir: str) -> list:
+    """
+    :param snapshot_dir: a snapshot directory
+    :return: list of the sidecar files of snapshot_dir that exist
+    """
+    base = os.path.normpath(snapshot_dir)
+    return [base + suffix for suffix in sidecar_suffixes if os.path.isfile(base + suffix)]
+
+
+def rename_snapshot_sidecars(old_snapshot_dir: str, new_snapshot_dir: str):
+    for sidecar in snapshot_sidecars(old_snapshot_dir):
+        suffix = sidecar[len(os.path.normpath(old_snapshot_dir)):]
+        os.replace(sidecar, os.path.normpath(new_snapshot_dir) + suffix)
+
+
+def stat_entry(st: os.stat_result) -> tuple:
+    size = 0 if stat.S_ISDIR(st.st_mode) else st.st_size
+    return size, st.st_mtime_ns, st.st_mode, st.st_ino
+
+
+def entry_is_dir(entry: tuple) -> bool:
+    return stat.S_ISDIR(entry[2])
+
+
+def _funny_entry_error(src, rel, error):
+    return Exception(f'There were funny files found when scanning {src}\n'
+                     f'Funny Files: [{rel}] ({error})')
+
+
+def _scan_directory(src, rel, ignore_filter):
+    """
+    Lists a single directory, entries matched by ignore_filter are dropped before they are stat'ed
+    :return: list of (name, relative path, entry tuple)
+    """
+    items = []
+    with os.scandir(os.path.join(src, rel) if rel else src) as it:
+        for dir_entry in it:
+            child_rel = os.path.join(rel, dir_entry.name) if rel else dir_entry.name
+            if ignore_filter is not None and ignore_filter.is_ignored(child_rel, dir_entry.is_dir):
+                continue
+            try:
+                # follows symbolic links, the same as filecmp and shutil.copytree see them
+                st = dir_entry.stat()
+            except OSError as e:
+                raise _funny_entry_error(src, child_rel, e)
+            items.append((dir_entry.name, child_rel, stat_entry(st)))
+    runReport.count('directories_walked')
+    runReport.count('files_stated', len(items))
+    return items
+
+
+def scan_tree(src: str, ignore_filter=None) -> dict:
+    """
+    Stats every entry below src with a single os.scandir pass
+    :param src: directory to scan
+    :param ignore_filter: IgnoreFilesFilter, matching entries are skipped (and not descended into)
+    :return: dict of relative path -> (size, mtime_ns, mode, inode)
+    """
+    entries = {}
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        for _, child_rel, entry in _scan_directory(src, rel, ignore_filter):
+            entries[child_rel] = entry
+            if entry_is_dir(entry):
+                stack.append(child_rel)
+    return entries
+
+
+def _ignore_key(ignore_list: list) -> list:
+    """
+    :return: the ignore list as recorded in the headers, order only matters once a pattern is negated
+    """
+    if not ignore_list:
+        return []
+    if any(pattern.startswith('!') for pattern in ignore_list):
+        return list(ignore_list)
+    return sorted(ignore_list)
+
+
+def write_manifest(path: str, source: str, entries: dict, ignore_list: list = None, created_ns: int = None,
+                   extra_header: dict = None):
+    """
+    Writes the manifest atomically (temporary file then rename) as gzip'ed json lines, a header line followed by
+    one [path, size, mtime_ns, mode, inode] line per entry
+    :param path: manifest file to write, see manifest_path
+    :param source: the source directory the entries describe
+    :param entries: dict from scan_tree or iter_manifest_changes
+    :param ignore_list: ignore list used for the scan, a manifest is only reused with the same list
+    :param created_ns: time the scan started, defaults to now
+    :param extra_header: more fields for the header (e.g. the LATEST a virtual snapshot resolves against)
+    """
+    if created_ns is None:
+        created_ns = time.time_ns()
+    header = {'version': manifest_version,
+              'source': os.path.abspath(source),
+              'ignore_list': _ignore_key(ignore_list),
+              'created_ns': created_ns,
+              'count': len(entries)}
+    if extra_header:
+        header.update(extra_header)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        f.write(json.dumps(header) + '\n')
+        for rel, entry in entries.items():
+            f.write(json.dumps([rel, *entry]) + '\n')
+    os.replace(tmp_path, path)
+
+
+def read_manifest_header(path: str) -> dict:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.loads(f.readline())
+
+
+def read_manifest(path: str):
+    """
+    :param path: manifest file
+    :return: (header, entries) where entries is a dict of relative path -> (size, mtime_ns, mode, inode)
+    """
+    entries = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        for line in f:
+            rel, size, mtime_ns, mode, ino = json.loads(line)
+            entries[rel] = (size, mtime_ns, mode, ino)
+    return header, entries
+
+
+def load_manifest(path: str, source: str, ignore_list: list = None, verbose: bool = False):
+    """
+    Reads a manifest if it can be used to diff source, a missing, unreadable or stale (different source, ignore
+    list or format) manifest returns None so the caller can fall back to a full comparison.
+    :return: (header, entries) or None
+    """
+    if not os.path.isfile(path):
+        if verbose:
+            print(f'[ Manifest ] : [ No manifest found at {path} ]')
+        return None
+    try:
+        header, entries = read_manifest(path)
+    except (OSError, ValueError, EOFError) as e:
+        print(f'[ Manifest ] : [ Could not read {path}, ignoring it ({e}) ]')
+        return None
+
+    expected_ignore = _ignore_key(ignore_list)
+    if header.get('version') != manifest_version or header.get('source') != os.path.abspath(source) \
+            or header.get('ignore_list') != expected_ignore or header.get('count') != len(entries):
+        if verbose:
+            print(f'[ Manifest ] : [ Manifest {path} is stale (source, ignore list or version changed) ]')
+        return None
+    return header, entries
+
+
+def _children_by_parent(entries: dict) -> dict:
+    children = {}
+    for rel in entries:
+        parent, name = os.path.split(rel)
+        children.setdefault(parent, []).append(name)
+    return children
+
+
+def _remove_subtree(entries: dict, children: dict, rel: str):
+    stack = [rel]
+    while stack:
+        curr = stack.pop()
+        entry = entries.pop(curr, None)
+        if entry is not None and entry_is_dir(entry):
+            stack.extend(os.path.join(curr, name) for name in children.get(curr, []))
+
+
+def _dirty_roots(dirty_dirs: dict, old_entries: dict, ignore_filter):
+    """
+    Orders the directories given by a change journal, directories that are not in the manifest (new ones are
+    copied with their parent), ignored, or below a directory that is compared recursively are dropped
+    :return: list of (relative path, recursive)
+    """
+    roots = []
+    recursive_prefixes = []
+    for rel in sorted(dirty_dirs, key=lambda d: (d.count(os.sep) + (1 if d else 0), d)):
+        if rel:
+            entry = old_entries.get(rel)
+            if entry is None or not entry_is_dir(entry):
+                continue
+            if ignore_filter is not None and ignore_filter.path_excluded(rel):
+                continue
+        if any(rel == prefix or rel.startswith(prefix + os.sep) or prefix == '' for prefix in recursive_prefixes):
+            continue
+        roots.append((rel, dirty_dirs[rel]))
+        if dirty_dirs[rel]:
+            recursive_prefixes.append(rel)
+    return roots
+
+
+def iter_manifest_changes(src: str, dst: str, manifest, entries: dict, ignore_filter=None, dirty_dirs: dict = None):
+    """
+    Diffs src against the manifest of the previous snapshot with one os.scandir pass and yields the changes as
+    ChangeEvents, nothing is read from dst. Within a directory removals come before additions so a rename that
+    only changes the case of a name is applied correctly on case insensitive file systems. Every entry is stat'ed
+    before its event is yielded (a new directory is scanned completely first), so a file changing while it is
+    copied differs from the new manifest on the next run.
+    :param src: source directory
+    :param dst: the linked copy of the snapshot the manifest belongs to, only used to build the event paths
+    :param manifest: (header, entries) from load_manifest
+    :param entries: dict filled with the new manifest of src, complete once the generator is exhausted
+    :param ignore_filter: IgnoreFilesFilter the manifest was created with
+    :param dirty_dirs: optional dict of relative directory -> recursive (see changeJournal.JournalReader), only
+                       these directories are scanned and everything else is taken as unchanged from the manifest
+    """
+    header, old_entries = manifest
+    racy_after_ns = header['created_ns'] - racy_window_ns
+    old_children = _children_by_parent(old_entries)
+
+    def event(kind, rel):
+        return ChangeEvent(kind, rel, os.path.join(src, rel), os.path.join(dst, rel))
+
+    if dirty_dirs is None:
+        roots = [('', True)]
+    else:
+        entries.update(old_entries)
+        roots = _dirty_roots(dirty_dirs, old_entries, ignore_filter)
+
+    # (relative path, True if sub directories are scanned)
+    stack = list(reversed(roots))
+    while stack:
+        rel, recursive = stack.pop()
+        try:
+            items = _scan_directory(src, rel, ignore_filter)
+        except FileNotFoundError:
+            if dirty_dirs is None or not rel:
+                raise
+            # removed since the journal recorded it, its parent lists the removal
+            continue
+
+        names = set(name for name, _, _ in items)
+        for name in sorted(old_children.get(rel, [])):
+            if name not in names:
+                child_rel = os.path.join(rel, name) if rel else name
+                if dirty_dirs is not None:
+                    _remove_subtree(entries, old_children, child_rel)
+                yield event(DIR_REMOVED if entry_is_dir(old_entries[child_rel]) else REMOVED, child_rel)
+
+        for name, child_rel, entry in items:
+            old_entry = old_entries.get(child_rel)
+            if old_entry is not None and entry_is_dir(old_entry) != entry_is_dir(entry):
+                # a file replaced by a directory or the other way around
+                if dirty_dirs is not None:
+                    _remove_subtree(entries, old_children, child_rel)
+                yield event(DIR_REMOVED if entry_is_dir(old_entry) else REMOVED, child_rel)
+                old_entry = None
+            entries[child_rel] = entry
+
+            if old_entry is None:
+                if entry_is_dir(entry):
+                    entries.update((os.path.join(child_rel, sub_rel), sub_entry)
+                                   for sub_rel, sub_entry in scan_tree(os.path.join(src, child_rel),
+                                                                       ignore_filter).items())
+                    yield event(DIR_ADDED, child_rel)
+                else:
+                    yield event(ADDED, child_rel)
+            elif entry_is_dir(entry):
+                if recursive:
+                    stack.append((child_rel, True))
+            elif entry != old_entry or entry[1] >= racy_after_ns:
+                yield event(MODIFIED, child_rel)
+
+def write_snapshot_metadata(snapshot_dir: str, source: str, entries: dict, ignore_list: list = None,
+                            created_ns: int = None):
+    """
+    Writes the manifest and the digests of a snapshot made from source. The digests come from the manifest entries
+    (copies keep the size and mtime of the source) so no second walk is needed, the ignore list was applied when
+    the snapshot was made so the digests describe the snapshot as it is.
+    """
+    write_manifest(manifest_path(snapshot_dir), source, entries, ignore_list, created_ns)
+    write_digests(digest_path(snapshot_dir), compute_digests(entries))
+
+
+def compute_digests(entries: dict, content_hashes: dict = None) -> dict:
+    """
+    Builds the Merkle digests of a tree bottom up. The files digest of a directory covers the name, size and mtime
+    (and content hash if given) of the files directly in it, the tree digest covers the files digest and the names
+    and tree digests of its sub directories. Directory mtimes are left out as they change whenever an entry is added.
+    :param entries: dict of relative path -> (size, mtime_ns, mode, inode), see scan_tree
+    :param content_hashes: optional dict of relative path -> content hash for files
+    :return: dict of relative directory path ('' for the root) -> (tree digest, files digest)
+    """
+    children = {'': []}
+    for rel, entry in entries.items():
+        if entry_is_dir(entry):
+            children.setdefault(rel, [])
+    for rel in entries:
+        children.setdefault(os.path.dirname(rel), []).append(rel)
+
+    digests = {}
+    # deepest directories first so every sub directory is done before its parent
+    for directory in sorted(children, key=lambda d: d.count(os.sep) + (1 if d else 0), reverse=True):
+        files_hash = hashlib.sha256()
+        tree_hash = hashlib.sha256()
+        for rel in sorted(children[directory]):
+            name = os.path.basename(rel)
+            entry = entries[rel]
+            if entry_is_dir(entry):
+                tree_hash.update('D\0{}\0{}\n'.format(name, digests[rel][0]).encode('utf-8', 'surrogateescape'))
+            else:
+                content = content_hashes.get(rel, '') if content_hashes else ''
+                files_hash.update('F\0{}\0{}\0{}\0{}\n'.format(name, entry[0], entry[1], content)
+                                  .encode('utf-8', 'surrogateescape'))
+        files_digest = files_hash.hexdigest()
+        tree_hash.update(files_digest.encode('ascii'))
+        digests[directory] = (tree_hash.hexdigest(), files_digest)
+    return digests
+
+
+def write_digests(path: str, digests: dict, ignore_list: list = None, content_hash: bool = False):
+    """
+    Writes the digests of a snapshot next to it
+    :param path: digest file, see digest_path
+    :param digests: dict from compute_digests
+    :param ignore_list: ignore list applied when the snapshot was scanned
+    :param content_hash: True if the digests include content hashes
+    """
+    header = {'version': digest_version,
+              'ignore_list': _ignore_key(ignore_list),
+              'content_hash': content_hash}
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        f.write(json.dumps(header) + '\n')
+        for rel, (tree_digest, files_digest) in digests.items():
+            f.write(json.dumps([rel, tree_digest, files_digest]) + '\n')
+    os.replace(tmp_path, path)
+
+
+def load_digests(path: str, ignore_list: list = None, content_hash: bool = False):
+    """
+    :return: dict of digests or None if the file is missing, unreadable or was built with other settings
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != digest_version \
+                    or header.get('ignore_list') != _ignore_key(ignore_list) \
+                    or header.get('content_hash') != content_hash:
+                return None
+            digests = {}
+            for line in f:
+                rel, tree_digest, files_digest = json.loads(line)
+                digests[rel] = (tree_digest, files_digest)
+    except (OSError, ValueError, EOFError) as e:
+        print(f'[ Digest ] : [ Could not read {path}, ignoring it ({e}) ]')
+        return None
+    return digests
+
+
+def snapshot_digests(snapshot_dir: str, ignore_filter=None, content_hash: bool = False, verbose: bool = False):
+    """
+    Returns the digests of a snapshot, they are read from its digest file or computed (and saved) on first use
+    :param snapshot_dir: snapshot directory
+    :param ignore_filter: IgnoreFilesFilter, matching names are left out of the digests
+    :param content_hash: include the content hash of every file (reads every file the first time)
+    :return: dict from compute_digests
+    """
+    ignore_list = ignore_filter.ignore_list if ignore_filter is not None else None
+    path = digest_path(snapshot_dir)
+    digests = load_digests(path, ignore_list, content_hash)
+    if digests is not None:
+        return digests
+
+    if verbose:
+        print(f'[ Digest ] : [ Computing digests of {snapshot_dir} ]')
+    entries = scan_tree(snapshot_dir, ignore_filter)
+    # files stored as blocks are described by the file they restore to, as the manifest of their source does
+    recipes = deltaStorage.snapshot_recipes(snapshot_dir)
+    for rel, size in recipes.items():
+        if rel in entries:
+            entries[rel] = (size,) + entries[rel][1:]
+    content_hashes = None
+    if content_hash:
+        storage_root = os.path.dirname(os.path.abspath(snapshot_dir))
+        content_hashes = {rel: deltaStorage.hash_logical(os.path.join(snapshot_dir, rel), storage_root, True)
+                          if rel in recipes else fileUtilities.hash_file(os.path.join(snapshot_dir, rel))
+                          for rel, entry in entries.items() if not entry_is_dir(entry)}
+    digests = compute_digests(entries, content_hashes)
+    write_digests(path, digests, ignore_list, content_hash)
+    return digests
+
+
+def first_difference(digests_a: dict, digests_b: dict):
+    """
+    Finds the first directory whose own contents differ by descending only into sub directories whose tree
+    digests differ
+    :return: relative path of the directory ('' for the root) or None if the trees match
+    """
+    if digests_a.get('') == digests_b.get(''):
+        return None
+
+    def sub_directories(digests, directory):
+        return {rel for rel in digests if rel and os.path.dirname(rel) == directory}
+
+    directory = ''
+    while True:
+        subs_a = sub_directories(digests_a, directory)
+        subs_b = sub_directories(digests_b, directory)
+        if digests_a[directory][1] != digests_b[directory][1] or subs_a != subs_b:
+            return directory
+        differing = sorted(rel for rel in subs_a if digests_a[rel][0] != digests_b[rel][0])
+        if not differing:
+            return directory
+        directory = differing[0]
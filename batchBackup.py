@@ -0,0 +1,282 @@
+# Batch Backup
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import configparser
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+import fileUtilities
+import runReport
+
+version = '1.0'
+
+default_jobs = 4
+default_copiers = 8
+default_volume_limit = 1
+
+
+class BackupJob:
+    """
+    One SOURCE/LATEST pair of the batch, run as its own incrementalBackup.py process so the state of each backup
+    (journal, copy engine, indexes, run report) stays its own. Its output goes to a log in the metadata directory
+    of its backup set and its run report is read back for the results.
+    """
+
+    def __init__(self, name: str, source: str, latest: str, options: list = None, volumes: list = None):
+        """
+        :param name: name of the job (section of the config file)
+        :param options: extra incrementalBackup.py arguments
+        :param volumes: names of the volumes the job reads and writes, by default the devices of SOURCE and of the
+                        directory holding LATEST
+        """
+        self.name = name
+        self.source = os.path.abspath(source)
+        self.latest = os.path.abspath(latest)
+        self.options = options if options is not None else []
+        self.volumes = set(volumes) if volumes else {volume_of(self.source),
+                                                     volume_of(os.path.dirname(self.latest))}
+        meta = fileUtilities.metadata_dir(os.path.dirname(self.latest), False)
+        self.log_path = os.path.join(meta, 'batch-{}.log'.format(os.path.basename(self.latest)))
+        self.report_path = os.path.join(meta, 'batch-{}.json'.format(os.path.basename(self.latest)))
+        self.returncode = None
+        self.duration = None
+        self.report = {}
+
+    def copy_threads(self, copiers: int):
+        """
+        :param copiers: copy threads given to the job, its share of the copiers of the batch
+        :return: (copy workers, large file workers) of the job, a --copy_workers or --large_workers in its options
+                 replaces the share, the copy workers take what the large file workers leave
+        """
+        parser = argparse.ArgumentParser(add_help=False, exit_on_error=False)
+        parser.add_argument('--copy_workers', type=int)
+        parser.add_argument('--large_workers', type=int, default=1)
+        options, _ = parser.parse_known_args(self.options)
+        if options.copy_workers is None:
+            options.copy_workers = max(1, copiers - options.large_workers) if copiers > 1 else 0
+        return options.copy_workers, options.large_workers
+
+    def copiers(self, copiers: int) -> int:
+        """
+        :return: threads copying at once when the job is given copiers, 1 when the walk copies by itself
+                 (--copy_workers 0), see copyEngine.CopyEngine
+        """
+        copy_workers, large_workers = self.copy_threads(copiers)
+        return max(1, copy_workers) + max(1, large_workers) if copy_workers > 0 else 1
+
+    def command(self, copiers: int) -> list:
+        """
+        :param copiers: copy threads the job runs with, its share of the copiers of the batch or what its options ask
+                        for, whichever the scheduler gave it
+        :return: arguments starting the backup, the copy threads come after the options of the job so a job asking
+                 for more threads than it was given (more than the copiers of the batch) runs with copiers
+        """
+        if getattr(sys, 'frozen', False):
+            # the executables are built side by side from the spec files
+            script = [os.path.join(os.path.dirname(sys.executable),
+                                   'incrementalBackup' + os.path.splitext(sys.executable)[1])]
+        else:
+            script = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'incrementalBackup.py')]
+        copy_workers, large_workers = self.copy_threads(copiers)
+        if self.copiers(copiers) > copiers:
+            copy_workers, large_workers = (copiers - 1, 1) if copiers > 1 else (0, 1)
+        return script + [self.source, self.latest, '--report', self.report_path] + self.options + [
+            '--copy_workers', str(copy_workers), '--large_workers', str(large_workers)]
+
+    def run(self, copiers: int):
+        """
+        Runs the backup, returns once it exited
+        :param copiers: copy threads the job runs with, see command
+        """
+        start = time.perf_counter()
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            if os.path.isfile(self.report_path):
+                os.remove(self.report_path)
+            with open(self.log_path, 'w') as log:
+                self.returncode = subprocess.run(self.command(copiers), stdin=subprocess.DEVNULL, stdout=log,
+                                                 stderr=subprocess.STDOUT).returncode
+        finally:
+            self.duration = time.perf_counter() - start
+        try:
+            with open(self.report_path) as f:
+                self.report = json.load(f)
+        except (OSError, ValueError):
+            self.report = {}
+
+    def summary(self) -> str:
+        status = 'ok' if self.returncode == 0 else 'FAILED ({})'.format(self.returncode)
+        counters = self.report.get('counters', {})
+        duration = '{:.1f}s'.format(self.duration) if self.duration is not None else 'not run'
+        return '{}, {}, {} items changed, {} files copied, {} bytes copied'.format(
+            status, duration, counters.get('items_changed', 0), counters.get('files_copied', 0),
+            counters.get('bytes_copied', 0))
+
+
+def volume_of(path: str) -> str:
+    """
+    :return: name of the volume (device) holding path, or its nearest existing parent
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return 'dev-{}'.format(os.stat(path).st_dev)
+
+
+def read_jobs(path: str) -> list:
+    """
+    Reads the jobs of a batch, one section per job:
+
+        [photos]
+        source = /data/photos
+        latest = /backup/photos/LATEST
+        options = --dedup --catalog
+        volume = backup-disk
+
+    Keys of the [DEFAULT] section apply to every job, volume is a comma separated list of names replacing the
+    devices found for SOURCE and LATEST.
+    :return: list of BackupJob in the order of the file
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    if not config.read(path):
+        raise Exception(f'Could not read the batch file {path}')
+    jobs = []
+    latest_paths = set()
+    for name in config.sections():
+        section = config[name]
+        if 'source' not in section or 'latest' not in section:
+            raise Exception(f'Job [{name}] of {path} needs a source and a latest')
+        volumes = [v.strip() for v in section.get('volume', '').split(',') if v.strip()]
+        job = BackupJob(name, section['source'], section['latest'], shlex.split(section.get('options', '')), volumes)
+        try:
+            job.copy_threads(1)
+        except argparse.ArgumentError as e:
+            raise Exception(f'Job [{name}] of {path} has invalid options ({e})')
+        if job.latest in latest_paths:
+            raise Exception(f'Job [{name}] of {path} backs up to the same LATEST as another job ({job.latest})')
+        latest_paths.add(job.latest)
+        jobs.append(job)
+    return jobs
+
+
+def run_jobs(jobs: list, max_jobs: int = default_jobs, copiers: int = default_copiers,
+             volume_limit: int = default_volume_limit):
+    """
+    Runs the jobs concurrently, at most max_jobs at a time and at most volume_limit on any volume, a job waiting
+    for a busy volume lets the jobs after it start. Each job copies with its share of the copiers (copiers/max_jobs
+    threads, large file workers included) and a job only starts while the copy threads of the running jobs leave
+    room for its own, so a job whose options ask for more threads waits for others to finish (and runs alone with the
+    copiers if it asks for more than copiers).
+    """
+    max_jobs = max(1, max_jobs)
+    copiers = max(1, copiers)
+    volume_limit = max(1, volume_limit)
+    share = max(1, copiers // max_jobs)
+    condition = threading.Condition()
+    busy = {}
+    pending = list(jobs)
+    threads = []
+    running = 0
+    copiers_used = 0
+
+    def run(job, job_copiers):
+        nonlocal running, copiers_used
+        try:
+            job.run(job_copiers)
+        except Exception as e:
+            print(f'WARNING: Job {job.name} could not be started: {e}')
+            job.returncode = -1
+        finally:
+            # the scheduler is woken up before anything else can fail
+            with condition:
+                running -= 1
+                copiers_used -= job_copiers
+                for volume in job.volumes:
+                    busy[volume] -= 1
+                condition.notify()
+            print(f'[ Finished ] : [ {job.name} : {job.summary()} ]', flush=True)
+
+    def can_start(job):
+        return all(busy.get(v, 0) < volume_limit for v in job.volumes) and (
+            running == 0 or copiers_used + job.copiers(share) <= copiers)
+
+    with condition:
+        while pending:
+            job = None
+            if running < max_jobs:
+                job = next((j for j in pending if can_start(j)), None)
+            if job is None:
+                condition.wait()
+                continue
+            pending.remove(job)
+            job_copiers = job.copiers(share)
+            if job_copiers > copiers:
+                print(f'WARNING: Job {job.name} copies with {job_copiers} threads, more than the {copiers} copiers '
+                      f'of the batch, it runs alone with {copiers}')
+                job_copiers = copiers
+            running += 1
+            copiers_used += job_copiers
+            for volume in job.volumes:
+                busy[volume] = busy.get(volume, 0) + 1
+            print(f'[ Started ] : [ {job.name} : {job.source} -> {job.latest} ({job_copiers} copiers) ]', flush=True)
+            thread = threading.Thread(target=run, args=(job, job_copiers), daemon=True)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="batchBackup.py <BATCH_FILE>\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Runs the incrementalBackup.py jobs listed in BATCH_FILE "
+                                                 "concurrently, limiting the jobs running at once\n\tand the jobs "
+                                                 "using the same volume.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('batch_file', type=str, help='file listing the jobs, one [NAME] section per job with its '
+                                                     'source, latest and options')
+    parser.add_argument('-j', '--jobs', type=int, default=default_jobs,
+                        help='Most jobs running at the same time, each walks its SOURCE (default {}).'
+                             ''.format(default_jobs))
+    parser.add_argument('-c', '--copiers', type=int, default=default_copiers,
+                        help='Copy threads shared by the running jobs (large file workers included), each gets\n'
+                             'copiers/jobs and a job asking for more in its options waits for room (default {}).'
+                             ''.format(default_copiers))
+    parser.add_argument('--volume_limit', type=int, default=default_volume_limit,
+                        help='Most jobs using the same volume at the same time (default {}), raise it for '
+                             'volumes\nthat handle parallel access well (SSD, arrays).'.format(default_volume_limit))
+    parser.add_argument('--report', type=str, help='Write the time of each job and the counters of the batch to this '
+                                                   'file when it ends,\nin the Prometheus text format if it ends in '
+                                                   '.prom, JSON otherwise.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = init_args()
+    run_report = runReport.start('batchBackup', args.report)
+    jobs = read_jobs(args.batch_file)
+    print(f'[ Batch ] : [ {len(jobs)} jobs, {args.jobs} at a time, {args.copiers} copiers, '
+          f'{args.volume_limit} per volume ]')
+    run_jobs(jobs, args.jobs, args.copiers, args.volume_limit)
+
+    failed = [job for job in jobs if job.returncode != 0]
+    for job in jobs:
+        run_report.add_time(job.name, job.duration or 0.0)
+        print(f'[ {job.name} ] : [ {job.summary()} ] : [ {job.log_path} ]')
+    run_report.set_value('jobs', len(jobs))
+    run_report.set_value('jobs_failed', len(failed))
+    run_report.finish(not failed)
+    if jobs:
+        slowest = max(jobs, key=lambda job: job.duration or 0.0)
+        print(f'[ Timing ] : [ batch {run_report.duration:.1f}s, slowest job {slowest.name} '
+              f'{slowest.duration or 0.0:.1f}s ]')
+    exit(1 if failed else 0)
@@ -0,0 +1,393 @@
+# Benchmark Backup
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import contextlib
+import functools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+import fileUtilities
+import incrementalBackup
+import purgeDuplicateBackups
+
+version = '1.0'
+
+size_distributions = ['fixed', 'uniform', 'lognormal']
+
+# os functions counted in each phase, a python level approximation of the system calls made (os.DirEntry.stat
+# and calls made inside C code are not seen), the kernel read/write syscall counts come from /proc/self/io
+counted_os_functions = ['stat', 'lstat', 'scandir', 'listdir', 'open', 'link', 'symlink', 'mkdir', 'rmdir',
+                        'remove', 'unlink', 'rename', 'replace', 'utime', 'chmod', 'chflags', 'readlink',
+                        'copy_file_range', 'sendfile']
+
+# random data the files are cut from, each file starts with its own random bytes so no two files are equal
+_pool_size = 1024 * 1024
+_prefix_size = 16
+
+
+class TreeGenerator:
+    """
+    Creates a synthetic SOURCE tree and changes it between snapshots. The same seed gives the same tree (names,
+    sizes and which files churn), so runs of different versions can be compared.
+    """
+
+    def __init__(self, root: str, files: int, depth: int, files_per_dir: int, distribution: str, mean_size: int,
+                 max_size: int, seed: int):
+        self._root = root
+        self._files = files
+        self._depth = max(1, depth)
+        self._files_per_dir = max(1, files_per_dir)
+        self._distribution = distribution
+        self._mean_size = mean_size
+        self._max_size = max_size
+        self._rng = random.Random(seed)
+        self._pool = self._rng.randbytes(_pool_size)
+        self._dirs = []
+        self._paths = []
+        self._next_file = 0
+
+    def _size(self) -> int:
+        if self._distribution == 'fixed':
+            size = self._mean_size
+        elif self._distribution == 'uniform':
+            size = self._rng.randint(0, 2 * self._mean_size)
+        else:
+            # median well below the mean, a few large files hold most of the bytes like a real tree
+            sigma = 1.5
+            size = int(self._rng.lognormvariate(math.log(max(1, self._mean_size)) - sigma * sigma / 2, sigma))
+        return min(size, self._max_size)
+
+    def _write(self, path: str) -> int:
+        size = self._size()
+        with open(path, 'wb') as f:
+            remaining = size
+            prefix = self._rng.randbytes(_prefix_size)
+            f.write(prefix[:remaining])
+            remaining -= min(remaining, _prefix_size)
+            while remaining > 0:
+                n = min(remaining, _pool_size)
+                f.write(self._pool[:n])
+                remaining -= n
+        return size
+
+    def _new_file(self) -> str:
+        rel = os.path.join(self._rng.choice(self._dirs), 'f{:08d}.dat'.format(self._next_file))
+        self._next_file += 1
+        return rel
+
+    def generate(self) -> dict:
+        """
+        :return: dict of files, directories and bytes created
+        """
+        os.makedirs(self._root)
+        dir_count = max(1, math.ceil(self._files / self._files_per_dir))
+        levels = [['']]
+        self._dirs = ['']
+        for i in range(dir_count - 1):
+            # round robin over the levels so every level up to depth has directories
+            level = 1 + i % self._depth
+            rel = os.path.join(self._rng.choice(levels[level - 1]), 'd{:06d}'.format(i))
+            os.mkdir(os.path.join(self._root, rel))
+            if len(levels) <= level:
+                levels.append([])
+            levels[level].append(rel)
+            self._dirs.append(rel)
+
+        total = 0
+        for _ in range(self._files):
+            rel = self._new_file()
+            total += self._write(os.path.join(self._root, rel))
+            self._paths.append(rel)
+        return {'files': self._files, 'directories': len(self._dirs), 'bytes': total}
+
+    def churn(self, rate: float) -> dict:
+        """
+        Changes rate of the files: 60% are rewritten, 20% deleted and as many new files as 20% are added
+        :return: dict of the files modified, added and deleted
+        """
+        count = int(len(self._paths) * rate)
+        modified = int(count * 0.6)
+        deleted = int(count * 0.2)
+        added = count - modified - deleted
+
+        self._rng.shuffle(self._paths)
+        for rel in self._paths[:modified]:
+            self._write(os.path.join(self._root, rel))
+        for rel in self._paths[modified:modified + deleted]:
+            os.remove(os.path.join(self._root, rel))
+        del self._paths[modified:modified + deleted]
+        for _ in range(added):
+            rel = self._new_file()
+            self._write(os.path.join(self._root, rel))
+            self._paths.append(rel)
+        return {'modified': modified, 'added': added, 'deleted': deleted}
+
+
+def _count_calls(counts: dict, name: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        counts[name] += 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _read_proc_io() -> dict:
+    """
+    :return: the kernel I/O counters of this process (syscr and syscw are read and write syscalls), empty if
+             /proc/self/io is not available
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f if ':' in line)}
+    except OSError:
+        return {}
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _tree_size(path: str):
+    files = 0
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        if fileUtilities.metadata_dir_name in dirnames:
+            dirnames.remove(fileUtilities.metadata_dir_name)
+        for name in filenames:
+            files += 1
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+    return files, size
+
+
+def _phase_first_run(params: dict):
+    incrementalBackup.my_copy_tree(params['source'], params['latest'])
+    return params['latest'], None, None
+
+
+def _phase_link_farm(params: dict):
+    ignore_filter = incrementalBackup.IgnoreFilesFilter([])
+    if params['serial_links']:
+        incrementalBackup.create_links_of_files(params['previous'], params['latest'], False, ignore_filter)
+        return params['latest'], None, 0
+    links, _ = incrementalBackup.create_links_of_files_parallel(params['previous'], params['latest'], False,
+                                                                ignore_filter, params['workers'])
+    return None, links, 0
+
+
+def _phase_compare(params: dict):
+    # the same streaming path the main script runs, changes are applied as they are found
+    changes = incrementalBackup.apply_changes(incrementalBackup.iter_changes(params['source'], params['latest']),
+                                              False)
+    for _ in changes:
+        pass
+    stats = incrementalBackup.copy_stats
+    return params['source'], None, stats.bytes_cloned + stats.bytes_copied
+
+
+def _phase_purge(params: dict):
+    purgeDuplicateBackups.search_and_destroy(params['root'], shallow=params['shallow'],
+                                             workers=params['workers'])
+    return params['root'], None, 0 if params['shallow'] else None
+
+
+# each phase returns (tree, files, bytes), a count given as None is taken from the tree after the measurement
+_phases = {'first_run': _phase_first_run,
+           'link_farm': _phase_link_farm,
+           'compare': _phase_compare,
+           'purge': _phase_purge}
+
+
+def _run_phase(name: str, params: dict, conn):
+    """
+    Runs one phase in a fresh process (see run_phase) and sends its measurements through conn
+    """
+    counts = {func: 0 for func in counted_os_functions if hasattr(os, func)}
+    for func in counts:
+        setattr(os, func, _count_calls(counts, func, getattr(os, func)))
+
+    try:
+        rss_start = _peak_rss_kb()
+        io_start = _read_proc_io()
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            tree, files, size = _phases[name](params)
+        seconds = time.perf_counter() - start
+        io_end = _read_proc_io()
+        peak_rss = _peak_rss_kb()
+        calls = {key: value for key, value in counts.items() if value}
+
+        if files is None or size is None:
+            tree_files, tree_size = _tree_size(tree)
+            files = tree_files if files is None else files
+            size = tree_size if size is None else size
+        conn.send({'phase': name,
+                   'seconds': seconds,
+                   'files': files,
+                   'bytes': size,
+                   'files_per_s': files / seconds if seconds > 0 else None,
+                   'mb_per_s': size / seconds / 1024 ** 2 if seconds > 0 else None,
+                   'rss_start_kb': rss_start,
+                   'peak_rss_kb': peak_rss,
+                   'io': {key: io_end[key] - io_start.get(key, 0) for key in io_end},
+                   'os_calls': calls})
+    except BaseException as e:
+        conn.send({'phase': name, 'error': repr(e)})
+    finally:
+        conn.close()
+
+
+def run_phase(name: str, params: dict) -> dict:
+    """
+    Runs a phase in a spawned process so its peak RSS and I/O counters only cover that phase
+    :param name: one of first_run, link_farm, compare, purge
+    :param params: paths and options of the phase
+    :return: dict of measurements
+    """
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_run_phase, args=(name, params, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {'phase': name, 'error': f'process exited with code {process.exitcode}'}
+    process.join()
+    if 'error' in result:
+        raise Exception(f'Phase {name} failed: {result["error"]}')
+    return result
+
+
+def _print_result(result: dict):
+    print('[ {:<10} ] : [ {:8.2f}s {:>10.0f} files/s {:>9.1f} MB/s peak RSS {} KB ]'.format(
+        result['phase'], result['seconds'], result['files_per_s'] or 0, result['mb_per_s'] or 0,
+        result['peak_rss_kb']))
+
+
+def run_benchmark(work_dir: str, files: int, depth: int, files_per_dir: int, distribution: str, mean_size: int,
+                  max_size: int, churn: float, snapshots: int, seed: int, workers: int, serial_links: bool = False,
+                  shallow: bool = True) -> dict:
+    """
+    Generates a source tree and runs the phases of a backup set with snapshots snapshots: a first run, then for
+    each later snapshot churn, link farm and compare, and finally a purge over all of them
+    :return: dict of the parameters, tree and the measurements of each phase
+    """
+    source = os.path.join(work_dir, 'source')
+    root = os.path.join(work_dir, 'store')
+    latest = os.path.join(root, 'LATEST')
+    os.makedirs(root)
+
+    generator = TreeGenerator(source, files, depth, files_per_dir, distribution, mean_size, max_size, seed)
+    start = time.perf_counter()
+    tree = generator.generate()
+    tree['seconds'] = time.perf_counter() - start
+    print('[ Generated ] : [ {files} files, {directories} directories, {bytes} bytes ]'.format(**tree))
+
+    phases = []
+
+    def measure(name, snapshot, params):
+        result = run_phase(name, params)
+        result['snapshot'] = snapshot
+        _print_result(result)
+        phases.append(result)
+
+    measure('first_run', 0, {'source': source, 'latest': latest})
+    churned = []
+    for snapshot in range(1, snapshots):
+        churned.append(generator.churn(churn))
+        previous = os.path.join(root, 'snapshot_{:04d}'.format(snapshot - 1))
+        os.rename(latest, previous)
+        measure('link_farm', snapshot, {'previous': previous, 'latest': latest, 'workers': workers,
+                                        'serial_links': serial_links})
+        measure('compare', snapshot, {'source': source, 'latest': latest})
+    measure('purge', snapshots - 1, {'root': root, 'shallow': shallow, 'workers': workers})
+
+    return {'version': version,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'platform': {'python': platform.python_version(), 'system': platform.platform(),
+                         'cpus': os.cpu_count()},
+            'parameters': {'files': files, 'depth': depth, 'files_per_dir': files_per_dir,
+                           'size_distribution': distribution, 'mean_size': mean_size, 'max_size': max_size,
+                           'churn': churn, 'snapshots': snapshots, 'seed': seed, 'workers': workers,
+                           'serial_links': serial_links, 'shallow': shallow},
+            'tree': tree,
+            'churn': churned,
+            'phases': phases}
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="benchmarkBackup.py\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Generates a synthetic SOURCE tree and times each phase of a backup "
+                                                 "set (first run copy, link farm,\n\tcompare and purge) over several "
+                                                 "snapshots, the results are written as JSON.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('work_dir', type=str, help='directory the trees are created in (e.g. on tmpfs or ext4), '
+                                                   'a temporary directory inside it is used')
+    parser.add_argument('-f', '--files', type=int, default=10000, help='Number of files in SOURCE (default 10000).')
+    parser.add_argument('--depth', type=int, default=4, help='Depth of the directory tree (default 4).')
+    parser.add_argument('--files_per_dir', type=int, default=50, help='Average files per directory (default 50).')
+    parser.add_argument('--size_distribution', type=str, default='lognormal', choices=size_distributions,
+                        help='Distribution of the file sizes (default lognormal).')
+    parser.add_argument('--mean_size', type=fileUtilities.parse_size, default=16 * 1024,
+                        help='Mean file size (default 16K).')
+    parser.add_argument('--max_size', type=fileUtilities.parse_size, default=64 * 1024 ** 2,
+                        help='Largest file size (default 64M).')
+    parser.add_argument('-c', '--churn', type=float, default=0.05,
+                        help='Fraction of the files changed, added or deleted before each snapshot (default 0.05).')
+    parser.add_argument('-k', '--snapshots', type=int, default=3, help='Number of snapshots made (default 3).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the tree and the churn (default 0).')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='Worker threads of the link farm and the purge '
+                                                                     'hashing (default 8).')
+    parser.add_argument('--serial_links', action='store_true', help='Time create_links_of_files instead of the '
+                                                                    'parallel link farm.')
+    parser.add_argument('--deep', action='store_true', help='Purge compares file contents (purge without --shallow).')
+    parser.add_argument('-o', '--output', type=str, help='JSON file to write (default benchmark-<time>.json in the '
+                                                         'current directory).')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated trees.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = init_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='benchmarkBackup-', dir=args.work_dir)
+    print(f'[ Work Dir ] : [ {work_dir} ]')
+    try:
+        results = run_benchmark(work_dir, args.files, args.depth, args.files_per_dir, args.size_distribution,
+                                args.mean_size, args.max_size, args.churn, args.snapshots, args.seed, args.workers,
+                                args.serial_links, not args.deep)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir)
+
+    output = args.output
+    if output is None:
+        output = 'benchmark-{}.json'.format(datetime.now().strftime('%Y-%m-%d-%Hh%Mm%Ss'))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'[ Results ] : [ {output} ]')
@@ -0,0 +1,356 @@
+# Change Journal
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import signal
+import struct
+import sys
+import time
+import uuid
+
+version = '1.0'
+
+# inotify event masks (see man 7 inotify)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+watch_mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_event_header = struct.Struct('iIII')
+
+# journal records, one json list per line after the header line
+CHANGED = 'C'     # the listing or a file of the parent directory of the path changed
+TREE = 'T'        # everything below the path has to be compared (a directory created or moved in)
+OVERFLOW = 'O'    # events were lost, the journal can not be trusted
+STOP = 'S'        # the watcher stopped, later changes are not recorded
+
+_fsync_interval = 1.0
+
+
+def consumed_state_path(journal_path: str) -> str:
+    return journal_path + '.consumed'
+
+
+class Watcher:
+    """
+    Watches every directory below source with inotify and appends the changed paths to a journal file. Paths are
+    relative to source. A new journal (with a new session id) is started every time the watcher starts, so a
+    backup run can tell if the watcher was restarted since it last read the journal.
+    """
+
+    def __init__(self, source: str, journal_path: str, ignore_filter=None, verbose: bool = False):
+        self._source = os.path.abspath(source)
+        self._journal_path = journal_path
+        self._ignore_filter = ignore_filter
+        self._verbose = verbose
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._fd = -1
+        self._watches = {}
+        self._moves = {}
+        self._journal = None
+        self._last_sync = 0.0
+        self._last_line = None
+
+    def _record(self, kind: str, rel: str = None):
+        line = json.dumps([kind] if rel is None else [kind, rel]) + '\n'
+        if line == self._last_line:
+            # a file being written gives a burst of the same event
+            return
+        self._last_line = line
+        self._journal.write(line)
+        if self._verbose:
+            print(f'[ {kind} ] : [ {rel} ]')
+
+    def _sync(self, force=False):
+        self._journal.flush()
+        now = time.monotonic()
+        if force or now - self._last_sync >= _fsync_interval:
+            os.fsync(self._journal.fileno())
+            self._last_sync = now
+
+    def _add_watch(self, rel: str):
+        path = os.path.join(self._source, rel) if rel else self._source
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), watch_mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                # removed before the watch was added, its parent recorded the removal
+                return
+            # e.g. ENOSPC when fs.inotify.max_user_watches is reached, changes below path would be missed
+            self._record(OVERFLOW, rel)
+            print(f'[ Error ] : [ Could not watch {path}: {os.strerror(e)} ]')
+            return
+        self._watches[wd] = rel
+
+    def _add_tree(self, rel: str):
+        stack = [rel]
+        while stack:
+            curr = stack.pop()
+            self._add_watch(curr)
+            try:
+                with os.scandir(os.path.join(self._source, curr) if curr else self._source) as it:
+                    for entry in it:
+                        child = os.path.join(curr, entry.name) if curr else entry.name
+                        if self._ignore_filter is not None and self._ignore_filter.is_ignored(child, entry.is_dir):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(child)
+                        elif entry.is_symlink() and entry.is_dir():
+                            # the target is outside of what is watched, changes in it can not be seen
+                            self._record(OVERFLOW, child)
+                            print(f'[ Error ] : [ {child} is a link to a directory, it can not be watched ]')
+            except OSError:
+                pass
+
+    def _rename_watches(self, old_rel: str, new_rel: str):
+        prefix = old_rel + os.sep
+        for wd, rel in list(self._watches.items()):
+            if rel == old_rel:
+                self._watches[wd] = new_rel
+            elif rel.startswith(prefix):
+                self._watches[wd] = new_rel + rel[len(old_rel):]
+
+    def _remove_watches(self, old_rel: str):
+        prefix = old_rel + os.sep
+        for wd, rel in list(self._watches.items()):
+            if rel == old_rel or rel.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _handle(self, wd: int, mask: int, cookie: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self._record(OVERFLOW)
+            return
+        if wd not in self._watches:
+            return
+        if mask & IN_IGNORED:
+            del self._watches[wd]
+            return
+        parent = self._watches[wd]
+        if not name:
+            # IN_DELETE_SELF / IN_MOVE_SELF, the parent directory reports the change
+            return
+        rel = os.path.join(parent, name) if parent else name
+        if self._ignore_filter is not None and self._ignore_filter.is_ignored(rel, bool(mask & IN_ISDIR)):
+            return
+        self._record(CHANGED, rel)
+
+        if mask & IN_ISDIR:
+            if mask & IN_MOVED_FROM:
+                self._moves[cookie] = rel
+            elif mask & IN_MOVED_TO:
+                old_rel = self._moves.pop(cookie, None)
+                if old_rel is not None:
+                    self._rename_watches(old_rel, rel)
+                else:
+                    self._add_tree(rel)
+                self._record(TREE, rel)
+            elif mask & IN_CREATE:
+                # files created before the watch was added are only found by comparing the whole directory
+                self._add_tree(rel)
+                self._record(TREE, rel)
+
+    def run(self):
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        tmp_path = self._journal_path + '.tmp'
+        self._journal = open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape')
+        header = {'version': version, 'session': uuid.uuid4().hex, 'source': self._source, 'pid': os.getpid(),
+                  'host': os.uname().nodename, 'started_ns': time.time_ns()}
+        self._journal.write(json.dumps(header) + '\n')
+        self._sync(True)
+        os.replace(tmp_path, self._journal_path)
+        print(f'[ Watching ] : [ {self._source} -> {self._journal_path} ]')
+
+        # watches are added after the journal exists, anything changing while they are added is recorded
+        self._add_tree('')
+        print(f'[ Watches ] : [ {len(self._watches)} directories ]')
+        self._sync(True)
+
+        try:
+            while True:
+                data = os.read(self._fd, 1024 * 1024)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+                    offset += _event_header.size
+                    name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                    offset += length
+                    self._handle(wd, mask, cookie, name)
+                # a directory moved out of the source never gets its IN_MOVED_TO, stop watching it
+                for cookie, rel in list(self._moves.items()):
+                    del self._moves[cookie]
+                    self._remove_watches(rel)
+                self._sync()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._record(STOP)
+            self._sync(True)
+            self._journal.close()
+            os.close(self._fd)
+
+
+def _watcher_alive(header: dict) -> bool:
+    if header.get('host') != os.uname().nodename:
+        # can not check a process on another machine, the STOP record is all there is
+        return True
+    try:
+        os.kill(header['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JournalReader:
+    """
+    Reads the changes a Watcher recorded since the last backup run. The journal can only be used when the same
+    watcher session was running when the last run read it, nothing was lost (no overflow) and the watcher is still
+    running, otherwise dirty_directories returns None and the run has to do a full scan.
+    """
+
+    def __init__(self, journal_path: str, source: str):
+        self._journal_path = journal_path
+        self._source = os.path.abspath(source)
+        self._state = None
+
+    def dirty_directories(self, verbose: bool = False):
+        """
+        :return: dict of relative directory path -> True if everything below it has to be compared, False if only
+                 its own entries, or None if the journal can not be trusted
+        """
+        self._state = None
+        try:
+            with open(self._journal_path, 'rb') as f:
+                header = json.loads(f.readline())
+                previous = None
+                if os.path.isfile(consumed_state_path(self._journal_path)):
+                    with open(consumed_state_path(self._journal_path), 'r') as state_file:
+                        previous = json.load(state_file)
+
+                if header.get('source') != self._source:
+                    print(f'[ Journal ] : [ {self._journal_path} is for {header.get("source")}, not {self._source} ]')
+                    return None
+                if not _watcher_alive(header):
+                    print(f'[ Journal ] : [ The watcher writing {self._journal_path} is not running ]')
+                    return None
+
+                restarted = previous is None or previous.get('session') != header['session']
+                if restarted:
+                    print('[ Journal ] : [ The watcher was (re)started since the last run, doing a full scan ]')
+                    f.seek(0, os.SEEK_END)
+                else:
+                    f.seek(previous['offset'])
+
+                lost = False
+                stopped = False
+                dirty = {}
+                offset = f.tell()
+                for line in iter(f.readline, b''):
+                    if not line.endswith(b'\n'):
+                        # partly written record, it is read on the next run
+                        break
+                    offset += len(line)
+                    record = json.loads(line)
+                    if record[0] == OVERFLOW:
+                        lost = True
+                    elif record[0] == STOP:
+                        stopped = True
+                    elif record[0] == TREE:
+                        dirty[record[1]] = True
+                    else:
+                        dirty.setdefault(os.path.dirname(record[1]), False)
+        except (OSError, ValueError) as e:
+            print(f'[ Journal ] : [ Could not read {self._journal_path} ({e}) ]')
+            return None
+
+        if stopped:
+            # nothing is recorded after this, the journal stays unusable until the watcher is restarted
+            print('[ Journal ] : [ The watcher stopped, doing a full scan ]')
+            return None
+
+        # a full scan starts from here, the next run can use the journal if nothing is lost until then
+        self._state = {'session': header['session'], 'offset': offset}
+        if restarted:
+            return None
+        if lost:
+            print('[ Journal ] : [ Changes were lost (overflow or unwatchable directory), doing a full scan ]')
+            return None
+
+        if verbose:
+            print(f'[ Journal ] : [ {len(dirty)} directories changed ]')
+        return dirty
+
+    def commit(self):
+        """
+        Records that the changes returned by dirty_directories were backed up, call after the run finished
+        """
+        if self._state is None:
+            return
+        path = consumed_state_path(self._journal_path)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._state, f)
+        os.replace(path + '.tmp', path)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="changeJournal.py <SOURCE> <JOURNAL>\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Watches SOURCE with inotify (Linux) and records the paths that "
+                                                 "change in JOURNAL. Run it in the background and\n\tpass the same "
+                                                 "JOURNAL to incrementalBackup.py --journal so only the directories "
+                                                 "that changed are compared.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('source', type=str, help="source directory to watch")
+    parser.add_argument('journal', type=str, help="journal file to write")
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print every change recorded.')
+    parser.add_argument('-o', '--omit_list', type=str, help='List of directory/file names to exclude, can use '
+                                                            'patterns,\n(e.g  -o test,logs,*.exe)')
+    parser.add_argument('--ignore_file', type=str, help='File of patterns to exclude, one per line (see '
+                                                        'incrementalBackup.py --ignore_file).')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from incrementalBackup import IgnoreFilesFilter
+
+    args = init_args()
+    if not sys.platform.startswith('linux'):
+        print('[ Error ] : [ changeJournal.py needs inotify (Linux) ]')
+        sys.exit(1)
+
+    ignore_list = None
+    if args.omit_list:
+        ignore_list = [x for x in args.omit_list.split(',') if x]
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # stop cleanly (writing the STOP record) on SIGTERM as well
+    signal.signal(signal.SIGTERM, stop)
+    Watcher(args.source, args.journal, IgnoreFilesFilter(ignore_list, args.ignore_file), args.verbose).run()
@@ -0,0 +1,278 @@
+# Content Store
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import concurrent.futures
+import errno
+import os
+import sqlite3
+import stat
+import threading
+
+import fileUtilities
+
+index_file_name = 'content_index.db'
+
+# files smaller than this are always copied, a link saves little and the lookup is not free
+default_min_size = 64 * 1024
+
+_commit_every = 1000
+
+
+class ContentIndex:
+    """
+    Index of the files stored in a backup set, kept in sqlite in the metadata directory of the set. Files are
+    found by (size, mtime) and confirmed by a content hash, so a file that was renamed or moved in the source is
+    hard linked from the copy already in the backup set instead of copied again. Entries are stored as
+    (snapshot directory name, path in the snapshot) so renaming a snapshot only updates one column. Entries whose
+    file no longer matches are dropped when they are looked up.
+    """
+
+    def __init__(self, storage_root: str, min_size: int = default_min_size):
+        self._root = os.path.abspath(storage_root)
+        self._min_size = min_size
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._db = sqlite3.connect(os.path.join(fileUtilities.metadata_dir(self._root), index_file_name),
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS files (snapshot TEXT, path TEXT, size INTEGER, '
+                         'mtime_ns INTEGER, digest TEXT, PRIMARY KEY (snapshot, path))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS files_signature ON files (size, mtime_ns)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS files_digest ON files (digest)')
+        self._db.commit()
+        self.deduplicated_files = 0
+        self.deduplicated_bytes = 0
+
+    @staticmethod
+    def exists(storage_root: str) -> bool:
+        return os.path.isfile(os.path.join(storage_root, fileUtilities.metadata_dir_name, index_file_name))
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM files LIMIT 1').fetchone() is None
+
+    def _split(self, path: str):
+        rel = os.path.relpath(os.path.abspath(path), self._root)
+        snapshot, _, rel_in_snapshot = rel.partition(os.sep)
+        return snapshot, rel_in_snapshot
+
+    def _commit_if_due(self):
+        self._pending += 1
+        if self._pending >= _commit_every:
+            self._db.commit()
+            self._pending = 0
+
+    def add(self, snapshot: str, rel: str, size: int, mtime_ns: int, digest: str = None):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                             (snapshot, rel, size, mtime_ns, digest))
+            self._commit_if_due()
+
+    def add_entries(self, snapshot: str, entries: dict):
+        """
+        Adds the files of a manifest (see backupManifest.scan_tree) stored in snapshot
+        """
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, NULL)',
+                                 ((snapshot, rel, entry[0], entry[1]) for rel, entry in entries.items()
+                                  if entry[0] > 0 and not stat.S_ISDIR(entry[2])))
+            self._db.commit()
+
+    def rename_snapshot(self, old_name: str, new_name: str):
+        with self._lock:
+            self._db.execute('UPDATE OR REPLACE files SET snapshot = ? WHERE snapshot = ?', (new_name, old_name))
+            self._db.commit()
+
+    def _drop(self, snapshot, rel):
+        with self._lock:
+            self._db.execute('DELETE FROM files WHERE snapshot = ? AND path = ?', (snapshot, rel))
+
+    def find(self, src: str, st: os.stat_result):
+        """
+        Looks for a file in the backup set with the same contents as src
+        :param src: file to look for
+        :param st: os.stat of src
+        :return: (path of the stored file or None, digest of src or None if it was not hashed)
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT snapshot, path, digest FROM files WHERE size = ? AND mtime_ns = ?',
+                                    (st.st_size, st.st_mtime_ns)).fetchall()
+        src_digest = None
+        for snapshot, rel, digest in rows:
+            candidate = os.path.join(self._root, snapshot, rel)
+            try:
+                candidate_st = os.stat(candidate)
+            except OSError:
+                self._drop(snapshot, rel)
+                continue
+            if candidate_st.st_size != st.st_size or candidate_st.st_mtime_ns != st.st_mtime_ns:
+                self._drop(snapshot, rel)
+                continue
+            if candidate_st.st_mode != st.st_mode:
+                # a link shares the permissions, the copy has to keep the ones of src
+                continue
+            if digest is None:
+                digest = fileUtilities.hash_file(candidate)
+                with self._lock:
+                    self._db.execute('UPDATE files SET digest = ? WHERE snapshot = ? AND path = ?',
+                                     (digest, snapshot, rel))
+            if src_digest is None:
+                src_digest = fileUtilities.hash_file(src)
+            if digest == src_digest:
+                return candidate, src_digest
+        return None, src_digest
+
+    def link_or_copy(self, src: str, dst: str, copy_function) -> str:
+        """
+        Hard links dst to a file in the backup set with the same contents as src, or copies src with copy_function
+        when there is none, either way dst is added to the index
+        :param src: file to copy
+        :param dst: path in a snapshot of the backup set, must not exist
+        :param copy_function: function(src, dst) used when no match is found
+        :return: dst
+        """
+        st = os.stat(src)
+        snapshot, rel = self._split(dst)
+        candidate, digest = None, None
+        if st.st_size >= self._min_size:
+            candidate, digest = self.find(src, st)
+
+        if candidate is not None:
+            try:
+                os.link(candidate, dst)
+                with self._lock:
+                    self.deduplicated_files += 1
+                    self.deduplicated_bytes += st.st_size
+            except OSError as e:
+                if e.errno not in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+                    raise
+                # too many links to the stored file or it is on another device
+                candidate = None
+        if candidate is None:
+            copy_function(src, dst)
+
+        if st.st_size > 0:
+            self.add(snapshot, rel, st.st_size, st.st_mtime_ns, digest)
+        return dst
+
+    def summary(self) -> str:
+        return '{} files, {} bytes'.format(self.deduplicated_files, self.deduplicated_bytes)
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+hash_cache_file_name = 'hash_cache.db'
+
+# threads hashing files, the reads are large and sequential and hashlib releases the GIL so threads are enough
+default_hash_workers = 4
+
+
+def _signed_64(value: int) -> int:
+    # st_dev and st_ino are unsigned 64 bit, sqlite integers are signed
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class HashCache:
+    """
+    Persistent cache of file content hashes keyed by (st_dev, st_ino, size, mtime_ns), kept in sqlite in the
+    metadata directory of a backup set. The snapshots of a set are mostly hard links to the same inodes, so each
+    physical file is read once for the lifetime of the set and later runs only hash the inodes they have not seen.
+    Files missing from the cache are hashed by a pool of threads. The hashes of files copied into the set can be
+    recorded as they are copied (see record), scrubBackups.py verifies the files against them.
+    """
+
+    def __init__(self, storage_root: str, workers: int = default_hash_workers):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(fileUtilities.metadata_dir(storage_root), hash_cache_file_name),
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS hashes (dev INTEGER, ino INTEGER, size INTEGER, '
+                         'mtime_ns INTEGER, digest TEXT, PRIMARY KEY (dev, ino, size, mtime_ns))')
+        self._db.commit()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max(1, workers))
+        self._pending = 0
+        self.cached_files = 0
+        self.hashed_files = 0
+        self.hashed_bytes = 0
+        self.recorded_files = 0
+
+    @staticmethod
+    def key(st: os.stat_result):
+        return _signed_64(st.st_dev), _signed_64(st.st_ino), st.st_size, st.st_mtime_ns
+
+    def _commit_if_due(self):
+        self._pending += 1
+        if self._pending >= _commit_every:
+            self._db.commit()
+            self._pending = 0
+
+    def lookup(self, st: os.stat_result):
+        """
+        :return: hex digest stored for the inode, size and mtime of st, None if there is none
+        """
+        with self._lock:
+            row = self._db.execute('SELECT digest FROM hashes WHERE dev = ? AND ino = ? AND size = ? '
+                                   'AND mtime_ns = ?', self.key(st)).fetchone()
+        return row[0] if row is not None else None
+
+    def record(self, st: os.stat_result, digest: str):
+        """
+        Stores the digest of a file hashed elsewhere (e.g. while it was copied), safe to call from worker threads
+        :param st: os.stat of the file once its data and times are final
+        """
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)', self.key(st) + (digest,))
+            self._commit_if_due()
+            self.recorded_files += 1
+
+    def digests(self, paths: list) -> list:
+        """
+        :param paths: files to hash, files that are the same inode are hashed once
+        :return: list of hex digests in the order of paths, None for a file that could not be read
+        """
+        keys = []
+        for path in paths:
+            try:
+                keys.append(self.key(os.stat(path)))
+            except OSError:
+                keys.append(None)
+
+        known = {}
+        missing = {}
+        for path, key in zip(paths, keys):
+            if key is None or key in known or key in missing:
+                continue
+            with self._lock:
+                row = self._db.execute('SELECT digest FROM hashes WHERE dev = ? AND ino = ? AND size = ? '
+                                       'AND mtime_ns = ?', key).fetchone()
+            if row is not None:
+                known[key] = row[0]
+                self.cached_files += 1
+            else:
+                missing[key] = path
+
+        futures = {key: self._pool.submit(fileUtilities.hash_file, path) for key, path in missing.items()}
+        for key, future in futures.items():
+            try:
+                known[key] = future.result()
+            except OSError:
+                continue
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)', key + (known[key],))
+                self._commit_if_due()
+            self.hashed_files += 1
+            self.hashed_bytes += key[2]
+        return [known.get(key) for key in keys]
+
+    def summary(self) -> str:
+        return '{} files hashed ({} bytes), {} from cache'.format(self.hashed_files, self.hashed_bytes,
+                                                                  self.cached_files)
+
+    def close(self):
+        self._pool.shutdown()
+        with self._lock:
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,129 @@
+# Copy Engine
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import os
+import queue
+import shutil
+import threading
+
+version = '1.0'
+
+default_workers = 4
+# files of at least this size are copied by their own workers so they do not hold up the small files
+default_large_file_size = 256 * 1024 * 1024
+default_large_workers = 1
+# copies waiting per worker, the walk blocks when the queue is full so memory stays bounded
+_queue_per_worker = 256
+
+
+class CopyEngine:
+    """
+    Copies files on pools of worker threads fed through bounded queues, so the directory walk finding the
+    changes keeps going while the disk is busy copying. Large files have their own queue and workers: one huge
+    file only holds up the other large files. A job removes the destination first when it exists (it can be a
+    hard link to an older snapshot, copying over it would change that snapshot too), then runs copy_function,
+    which must keep the shutil.copy2 metadata semantics. Directories created for a copied tree are registered
+    and get the times and permissions of their source once all files are copied (copying a file into a
+    directory changes its mtime).
+    """
+
+    def __init__(self, copy_function, workers: int = default_workers, large_file_size: int = default_large_file_size,
+                 large_workers: int = default_large_workers, on_done=None):
+        """
+        :param copy_function: copy_function(src, dst) copying data and metadata, e.g. fileUtilities.copy_file
+        :param workers: threads copying files smaller than large_file_size
+        :param large_file_size: files of at least this size go to the large file workers
+        :param large_workers: threads copying large files
+        :param on_done: on_done(tag) called by the worker once the copy of a job submitted with a tag completed
+        """
+        self._copy_function = copy_function
+        self._on_done = on_done
+        self._large_file_size = large_file_size
+        self._errors = []
+        self._directories = []
+        self._lock = threading.Lock()
+        # (queue, number of workers) of the small and the large files
+        self._queues = []
+        self._threads = []
+        for count in (max(1, workers), max(1, large_workers)):
+            jobs = queue.Queue(maxsize=count * _queue_per_worker)
+            self._queues.append((jobs, count))
+            for _ in range(count):
+                thread = threading.Thread(target=self._worker, args=(jobs,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self.files = 0
+
+    def _worker(self, jobs: queue.Queue):
+        while True:
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
+                if not self._errors:
+                    self._copy(*job)
+            except BaseException as e:
+                with self._lock:
+                    self._errors.append(e)
+            finally:
+                jobs.task_done()
+
+    def _copy(self, src: str, dst: str, tag):
+        if os.path.lexists(dst):
+            os.remove(dst)
+        self._copy_function(src, dst)
+        with self._lock:
+            self.files += 1
+        if tag is not None and self._on_done is not None:
+            self._on_done(tag)
+
+    def _raise_error(self):
+        if self._errors:
+            raise self._errors[0]
+
+    def submit(self, src: str, dst: str, size: int = None, tag=None):
+        """
+        Queues a copy of src to dst, blocks while the queue is full
+        :param size: size of src if known, saves a stat
+        :param tag: passed to on_done when the copy completed
+        """
+        self._raise_error()
+        if size is None:
+            size = os.path.getsize(src)
+        self._queues[1 if size >= self._large_file_size else 0][0].put((src, dst, tag))
+
+    def add_directory(self, src: str, dst: str):
+        """
+        Registers a directory created for a copied tree, copystat(src, dst) is applied when the engine is closed
+        """
+        with self._lock:
+            self._directories.append((src, dst))
+
+    def wait(self):
+        """
+        Waits for the queued copies to finish and applies the times of the registered directories (deepest
+        first), raises the first error a copy hit
+        """
+        for jobs, _ in self._queues:
+            jobs.join()
+        self._raise_error()
+        with self._lock:
+            directories = self._directories
+            self._directories = []
+        for src, dst in sorted(directories, key=lambda d: d[1].count(os.sep), reverse=True):
+            shutil.copystat(src, dst)
+
+    def close(self):
+        """
+        Waits for the queued copies (see wait) and stops the workers
+        """
+        try:
+            self.wait()
+        finally:
+            for jobs, count in self._queues:
+                for _ in range(count):
+                    jobs.put(None)
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,267 @@
+# Deletion Engine
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import os
+import queue
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import fileUtilities
+
+version = '1.0'
+
+default_workers = 8
+
+# jobs of the workers
+_SCAN = 0
+_RMDIR = 1
+
+
+class DeletionEngine:
+    """
+    Deletes directory trees on a pool of worker threads. Each worker takes a directory, lists it with os.scandir,
+    unlinks its files and queues its subdirectories, so the unlinks of a snapshot with millions of hard links are
+    spread over the pool instead of issued one after another. The directories are removed once they are empty,
+    deepest first. Read-only files and directories are handled like shutil.rmtree with
+    fileUtilities.remove_readonly.
+
+    remove queues the tree and returns, the trees queued are deleted one after another by a dispatcher thread while
+    the caller goes on. wait is the barrier: it returns once every tree queued is gone and raises the first error
+    hit. A path queued must not be used again before wait returned.
+
+    With a trash directory, remove only renames the tree into the trash (one rename on the same file system) and
+    close starts a detached process reclaiming the trash, the caller returns right away. A trash that was not
+    reclaimed (the machine went down) is emptied by the next reclaim.
+    """
+
+    def __init__(self, workers: int = default_workers, trash: str = None):
+        """
+        :param workers: threads unlinking files
+        :param trash: directory trees are moved into, see trash_dir, None deletes them in place
+        """
+        self._trash = trash
+        self._errors = []
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        # trees queued by remove, deleted one at a time by the dispatcher with remove_tree
+        self._trees = queue.Queue()
+        self._directories = []
+        self._threads = []
+        for _ in range(max(1, workers)):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+        self.files = 0
+        self.directories = 0
+        self.trashed = 0
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                if not self._errors:
+                    if job[0] == _SCAN:
+                        self._scan(job[1])
+                    else:
+                        _remove(os.rmdir, job[1])
+            except BaseException as e:
+                with self._lock:
+                    self._errors.append(e)
+            finally:
+                self._jobs.task_done()
+
+    def _dispatch(self):
+        while True:
+            path = self._trees.get()
+            try:
+                if path is None:
+                    return
+                if not self._errors:
+                    self.remove_tree(path)
+            except BaseException as e:
+                with self._lock:
+                    self._errors.append(e)
+            finally:
+                self._trees.task_done()
+
+    def _scan(self, path: str):
+        files = 0
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        with self._lock:
+                            self._directories.append(entry.path)
+                        self._jobs.put((_SCAN, entry.path))
+                    else:
+                        _remove(os.unlink, entry.path)
+                        files += 1
+        except FileNotFoundError:
+            # removed by someone else (e.g. two reclaims of the same trash)
+            pass
+        with self._lock:
+            self.files += files
+
+    def _raise_error(self):
+        if self._errors:
+            error = self._errors[0]
+            self._errors = []
+            raise error
+
+    def remove_tree(self, path: str):
+        """
+        Deletes a directory and everything below it on the workers, returns once it is gone
+        """
+        self._raise_error()
+        if os.path.islink(path):
+            # never follow a link to a directory, only the link goes
+            os.unlink(path)
+            self.files += 1
+            return
+        with self._lock:
+            self._directories = [path]
+        self._jobs.put((_SCAN, path))
+        self._jobs.join()
+        self._raise_error()
+
+        # every directory is empty now, each depth is removed once the one below it is gone
+        levels = {}
+        for directory in self._directories:
+            levels.setdefault(directory.count(os.sep), []).append(directory)
+        for depth in sorted(levels, reverse=True):
+            for directory in levels[depth]:
+                self._jobs.put((_RMDIR, directory))
+            self._jobs.join()
+            self._raise_error()
+        self.directories += len(self._directories)
+        self._directories = []
+
+    def remove(self, path: str):
+        """
+        Removes a directory tree, moved into the trash when the engine has one, queued for deletion otherwise (see
+        wait)
+        """
+        if self._trash is None:
+            self._raise_error()
+            self._trees.put(path)
+            return
+        os.makedirs(self._trash, exist_ok=True)
+        os.rename(path, os.path.join(self._trash, '{}-{}-{}'.format(os.path.basename(os.path.normpath(path)),
+                                                                       time.time_ns(), os.getpid())))
+        self.trashed += 1
+
+    def wait(self):
+        """
+        Returns once every tree queued by remove is deleted, the first error hit is raised
+        """
+        self._trees.join()
+        self._raise_error()
+
+    def summary(self) -> str:
+        if self._trash is not None:
+            return '{} directories moved to the trash'.format(self.trashed)
+        return '{} files, {} directories deleted'.format(self.files, self.directories)
+
+    def close(self):
+        """
+        Deletes the trees still queued and stops the workers, the trash is reclaimed in the background if anything
+        was moved into it
+        """
+        self._trees.put(None)
+        self._dispatcher.join()
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.trashed:
+            reclaim_in_background(self._trash)
+
+
+def _remove(func, path: str):
+    try:
+        func(path)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        # a read-only file on windows, an entry of a read-only directory (snapshots keep the permissions of the
+        # source) elsewhere
+        parent = os.path.dirname(path)
+        os.chmod(parent, os.stat(parent).st_mode | stat.S_IWUSR | stat.S_IXUSR)
+        fileUtilities.remove_readonly(func, path, None)
+
+
+def trash_dir(storage_root: str) -> str:
+    """
+    :return: trash directory of a backup set, in its metadata directory so a rename into it never crosses file
+             systems
+    """
+    return os.path.join(fileUtilities.metadata_dir(storage_root, False), fileUtilities.trash_dir_name)
+
+
+def reclaim(trash: str, workers: int = default_workers, verbose: bool = False) -> DeletionEngine:
+    """
+    Deletes everything in a trash directory
+    :return: the engine used, for its counts
+    """
+    engine = DeletionEngine(workers)
+    try:
+        if os.path.isdir(trash):
+            for name in os.listdir(trash):
+                path = os.path.join(trash, name)
+                if verbose:
+                    print(f'Deleting {path}')
+                if os.path.isdir(path) and not os.path.islink(path):
+                    engine.remove_tree(path)
+                else:
+                    _remove(os.unlink, path)
+    finally:
+        engine.close()
+    return engine
+
+
+def reclaim_in_background(trash: str):
+    """
+    Starts a process reclaiming a trash directory that keeps running after this one exits. A frozen executable
+    cannot start this script, the trash is reclaimed before returning instead.
+    """
+    if getattr(sys, 'frozen', False):
+        reclaim(trash)
+        return
+    if os.name == 'nt':
+        options = {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        options = {'start_new_session': True}
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), os.path.dirname(os.path.dirname(trash))],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     close_fds=True, **options)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="deletionEngine.py\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Deletes the snapshots moved to the trash of a backup set by "
+                                                 "incrementalBackup.py --trash\n\tor purgeDuplicateBackups.py "
+                                                 "--trash.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('root', type=str, help='root backup directory')
+    parser.add_argument('-w', '--workers', type=int, default=default_workers,
+                        help='Threads unlinking files (default {}).'.format(default_workers))
+    parser.add_argument('-v', '--verbose', action='store_true', help='List the trees deleted.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = init_args()
+    engine = reclaim(trash_dir(os.path.abspath(args.root)), args.workers, args.verbose)
+    print(f'[ Reclaimed ] : [ {engine.summary()} ]')
@@ -0,0 +1,474 @@
+# Delta Storage
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import fileUtilities
+import operationJournal
+
+try:
+    import numpy
+except ImportError:
+    # files are cut into fixed size blocks
+    numpy = None
+
+version = '1.0'
+
+# first line of a file stored as a list of blocks, the rest of the file is the json recipe
+recipe_magic = b'#incrementalBackup-delta 1\n'
+chunks_dir_name = 'chunks'
+# list of the files of a snapshot stored as blocks, a sidecar renamed and removed with the snapshot
+recipe_index_suffix = '.recipes'
+recipe_index_version = 1
+
+default_block_size = 4 * 1024 * 1024
+
+CDC = 'cdc'
+FIXED = 'fixed'
+chunking_methods = [CDC, FIXED] if numpy is not None else [FIXED]
+
+# recipes are small, anything larger is not read when scanning a snapshot for them
+_max_recipe_size = 64 * 1024 * 1024
+
+# bytes covered by the rolling hash of content defined chunking, and the random value each byte adds to it
+_cdc_window = 48
+_gear = numpy.random.default_rng(0x6765617220636463).integers(0, 1 << 31, 256, numpy.int64) \
+    if numpy is not None else None
+
+
+def cdc_cuts(data, min_size: int, mask: int, max_size: int, final: bool) -> list:
+    """
+    Content defined chunk boundaries of data, which starts at a chunk boundary. The rolling hash of a position is
+    the sum of the gear values of the last _cdc_window bytes, one cumulative sum for the whole buffer, and a chunk
+    ends after the first byte past min_size whose hash has none of the mask bits set (or at max_size). A boundary
+    only depends on the bytes before it in its chunk, so an insertion only moves the boundaries up to the next one
+    found again and the blocks after it are the same as before.
+    :param data: bytes, or a buffer
+    :param final: data ends the file, the rest after the last boundary is the last chunk
+    :return: end offsets of the chunks, data after the last one needs more data to be cut
+    """
+    values = _gear[numpy.frombuffer(data, numpy.uint8)]
+    sums = numpy.cumsum(values)
+    hashes = sums.copy()
+    hashes[_cdc_window:] -= sums[:-_cdc_window]
+    candidates = numpy.nonzero((hashes & mask) == 0)[0] + 1
+    cuts = []
+    start = 0
+    while True:
+        found = int(numpy.searchsorted(candidates, start + min_size))
+        cut = int(candidates[found]) if found < len(candidates) else start + max_size
+        cut = min(cut, start + max_size)
+        if cut > len(data):
+            break
+        cuts.append(cut)
+        start = cut
+    if final and start < len(data):
+        cuts.append(len(data))
+    return cuts
+
+
+class ChunkStore:
+    """
+    Content addressed store of file blocks in the metadata directory of a backup set. Large files are split into
+    blocks and stored as a recipe (the list of block hashes) in the snapshot, a block is only written when it is
+    not already stored, so a file with a few changed blocks costs only those blocks in a new snapshot.
+    Blocks are content defined (see cdc_cuts) so data inserted or removed in a file (a database dump) only changes
+    the blocks around it, with block_size as their average size. Fixed blocks (FIXED, and without numpy) suit files
+    changed in place (VM disks) and hash at hashlib speed.
+    """
+
+    def __init__(self, storage_root: str, threshold: int, block_size: int = default_block_size, latest: str = None,
+                 chunking: str = None, on_store=None):
+        """
+        :param latest: snapshot directory the recipes are written to, the files stored are listed in recipes
+        :param chunking: CDC or FIXED, CDC when numpy is available if not given
+        :param on_store: called with the path relative to latest and the size of every file stored
+        """
+        self._path = os.path.join(fileUtilities.metadata_dir(storage_root), chunks_dir_name)
+        os.makedirs(self._path, exist_ok=True)
+        self._threshold = threshold
+        self._block_size = block_size
+        self._latest = os.path.abspath(latest) if latest is not None else None
+        self._chunking = chunking or chunking_methods[0]
+        if self._chunking not in chunking_methods:
+            raise Exception(f'Unknown chunking {self._chunking}, one of {chunking_methods}')
+        self._on_store = on_store
+        self._lock = threading.Lock()
+        # relative path in latest -> size of the files stored by this run
+        self.recipes = {}
+        self.files = 0
+        self.bytes_stored = 0
+        self.bytes_reused = 0
+
+    def handles(self, src: str) -> bool:
+        """
+        :return: True if src is large enough to be stored as blocks
+        """
+        return os.path.getsize(src) >= self._threshold
+
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self._path, digest[:2], digest)
+
+    def put(self, data) -> str:
+        """
+        :param data: bytes of one block
+        :return: digest of the block, the block is written if it is not stored yet
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            with self._lock:
+                self.bytes_reused += len(data)
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.bytes_stored += len(data)
+        return digest
+
+    def store_file(self, src: str, dst: str) -> str:
+        """
+        Stores src as blocks and writes its recipe to dst, the recipe gets the permissions and times of src
+        :param src: file to store
+        :param dst: recipe to create, must not exist
+        :return: dst
+        """
+        if self._chunking == CDC:
+            blocks, size = self._store_cdc(src)
+        else:
+            blocks, size = self._store_fixed(src)
+
+        recipe = {'size': size, 'block_size': self._block_size, 'chunking': self._chunking, 'blocks': blocks}
+        with open(dst, 'wb') as f:
+            f.write(recipe_magic)
+            f.write(json.dumps(recipe).encode('ascii'))
+        shutil.copystat(src, dst)
+        rel = os.path.relpath(os.path.abspath(dst), self._latest) if self._latest is not None else None
+        with self._lock:
+            self.files += 1
+            if rel is not None:
+                self.recipes[rel] = size
+        if self._on_store is not None and rel is not None:
+            self._on_store(rel, size)
+        return dst
+
+    def _store_fixed(self, src: str):
+        blocks = []
+        buffer = bytearray(self._block_size)
+        view = memoryview(buffer)
+        size = 0
+        with open(src, 'rb', buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                # short reads are kept as they are, restoring only concatenates the blocks
+                blocks.append(self.put(view[:n]))
+                size += n
+        return blocks, size
+
+    def _store_cdc(self, src: str):
+        min_size = max(self._block_size // 4, _cdc_window)
+        max_size = self._block_size * 4
+        # about one boundary every block_size - min_size bytes past the minimum
+        mask = (1 << max((self._block_size - min_size).bit_length() - 1, 0)) - 1
+        blocks = []
+        size = 0
+        pending = b''
+        with open(src, 'rb') as f:
+            while True:
+                data = f.read(2 * max_size)
+                data = pending + data if pending else data
+                final = len(data) == len(pending)
+                start = 0
+                view = memoryview(data)
+                for cut in cdc_cuts(data, min_size, mask, max_size, final):
+                    blocks.append(self.put(view[start:cut]))
+                    start = cut
+                size += start
+                pending = data[start:]
+                if final:
+                    break
+        return blocks, size
+
+    def summary(self) -> str:
+        return '{} files, {} bytes stored, {} bytes reused'.format(self.files, self.bytes_stored, self.bytes_reused)
+
+
+def has_recipe_header(path: str) -> bool:
+    """
+    Only used to find the recipes of a snapshot written without a recipe index (see scan_recipes), the index of
+    a snapshot is what says which of its files are recipes: a file of the source can start with the same bytes
+    :return: True if path starts like a recipe written by ChunkStore.store_file
+    """
+    try:
+        if os.path.getsize(path) > _max_recipe_size:
+            return False
+        with open(path, 'rb') as f:
+            return f.read(len(recipe_magic)) == recipe_magic
+    except OSError:
+        return False
+
+
+def read_recipe(path: str) -> dict:
+    with open(path, 'rb') as f:
+        if f.read(len(recipe_magic)) != recipe_magic:
+            raise Exception(f'{path} is not a file stored as blocks')
+        return json.loads(f.read().decode('ascii'))
+
+
+def has_block_store(storage_root: str) -> bool:
+    return os.path.isdir(os.path.join(storage_root, fileUtilities.metadata_dir_name, chunks_dir_name))
+
+
+def recipe_index_path(snapshot: str) -> str:
+    """
+    :return: recipe index of a snapshot (directory or virtual snapshot), a sidecar renamed and removed with it
+    """
+    return os.path.normpath(snapshot) + recipe_index_suffix
+
+
+def read_recipe_index(snapshot: str):
+    """
+    :return: dict of relative path -> size of the files of snapshot stored as blocks, None if it has no index
+    """
+    path = recipe_index_path(snapshot)
+    if not os.path.isfile(path):
+        return None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('version') != recipe_index_version:
+        raise Exception(f'Unknown recipe index version in {path}')
+    return index['recipes']
+
+
+def write_recipe_index(snapshot: str, recipes: dict):
+    """
+    Writes the recipe index of a snapshot atomically (temporary file then rename)
+    :param recipes: dict of relative path -> size (of the file the recipe restores)
+    """
+    path = recipe_index_path(snapshot)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        json.dump({'version': recipe_index_version, 'recipes': recipes}, f)
+    os.replace(tmp_path, path)
+
+
+def scan_recipes(snapshot_dir: str) -> dict:
+    """
+    Finds the recipes of a snapshot directory by opening every file small enough to be one
+    :return: dict of relative path -> size, see read_recipe_index
+    """
+    recipes = {}
+    for dirpath, _, filenames in os.walk(snapshot_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if has_recipe_header(path):
+                recipes[os.path.relpath(path, snapshot_dir)] = read_recipe(path)['size']
+    return recipes
+
+
+def snapshot_recipes(snapshot_dir: str, save: bool = True) -> dict:
+    """
+    :param snapshot_dir: snapshot directory
+    :param save: save the index of a snapshot that had to be scanned
+    :return: dict of relative path -> size of the files stored as blocks, from the recipe index of the snapshot.
+             A snapshot made before the indexes were written is scanned once and its index saved, a backup set
+             without a block store has no recipes.
+    """
+    recipes = read_recipe_index(snapshot_dir)
+    if recipes is not None:
+        return recipes
+    if not has_block_store(os.path.dirname(os.path.abspath(snapshot_dir))):
+        return {}
+    recipes = scan_recipes(snapshot_dir)
+    if save:
+        write_recipe_index(snapshot_dir, recipes)
+    return recipes
+
+
+def find_storage_root(path: str) -> str:
+    """
+    :param path: a path inside a backup set
+    :return: the root of the backup set (the directory holding the metadata directory)
+    """
+    curr = os.path.dirname(os.path.abspath(path))
+    while True:
+        if os.path.isdir(os.path.join(curr, fileUtilities.metadata_dir_name, chunks_dir_name)):
+            return curr
+        parent = os.path.dirname(curr)
+        if parent == curr:
+            raise Exception(f'No block store found above {path}')
+        curr = parent
+
+
+def restore_file(recipe_path: str, out_path: str, storage_root: str = None) -> str:
+    """
+    Reassembles a file stored as blocks, the output gets the permissions and times of the recipe
+    :param recipe_path: recipe written by ChunkStore.store_file
+    :param out_path: file to write
+    :param storage_root: root of the backup set, found from recipe_path if not given
+    :return: out_path
+    """
+    if storage_root is None:
+        storage_root = find_storage_root(recipe_path)
+    recipe = read_recipe(recipe_path)
+    with open(out_path, 'wb') as out:
+        for block in _block_paths(recipe, storage_root):
+            with open(block, 'rb') as chunk:
+                shutil.copyfileobj(chunk, out, recipe['block_size'])
+        if out.tell() != recipe['size']:
+            raise Exception(f'Restored {out.tell()} bytes of {recipe_path}, expected {recipe["size"]}')
+    shutil.copystat(recipe_path, out_path)
+    return out_path
+
+
+def _block_paths(recipe: dict, storage_root: str) -> list:
+    chunks = os.path.join(storage_root, fileUtilities.metadata_dir_name, chunks_dir_name)
+    return [os.path.join(chunks, digest[:2], digest) for digest in recipe['blocks']]
+
+
+def hash_logical(path: str, storage_root: str = None, recipe: bool = False,
+                 algorithm: str = fileUtilities.hash_algorithm) -> str:
+    """
+    :param recipe: path is a recipe (listed in the recipe index of its snapshot)
+    :return: hex digest of the contents of path, of the file it restores to if it is a recipe
+    """
+    if not recipe:
+        return fileUtilities.hash_file(path, algorithm)
+    if storage_root is None:
+        storage_root = find_storage_root(path)
+    h = hashlib.new(algorithm)
+    buffer = bytearray(fileUtilities.hash_buffer_size)
+    view = memoryview(buffer)
+    for block in _block_paths(read_recipe(path), storage_root):
+        with open(block, 'rb', buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                h.update(view[:n])
+    return h.hexdigest()
+
+
+def same_contents(path_a: str, path_b: str, storage_root: str, is_recipe_a: bool = False,
+                  is_recipe_b: bool = False) -> bool:
+    """
+    Compares two files of a backup set by the contents they restore to, either can be a recipe. Recipes cut the
+    same way are equal exactly when their block lists are, nothing else is read.
+    :param is_recipe_a: path_a is a recipe (listed in the recipe index of its snapshot), the same for is_recipe_b
+    """
+    recipe_a = read_recipe(path_a) if is_recipe_a else None
+    recipe_b = read_recipe(path_b) if is_recipe_b else None
+    size_a = recipe_a['size'] if recipe_a is not None else os.path.getsize(path_a)
+    size_b = recipe_b['size'] if recipe_b is not None else os.path.getsize(path_b)
+    if size_a != size_b:
+        return False
+    if recipe_a is not None and recipe_b is not None:
+        if recipe_a['blocks'] == recipe_b['blocks']:
+            return True
+        if (recipe_a['block_size'], recipe_a.get('chunking', FIXED)) == \
+                (recipe_b['block_size'], recipe_b.get('chunking', FIXED)):
+            return False
+    return hash_logical(path_a, storage_root, is_recipe_a) == hash_logical(path_b, storage_root, is_recipe_b)
+
+
+def restore_tree(snapshot_dir: str, output: str) -> str:
+    """
+    Copies a snapshot directory, the files its recipe index lists are reassembled
+    :param output: directory to create
+    :return: output
+    """
+    snapshot_dir = os.path.abspath(snapshot_dir)
+    recipes = snapshot_recipes(snapshot_dir)
+    storage_root = os.path.dirname(snapshot_dir)
+
+    def copy_restoring(src, dst):
+        if os.path.relpath(src, snapshot_dir) in recipes:
+            return restore_file(src, dst, storage_root)
+        return shutil.copy2(src, dst)
+    return shutil.copytree(snapshot_dir, output, copy_function=copy_restoring)
+
+
+def collect_garbage(storage_root: str, verbose: bool = False) -> int:
+    """
+    Removes the blocks no recipe in the backup set refers to any more (e.g. after snapshots were purged). The
+    recipes are found from the recipe index of each snapshot, only they are read. The index of a snapshot an
+    interrupted run was writing to misses what that run stored, nothing is removed until the run is finished.
+    :return: number of blocks removed
+    """
+    # virtualSnapshot uses this module to restore files
+    import virtualSnapshot
+
+    root = os.path.abspath(storage_root)
+    chunks = os.path.join(root, fileUtilities.metadata_dir_name, chunks_dir_name)
+    used = set()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name == fileUtilities.metadata_dir_name:
+            continue
+        if os.path.isfile(operationJournal.journal_path(root, path, False)):
+            raise Exception(f'A run into {path} was interrupted, run incrementalBackup.py again to finish it before '
+                            f'removing blocks.')
+        if os.path.isdir(path):
+            paths = [os.path.join(path, rel) for rel in snapshot_recipes(path)]
+        elif virtualSnapshot.is_virtual_snapshot(path):
+            paths = virtualSnapshot.recipe_paths(path)
+        else:
+            continue
+        for recipe_path in paths:
+            used.update(read_recipe(recipe_path)['blocks'])
+
+    removed = 0
+    for dirpath, _, filenames in os.walk(chunks):
+        for name in filenames:
+            if name not in used:
+                os.remove(os.path.join(dirpath, name))
+                removed += 1
+                if verbose:
+                    print(f'Removed block {name}')
+    return removed
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="deltaStorage.py\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Restores files that incrementalBackup.py --delta_threshold stored as "
+                                                 "blocks, or removes blocks no longer used.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    restore = subparsers.add_parser('restore', help='Reassemble a file (or every file of a directory) stored as '
+                                                    'blocks.')
+    restore.add_argument('path', type=str, help='recipe file or snapshot directory')
+    restore.add_argument('output', type=str, help='file or directory to create')
+
+    gc = subparsers.add_parser('gc', help='Remove blocks not used by any snapshot.')
+    gc.add_argument('root', type=str, help='root backup directory')
+    gc.add_argument('-v', '--verbose', action='store_true', help='List the blocks removed.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = init_args()
+    if args.command == 'restore':
+        if os.path.isdir(args.path):
+            restore_tree(args.path, args.output)
+        else:
+            restore_file(args.path, args.output)
+        print(f'[ Restored ] : [ {args.path} -> {args.output} ]')
+    else:
+        print(f'[ Removed ] : [ {collect_garbage(args.root, args.verbose)} blocks ]')
@@ -0,0 +1,319 @@
+# File Utilities
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+
+# copy methods in the order they are tried, choosing one starts the chain at that method, copy2 is the plain
+# shutil.copy2 every other method falls back to
+copy_methods = ['reflink', 'copy_file_range', 'sendfile', 'copy2']
+default_copy_method = 'reflink'
+
+# linux ioctl to share the extents of one file with another (btrfs, xfs with reflink=1, ...)
+FICLONE = 0x40049409
+
+# errors meaning a method is not supported for this pair of files, anything else is a real failure
+_unsupported_errors = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+                       errno.ENOTSUP, errno.EPERM}
+
+_chunk_size = 64 * 1024 * 1024
+
+
+class CopyStats:
+    """
+    Counts the files copied by copy_file and how many of their bytes were cloned (shared with the source by the
+    file system) versus physically copied, safe to share between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.bytes_cloned = 0
+        self.bytes_copied = 0
+
+    def add(self, bytes_cloned: int = 0, bytes_copied: int = 0):
+        with self._lock:
+            self.files += 1
+            self.bytes_cloned += bytes_cloned
+            self.bytes_copied += bytes_copied
+
+    def summary(self) -> str:
+        return '{} files, {} bytes cloned, {} bytes copied'.format(self.files, self.bytes_cloned, self.bytes_copied)
+
+
+class Throttle:
+    """
+    Caps the bytes per second and the operations per second of the copies sharing it (a token bucket per limit
+    allowing a burst of burst seconds), safe to share between threads. Each file and each buffer copied counts as
+    one operation.
+    """
+
+    def __init__(self, bytes_per_second: int = None, ops_per_second: int = None, burst: float = 0.5):
+        self._lock = threading.Lock()
+        self._bytes_per_second = bytes_per_second
+        self._ops_per_second = ops_per_second
+        self._burst = burst
+        # time each bucket is empty at, a request waits until that time is at most burst seconds away
+        self._bytes_time = 0.0
+        self._ops_time = 0.0
+
+    def consume(self, nbytes: int = 0, ops: int = 1):
+        delay = 0.0
+        with self._lock:
+            now = time.monotonic()
+            if self._bytes_per_second and nbytes:
+                self._bytes_time = max(self._bytes_time, now) + nbytes / self._bytes_per_second
+                delay = max(delay, self._bytes_time - now - self._burst)
+            if self._ops_per_second and ops:
+                self._ops_time = max(self._ops_time, now) + ops / self._ops_per_second
+                delay = max(delay, self._ops_time - now - self._burst)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _data_segments(fd: int, size: int):
+    """
+    Yields (offset, length) of the data in fd skipping holes, a file that is not sparse (or a platform without
+    SEEK_DATA) is a single segment
+    """
+    if not hasattr(os, 'SEEK_DATA') or os.fstat(fd).st_blocks * 512 >= size:
+        if size > 0:
+            yield 0, size
+        return
+
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # only a hole remains
+                return
+            raise
+        hole = os.lseek(fd, data, os.SEEK_HOLE)
+        yield data, hole - data
+        offset = hole
+
+
+def _reflink(fsrc: int, fdst: int, size: int, chunk: int = _chunk_size, throttle: Throttle = None) -> int:
+    fcntl.ioctl(fdst, FICLONE, fsrc)
+    return size
+
+
+def _copy_file_range(fsrc: int, fdst: int, size: int, chunk: int = _chunk_size, throttle: Throttle = None) -> int:
+    copied = 0
+    for offset, length in _data_segments(fsrc, size):
+        end = offset + length
+        while offset < end:
+            if throttle is not None:
+                throttle.consume(min(end - offset, chunk))
+            sent = os.copy_file_range(fsrc, fdst, min(end - offset, chunk), offset, offset)
+            if sent == 0:
+                break
+            offset += sent
+            copied += sent
+    os.ftruncate(fdst, size)
+    return copied
+
+
+def _sendfile(fsrc: int, fdst: int, size: int, chunk: int = _chunk_size, throttle: Throttle = None) -> int:
+    copied = 0
+    for offset, length in _data_segments(fsrc, size):
+        os.lseek(fdst, offset, os.SEEK_SET)
+        end = offset + length
+        while offset < end:
+            if throttle is not None:
+                throttle.consume(min(end - offset, chunk))
+            sent = os.sendfile(fdst, fsrc, offset, min(end - offset, chunk))
+            if sent == 0:
+                break
+            offset += sent
+            copied += sent
+    os.ftruncate(fdst, size)
+    return copied
+
+
+def _read_write(src: str, dst: str, chunk: int, throttle: Throttle = None, hasher=None) -> int:
+    """
+    Plain buffered copy of the data of src (what shutil.copyfile does) with a chosen buffer size and throttle
+    :param hasher: hashlib object updated with the data copied
+    """
+    copied = 0
+    buffer = bytearray(chunk)
+    view = memoryview(buffer)
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb', buffering=0) as fdst:
+        while True:
+            if throttle is not None:
+                throttle.consume(chunk)
+            n = fsrc.readinto(buffer)
+            if not n:
+                break
+            fdst.write(view[:n])
+            if hasher is not None:
+                hasher.update(view[:n])
+            copied += n
+    return copied
+
+
+def _method_available(method: str) -> bool:
+    if method == 'reflink':
+        return fcntl is not None and os.name == 'posix' and os.uname().sysname == 'Linux'
+    if method == 'copy_file_range':
+        return hasattr(os, 'copy_file_range')
+    if method == 'sendfile':
+        return hasattr(os, 'sendfile') and os.name == 'posix'
+    return False
+
+
+def _fast_copy(src: str, dst: str, method: str, stats: CopyStats, chunk: int = _chunk_size,
+               throttle: Throttle = None):
+    """
+    Tries the methods of the chain starting at method, the file data of dst is restarted after each failed method
+    :return: True if one of the methods copied the data
+    """
+    methods = [m for m in copy_methods[copy_methods.index(method):-1] if _method_available(m)]
+    if not methods:
+        return False
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for m in methods:
+            try:
+                if m == 'reflink':
+                    stats.add(bytes_cloned=_reflink(fsrc.fileno(), fdst.fileno(), size, chunk, throttle))
+                elif m == 'copy_file_range':
+                    stats.add(bytes_copied=_copy_file_range(fsrc.fileno(), fdst.fileno(), size, chunk, throttle))
+                else:
+                    stats.add(bytes_copied=_sendfile(fsrc.fileno(), fdst.fileno(), size, chunk, throttle))
+                return True
+            except OSError as e:
+                if e.errno not in _unsupported_errors:
+                    raise
+                os.ftruncate(fdst.fileno(), 0)
+                os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+    return False
+
+
+def copy_file(src: str, dst: str, method: str = default_copy_method, stats: CopyStats = None,
+              buffer_size: int = None, throttle: Throttle = None, hasher=None) -> str:
+    """
+    Drop in replacement for shutil.copy2 (data, permission bits, times and flags of src are copied to dst) that
+    tries a reflink first, then copy_file_range, then sendfile and finally shutil.copy2. Holes in sparse files are
+    kept by copy_file_range and sendfile.
+    The caller must remove dst first if it can be a hard link, like shutil.copy2 the data is written through it.
+    :param src: file to copy
+    :param dst: file to create
+    :param method: one of copy_methods, the first method tried
+    :param stats: CopyStats updated with the bytes cloned or copied
+    :param buffer_size: bytes copied per call, the shutil defaults if not given
+    :param throttle: Throttle the file and each buffer copied are counted against
+    :param hasher: hashlib object updated with the data of src, the data is then copied through a buffer (the
+                   kernel copy methods never show it) so it is read once for the copy and the hash
+    :return: dst
+    """
+    if stats is None:
+        stats = CopyStats()
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if throttle is not None:
+        throttle.consume()
+
+    if hasher is not None:
+        stats.add(bytes_copied=_read_write(src, dst, buffer_size or hash_buffer_size, throttle, hasher))
+        shutil.copystat(src, dst)
+        return dst
+
+    if method != 'copy2' and _fast_copy(src, dst, method, stats, buffer_size or _chunk_size, throttle):
+        shutil.copystat(src, dst)
+        return dst
+
+    if buffer_size is None and throttle is None:
+        shutil.copy2(src, dst)
+        stats.add(bytes_copied=os.stat(dst).st_size)
+        return dst
+
+    # same as shutil.copy2, data then permission bits, times and flags
+    stats.add(bytes_copied=_read_write(src, dst, buffer_size or shutil.COPY_BUFSIZE, throttle))
+    shutil.copystat(src, dst)
+    return dst
+
+
+hash_algorithm = 'sha256'
+hash_buffer_size = 1024 * 1024
+
+
+def hash_file(path: str, algorithm: str = hash_algorithm, throttle: Throttle = None) -> str:
+    """
+    :param path: file to hash
+    :param algorithm: hashlib algorithm name
+    :param throttle: Throttle each buffer read is counted against
+    :return: hex digest of the contents of path
+    """
+    h = hashlib.new(algorithm)
+    buffer = bytearray(hash_buffer_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            if throttle is not None:
+                throttle.consume(n)
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+# directory in the root of a backup set (next to LATEST and the snapshots) holding the state shared by all
+# snapshots, it is skipped when the snapshots are listed
+metadata_dir_name = '.backupMeta'
+# versions of files kept for virtual snapshots, see virtualSnapshot.ObjectStore
+objects_dir_name = 'objects'
+# snapshots waiting to be deleted in the background, see deletionEngine.DeletionEngine
+trash_dir_name = 'trash'
+
+
+def metadata_dir(storage_root: str, create: bool = True) -> str:
+    """
+    :param storage_root: directory holding LATEST and the snapshots
+    :param create: create the directory if it does not exist
+    :return: path of the metadata directory of the backup set
+    """
+    path = os.path.join(storage_root, metadata_dir_name)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def remove_readonly(func, path, _):
+    "Clear readonly bit when deleting files to avoid WinError 5 that occurs when deleting files that are readonly"
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+
+_size_units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(text: str) -> int:
+    """
+    :param text: a size in bytes with an optional K, M, G or T suffix (powers of 1024), e.g. 512K or 40G
+    :return: the size in bytes
+    """
+    value = text.strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in _size_units and not value[-1:].isdigit() else ''
+    try:
+        return int(float(value[:len(value) - len(unit)]) * _size_units[unit])
+    except ValueError:
+        raise ValueError(f'Invalid size [{text}], expected a number with an optional K, M, G or T suffix')
@@ -5,11 +5,29 @@
 
 import argparse
 import copy
+import hashlib
 import os
 import filecmp
 import shutil
-import fnmatch
+import re
+import stat
 import sys
+import threading
+import time
+import queue
+
+import backupManifest
+import changeJournal
+import contentStore
+import copyEngine
+import deletionEngine
+import deltaStorage
+import fileUtilities
+import operationJournal
+import packStore
+import runReport
+import snapshotCatalog
+import virtualSnapshot
 
 from datetime import datetime, timezone
 #from distutils.dir_util import copy_tree
@@ -45,18 +63,148 @@ def init_args():
     parser.add_argument('-s','--use_symbolic_links', action='store_true', help='If set will use symbolic links, default is to use hard links.')
 
     parser.add_argument('-o','--omit_list',type=str,help='List of directory/file names to exclude, can use patterns,\n'
-                                                '(e.g  -o test,logs,*.exe)')
+                                                '(e.g  -o test,logs,*.exe). A pattern with a / is matched against the path\n'
+                                                'relative to SOURCE (e.g. /logs, build/**), a trailing / matches directories only\n'
+                                                'and a leading ! includes again what an earlier pattern excluded.')
+    parser.add_argument('--ignore_file', type=str, help='File of patterns to exclude (same syntax as -o, one per line, # for '
+                                                        'comments), applied after -o.')
+
+    parser.add_argument('-w', '--workers', type=int, default=default_workers,
+                        help='Number of worker threads used to create the links of LATEST (default {}).'.format(default_workers))
+
+    parser.add_argument('-c', '--copy_method', type=str, default=fileUtilities.default_copy_method,
+                        choices=fileUtilities.copy_methods,
+                        help='First method tried when copying new or changed files, each falls back to the next:\n'
+                             'reflink (shares the data on btrfs/xfs), copy_file_range, sendfile, copy2 (default {}).'
+                             ''.format(fileUtilities.default_copy_method))
+
+    parser.add_argument('-d', '--dedup', action='store_true',
+                        help='Keep an index of the file contents stored in the backup set, a new file whose contents\n'
+                             'are already stored (e.g. a renamed or moved file) is hard linked instead of copied.')
+    parser.add_argument('--dedup_min_size', type=int, default=contentStore.default_min_size,
+                        help='Smallest file (bytes) looked up in the dedup index (default {}).'
+                             ''.format(contentStore.default_min_size))
+    parser.add_argument('--checksums', action='store_true',
+                        help='Record a checksum of every file copied in .backupMeta/hash_cache.db, computed from the\n'
+                             'data as it is copied (the kernel copy methods are not used), scrubBackups.py verifies\n'
+                             'the backup set against them.')
+
+    parser.add_argument('--delta_threshold', type=fileUtilities.parse_size,
+                        help='Files of at least this size (e.g. 1G) are stored as a list of blocks in a shared block\n'
+                             'store, a changed file only adds the blocks that changed. Restore them with deltaStorage.py.')
+    parser.add_argument('--delta_block_size', type=fileUtilities.parse_size, default=deltaStorage.default_block_size,
+                        help='Block size used with --delta_threshold, the average size with content defined blocks\n'
+                             '(default 4M).')
+    parser.add_argument('--delta_chunking', choices=deltaStorage.chunking_methods,
+                        default=deltaStorage.chunking_methods[0],
+                        help='How files are cut into blocks with --delta_threshold: cdc (content defined, data\n'
+                             'inserted into a file such as a database dump only changes the blocks around it, needs\n'
+                             'numpy) or fixed (for files changed in place, e.g. VM disks). Default {}.'
+                             ''.format(deltaStorage.chunking_methods[0]))
+
+    parser.add_argument('--pack_threshold', type=fileUtilities.parse_size,
+                        help='Files smaller than this (e.g. 64K) are appended to packs shared by the snapshots\n'
+                             '(.backupMeta/packs) instead of being copied into LATEST, a file that did not change is\n'
+                             'kept by reference in the index of the new snapshot. Needs the manifest, once LATEST has\n'
+                             'packed files every run packs. restoreBackup.py extracts them.')
+
+    parser.add_argument('-j', '--journal', type=str,
+                        help='Journal written by changeJournal.py watching SOURCE, only the directories it reports\n'
+                             'as changed are compared (a full scan is done if the watcher was not running or lost events).')
+
+    parser.add_argument('--no_manifest', action='store_true', help='Do not read or write the stat manifest and '
+                                                                   'digests kept next to each snapshot, every run\n'
+                                                                   'does a full comparison of SOURCE and LATEST.')
+    parser.add_argument('--catalog', action='store_true',
+                        help='Record the snapshot in the snapshot catalog of the backup set (.backupMeta/catalog.db,\n'
+                             'see snapshotCatalog.py), once the catalog exists every run updates it and --no_manifest\n'
+                             'is refused.')
+    parser.add_argument('--virtual', action='store_true',
+                        help='Keep the previous LATEST as a virtual snapshot (SOURCEDIRNAME_DATE.vsnap): only its\n'
+                             'manifest is written and LATEST is updated in place, the versions replaced or removed are\n'
+                             'kept as hard links in the backup set. Rebuild the tree with restoreBackup.py.')
+
+    parser.add_argument('--copy_workers', type=int, default=copyEngine.default_workers,
+                        help='Threads copying new and changed files while the comparison goes on, 0 copies them one\n'
+                             'after another during the comparison (default {}).'.format(copyEngine.default_workers))
+    parser.add_argument('--large_file_size', type=fileUtilities.parse_size, default=copyEngine.default_large_file_size,
+                        help='Files of at least this size are copied by their own threads so they do not hold up the\n'
+                             'small files (default 256M).')
+    parser.add_argument('--large_workers', type=int, default=copyEngine.default_large_workers,
+                        help='Threads copying large files (default {}).'.format(copyEngine.default_large_workers))
+    parser.add_argument('--buffer_size', type=fileUtilities.parse_size,
+                        help='Bytes copied per read/write or kernel copy call (e.g. 1M).')
+    parser.add_argument('--bandwidth', type=fileUtilities.parse_size,
+                        help='Limit the copies to this many bytes per second (e.g. 50M).')
+    parser.add_argument('--iops', type=int, help='Limit the copies to this many operations per second (each file and '
+                                                 'each buffer copied is one).')
+    parser.add_argument('--delete_workers', type=int, default=deletionEngine.default_workers,
+                        help='Threads deleting the directories removed from SOURCE (default {}), the comparison\n'
+                             'and the copies go on while they are deleted.'.format(deletionEngine.default_workers))
+    parser.add_argument('--trash', action='store_true', help='Move the directories removed from SOURCE to the trash of '
+                                                             'the backup set (.backupMeta/trash) and\ndelete them in a '
+                                                             'background process once the run is done.')
+
+    parser.add_argument('--report', type=str, help='Write the time of each phase and the counters of the run to this '
+                                                   'file when it ends,\nin the Prometheus text format if it ends in '
+                                                   '.prom (textfile collector), JSON otherwise.')
+    parser.add_argument('--profile', type=str, help='Profile the run with cProfile, the stats are saved to this file '
+                                                    'and the hottest functions printed.')
     return parser.parse_args()
 
 
 
 
+default_copy_method = fileUtilities.default_copy_method
+copy_stats = fileUtilities.CopyStats()
+content_index = None
+chunk_store = None
+# set when files are copied by a pool of workers, see copyEngine.CopyEngine
+copy_engine = None
+copy_buffer_size = None
+copy_throttle = None
+# write-ahead journal of the run, see operationJournal.OperationJournal
+operation_journal = None
+# set when LATEST is updated in place for a virtual snapshot, see virtualSnapshot.ObjectStore
+object_store = None
+# set when directories only found in LATEST are deleted by a pool of workers, see deletionEngine.DeletionEngine
+deletion_engine = None
+# set when the checksums of the files copied are recorded, see contentStore.HashCache.record
+checksum_cache = None
+# set when small files are packed instead of copied into LATEST, see packStore.PackStore
+pack_store = None
+# files of LATEST stored as blocks (relative path -> size of the file they restore to), kept up to date as the run
+# changes LATEST and written as its recipe index at the end, see deltaStorage.recipe_index_path
+latest_recipes = None
+
+def _copy_file_data(src, dst):
+    if checksum_cache is not None:
+        hasher = hashlib.new(fileUtilities.hash_algorithm)
+        dst = fileUtilities.copy_file(src, dst, default_copy_method, copy_stats, copy_buffer_size, copy_throttle,
+                                      hasher)
+        checksum_cache.record(os.stat(dst), hasher.hexdigest())
+        return dst
+    return fileUtilities.copy_file(src, dst, default_copy_method, copy_stats, copy_buffer_size, copy_throttle)
+
+def copy_file(src, dst):
+    if pack_store is not None and pack_store.handles(src, dst):
+        return pack_store.pack_file(src, dst)
+    if chunk_store is not None and chunk_store.handles(src):
+        return chunk_store.store_file(src, dst)
+    if content_index is not None:
+        return content_index.link_or_copy(src, dst, _copy_file_data)
+    return _copy_file_data(src, dst)
+
 def copy2_verbose(src, dst):
     print('Copying {0}'.format(src))
-    shutil.copy2(src,dst)
+    return copy_file(src,dst)
 
 default_use_symbolic = False
 
+# threads used by create_links_of_files_parallel, each link is a metadata round trip on network shares so this is
+# set higher than the core count
+default_workers = 8
+
 def make_link(src_path:str, lnk_path:str, use_symbolic = default_use_symbolic):
     if not use_symbolic:
         os.link(src_path,lnk_path)
@@ -65,233 +213,791 @@ def make_link(src_path:str, lnk_path:str, use_symbolic = default_use_symbolic):
 
 
 
-def my_copy_tree(src, dst, verbose=False, ignore_list=None):
+def my_copy_tree(src, dst, verbose=False, ignore_list=None, ignore_filter=None, rel=''):
+    """
+    :param ignore_filter: IgnoreFilesFilter, built from ignore_list if not given, ignored directories are not copied
+    :param rel: path of src relative to the root the ignore patterns apply to
+    """
 
-    if ignore_list is None:
-        ignore = None
-    elif  len(ignore_list) < 1:
-        ignore = None
-    else:
-        ignore = shutil.ignore_patterns(*ignore_list)
+    if ignore_filter is None:
+        ignore_filter = IgnoreFilesFilter(ignore_list)
+    if copy_engine is not None:
+        return _queue_copy_tree(src, dst, ignore_filter, rel, verbose)
+    ignore = ignore_filter.copytree_ignore(src, rel)
 
     if verbose:
         shutil.copytree(src, dst, ignore=ignore, copy_function=copy2_verbose)
     else:
-        shutil.copytree(src,dst,ignore=ignore)
+        shutil.copytree(src,dst,ignore=ignore, copy_function=copy_file)
+
+
+def _queue_copy_tree(src, dst, ignore_filter, rel='', verbose=False):
+    """
+    Same result as shutil.copytree (symbolic links are followed), the directories are created here and the files
+    queued on copy_engine, the directories get the times of their source when the engine is waited for
+    """
+    stack = [(src, dst, rel)]
+    while stack:
+        curr_src, curr_dst, curr_rel = stack.pop()
+        os.makedirs(curr_dst)
+        copy_engine.add_directory(curr_src, curr_dst)
+        with os.scandir(curr_src) as it:
+            for entry in it:
+                entry_rel = os.path.join(curr_rel, entry.name) if curr_rel else entry.name
+                if ignore_filter.is_ignored(entry_rel, entry.is_dir):
+                    continue
+                dst_item = os.path.join(curr_dst, entry.name)
+                if entry.is_dir():
+                    stack.append((entry.path, dst_item, entry_rel))
+                else:
+                    if verbose:
+                        print('Copying {0}'.format(entry.path))
+                    copy_engine.submit(entry.path, dst_item, entry.stat().st_size)
+    return dst
+
+
+def _journal_copy(tag):
+    if operation_journal is not None:
+        operation_journal.record_copy(*tag)
+
+
+def _copy_or_queue(src, dst, rel=None):
+    """
+    Copies src to dst, or queues the copy when a copy engine is running (it removes dst first if it exists)
+    :param rel: path of src relative to the source root, the copy is recorded in the operation journal when it
+                completed
+    """
+    tag = None
+    if operation_journal is not None and rel is not None:
+        # stat'ed before the copy, a file changing while it is copied is copied again by a resumed run
+        st = os.stat(src)
+        tag = (rel, st.st_size, st.st_mtime_ns)
+    if copy_engine is not None:
+        copy_engine.submit(src, dst, None if tag is None else tag[1], tag)
+    else:
+        copy_file(src, dst)
+        if tag is not None:
+            _journal_copy(tag)
+
+
+def read_ignore_file(path:str)->list:
+    """
+    Reads ignore patterns from a file, one per line, blank lines and lines starting with # are skipped
+    (use \\# for a pattern starting with #)
+    """
+    patterns = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\r\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('\\#'):
+                line = line[1:]
+            patterns.append(line)
+    return patterns
+
+
+def _translate_ignore_pattern(pattern:str)->str:
+    """
+    Translates a path pattern to a regular expression matching a / separated relative path, * and ? do not match
+    a /, ** matches any number of directories
+    """
+    rtn = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        at_segment_start = i == 0 or pattern[i - 1] == '/'
+        if pattern.startswith('**/', i) and at_segment_start:
+            rtn.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i) and at_segment_start and i + 2 == n:
+            # everything inside, not the directory itself, so a later ! pattern can include some of it again
+            rtn.append('.+')
+            i += 2
+        elif c == '*':
+            rtn.append('[^/]*')
+            i += 1
+        elif c == '?':
+            rtn.append('[^/]')
+            i += 1
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                rtn.append('\\[')
+                i += 1
+            else:
+                chars = pattern[i + 1:j].replace('\\', '\\\\')
+                if chars[0] in '!^':
+                    chars = '^' + chars[1:]
+                rtn.append('(?!/)[' + chars + ']')
+                i = j + 1
+        else:
+            rtn.append(re.escape(c))
+            i += 1
+    return ''.join(rtn)
 
 
 class IgnoreFilesFilter:
     """
-    Ignore List to be used in filecmp functions, supports wild cards through use of in_list,
-    filecmp functions handle wildcards (*) on there own
+    Ignore List to be used when walking directories. All patterns are compiled into a single regular expression.
+    A pattern without a / (e.g. *.exe, node_modules) matches a name at any depth, a pattern containing a / is
+    matched against the path relative to the root of the walk (a leading / only anchors it, e.g. /logs or
+    build/**). A trailing / matches directories only and a leading ! re-includes what an earlier pattern
+    ignored, the last matching pattern wins. Nothing below an ignored directory is listed, walkers prune it.
     """
 
 
-    def __init__(self, ignore_list:list):
-        self._has_wildcards = False
+    def __init__(self, ignore_list:list, ignore_file:str = None):
+        if ignore_file is not None:
+            ignore_list = list(ignore_list or []) + read_ignore_file(ignore_file)
         self._ignore_list = ignore_list
 
-        if ignore_list is not None:
-            for word in ignore_list:
-                if '*' in word:
-                    self._has_wildcards = True
-                    break
+        self._regex = None
+        self._negated = []
+        self._has_dir_only = False
+        self._basename_only = True
+        patterns = []
+        for word in ignore_list or []:
+            negated = word.startswith('!')
+            if negated or word.startswith('\\!'):
+                word = word[1:]
+            dir_only = word.endswith('/')
+            word = word.rstrip('/')
+            if not word:
+                continue
+            anchored = '/' in word
+            patterns.append((_translate_ignore_pattern(word.lstrip('/')), negated, dir_only, anchored))
+            self._has_dir_only = self._has_dir_only or dir_only
+            self._basename_only = self._basename_only and not anchored
+
+        if patterns:
+            alternatives = []
+            # reversed as the first matching alternative is used and the last matching pattern wins
+            for i, (regex, negated, dir_only, anchored) in reversed(list(enumerate(patterns))):
+                if not anchored and not self._basename_only:
+                    regex = '(?:.*/)?' + regex
+                alternatives.append('(?P<p{}>{}{})'.format(i, regex, '/' if dir_only else '/?'))
+                self._negated.append(negated)
+            self._negated.reverse()
+            # matches the case insensitive behaviour of fnmatch on windows
+            self._regex = re.compile('|'.join(alternatives), re.IGNORECASE if os.name == 'nt' else 0)
 
     @property
     def ignore_list(self):
         return self._ignore_list
 
-    def filter_list(self, list_to_filter:list)->list:
-        return [x for x in list_to_filter if not self.in_list(x)]
+    def _match(self, rel:str, is_dir:bool)->bool:
+        if self._basename_only:
+            subject = os.path.basename(rel)
+        else:
+            subject = rel.replace(os.sep, '/') if os.sep != '/' else rel
+        match = self._regex.fullmatch(subject + '/' if is_dir else subject)
+        return match is not None and not self._negated[int(match.lastgroup[1:])]
+
+    def is_ignored(self, rel:str, is_dir=False)->bool:
+        """
+        :param rel: path relative to the root of the walk
+        :param is_dir: True if rel is a directory, or a callable returning it, only called when a directory only
+                       pattern makes the answer depend on it (saves a stat)
+        :return: True if rel is ignored
+        """
+        if self._regex is None:
+            return False
+        if not callable(is_dir):
+            ignored = self._match(rel, is_dir)
+        else:
+            ignored = self._match(rel, False)
+            if self._has_dir_only and ignored != self._match(rel, True):
+                ignored = not ignored if is_dir() else ignored
+        if ignored:
+            runReport.count('ignore_hits')
+        return ignored
+
+    def path_excluded(self, rel:str, is_dir=True)->bool:
+        """
+        :return: True if rel or one of the directories above it is ignored, for paths not reached by a walk
+        """
+        if self._regex is None or not rel:
+            return False
+        parts = rel.split(os.sep)
+        for i in range(1, len(parts)):
+            if self.is_ignored(os.sep.join(parts[:i]), True):
+                return True
+        return self.is_ignored(rel, is_dir)
 
-    def filter_dircmp(self, dircmp: filecmp.dircmp)->filecmp.dircmp:
+    def filter_list(self, list_to_filter:list, rel:str = '', directory:str = None)->list:
+        """
+        :param list_to_filter: names in the directory rel
+        :param rel: path of the directory relative to the root of the walk
+        :param directory: path of the directory, used to tell directories from files for directory only patterns
+        :return: the names not ignored
+        """
+        if self._regex is None:
+            return list(list_to_filter)
+        rtn = []
+        for name in list_to_filter:
+            is_dir = False
+            if directory is not None:
+                path = os.path.join(directory, name)
+                is_dir = lambda: os.path.isdir(path)
+            if not self.is_ignored(os.path.join(rel, name) if rel else name, is_dir):
+                rtn.append(name)
+        return rtn
+
+    def filter_dircmp(self, dircmp: filecmp.dircmp, rel:str = '')->filecmp.dircmp:
         """
-        Filters the files from the right_only, left_only, diff_files,
+        Filters the entries of a directory comparison before the comparison is made, ignored entries are listed
+        but never stat'ed or compared
         :param dircmp: filecmp.dircmp see https://docs.python.org/3/library/filecmp.html
-        :return: rtn_dircmp: a modified copy of dircmp (filecmp.dircmp class)
+        :param rel: path of the compared directories relative to the root of the walk
+        :return: rtn_dircmp: a modified shallow copy of dircmp (filecmp.dircmp class), the lists are recomputed
+                 from the filtered listings
         """
-        rtn_dircmp = copy.deepcopy(dircmp)
-        rtn_dircmp.left_list = self.filter_list(dircmp.left_list)
-        rtn_dircmp.right_list = self.filter_list(dircmp.right_list)
-        rtn_dircmp.common = self.filter_list(dircmp.common)
-        rtn_dircmp.right_only = self.filter_list(dircmp.right_only)
-        rtn_dircmp.left_only = self.filter_list(dircmp.left_only)
-        rtn_dircmp.common_dirs = self.filter_list(dircmp.common_dirs)
-        rtn_dircmp.common_files = self.filter_list(dircmp.common_files)
-        rtn_dircmp.common_funny = self.filter_list(dircmp.common_funny)
-        rtn_dircmp.same_files = self.filter_list(dircmp.same_files)
-        rtn_dircmp.diff_files = self.filter_list(dircmp.diff_files)
-        rtn_dircmp.funny_files = self.filter_list(dircmp.funny_files)
-        rtn_dircmp.subdirs = self.filter_list(dircmp.subdirs)
+        rtn_dircmp = copy.copy(dircmp)
+        rtn_dircmp.left_list = self.filter_list(dircmp.left_list, rel, dircmp.left)
+        rtn_dircmp.right_list = self.filter_list(dircmp.right_list, rel, dircmp.right)
+        for name in filecmp.dircmp.methodmap:
+            if name not in ('left_list', 'right_list'):
+                # computed again (lazily) from the filtered lists
+                rtn_dircmp.__dict__.pop(name, None)
 
         return rtn_dircmp
 
+    def copytree_ignore(self, root:str, rel:str = ''):
+        """
+        :param root: directory given to shutil.copytree
+        :param rel: path of root relative to the root of the walk
+        :return: callable for the ignore argument of shutil.copytree, None if nothing is ignored
+        """
+        if self._regex is None:
+            return None
 
-    def in_list(self, path_or_file:str):
-
-        word = os.path.basename(path_or_file)
-        if self._ignore_list is None or len(self._ignore_list) <1:
-            return False
-
-        if self._has_wildcards:
-            for item in self._ignore_list:
-                if fnmatch.fnmatch(word,item):
-                    return True
-            return False
-        else:
-            if word in self._ignore_list:
-                return True
-            else:
-                return False
+        def ignore(directory, names):
+            sub = os.path.relpath(directory, root)
+            sub = rel if sub == os.curdir else (os.path.join(rel, sub) if rel else sub)
+            return set(names) - set(self.filter_list(names, sub, directory))
+        return ignore
 
+    def in_list(self, path_or_file:str):
+        """
+        :return: True if the name of path_or_file is ignored as an entry of the root of the walk
+        """
+        return self.is_ignored(os.path.basename(path_or_file), lambda: os.path.isdir(path_or_file))
 
 
-def create_links_of_files(src, dest, verbosity, ignore_filter:IgnoreFilesFilter):
+def create_links_of_files(src, dest, verbosity, ignore_filter:IgnoreFilesFilter, rel=''):
     """
     Creates copy of the directory structure found
     :param src: Source directory
     :param dest: Destination directory
     :param verbosity: True to display information to console
+    :param rel: path of src relative to the root the ignore patterns apply to
     :return: None
     """
 
 
-    if not os.path.exists(dest) or not ignore_filter.in_list(dest):
-        os.mkdir(dest)
-        if verbosity:
-            print('Created directory {}.'.format(dest))
-    else:
-        print('WARNING: Directory {} already exists.'.format(dest))
+    _make_link_directory(dest, verbosity, ignore_filter)
 
     #for (dirpath, dirnames, filenames ) in os.walk(src):
     for item in os.listdir(src):
         curr_src_item = os.path.join(src, item)
         curr_dst_item = os.path.join(dest, item)
-        if ignore_filter.in_list(item):
+        curr_rel = os.path.join(rel, item) if rel else item
+        if ignore_filter.is_ignored(curr_rel, lambda: os.path.isdir(curr_src_item)):
             pass
         elif os.path.isdir(curr_src_item):
-            create_links_of_files(curr_src_item, curr_dst_item,verbosity, ignore_filter)
+            create_links_of_files(curr_src_item, curr_dst_item,verbosity, ignore_filter, curr_rel)
         else:
             make_link(curr_src_item, curr_dst_item)
             if verbosity:
                 print('Linking source {} to {}'.format(curr_src_item, curr_dst_item))
 
 
-def compare_replace_and_remove(src, dst, verbosity, ignore_filter:IgnoreFilesFilter=None, test = False):
+def remove_item(full_path_item, verbosity, test=False):
     """
-    :param ignore_filter:
-    :param src: The source directory of data
-    :param dst: The directory we will compare the src data with, if test is False different or new data is copied from src to dst
-    :param verbosity: if True output about the each operation performed or difference found is displayed
-    :param test: If test is True only information about compared data is displayed no changes occur
-    :return:  return empty list if no changes else a list of changes
+    Removes a file or directory that is only found in the destination
+    :return: description of the change
     """
-    if ignore_filter is None:
-        ignore_filter = IgnoreFilesFilter([])
+    if os.path.isdir(full_path_item):
 
-    data_changed = []
+        if verbosity:
+            print('Need to remove directory and contents: {}.'.format(full_path_item))
+        if not test:
+            if deletion_engine is not None:
+                deletion_engine.remove(full_path_item)
+            else:
+                shutil.rmtree(full_path_item, onerror=fileUtilities.remove_readonly)
+            if verbosity:
+                print('Removed directory and contents: {}.'.format(full_path_item))
+
+    else:
+        if verbosity and test:
+            print('Need to remove file: {}.'.format(full_path_item))
+        if not test:
+            os.remove(full_path_item)
+            if verbosity and test:
+                print('Removed file: {}.'.format(full_path_item))
+
+    return f'[DST ONLY]:[{full_path_item}]'
+
+
+def add_item(full_path_item, dst_path_item, verbosity, ignore_filter, test=False, rel=None):
+    """
+    Copies a file or directory that is only found in the source
+    :param rel: path of the item relative to the source root, ignore patterns inside a copied directory are
+                matched against it (defaults to the name of the item)
+    :return: description of the change
+    """
+    if os.path.isdir(full_path_item):
+        if verbosity:
+            print('Need to copy directory {} to {}.'.format(full_path_item, dst_path_item))
+        if not test:
+            my_copy_tree(full_path_item, dst_path_item, verbose=verbosity, ignore_filter=ignore_filter,
+                         rel=os.path.basename(full_path_item) if rel is None else rel)
+        if verbosity:
+            print('Copied directory (recursively) {} to {}'.format(full_path_item, dst_path_item))
+    else:
+        if verbosity and test:
+            print('Need to copy file {} to {}.'.format(full_path_item,dst_path_item))
+        if not test:
+            _copy_or_queue(full_path_item, dst_path_item, rel)
+        if verbosity and not test:
+            print('Copied file {} to {}.'.format(full_path_item,dst_path_item))
+
+    return f'[SRC ONLY]:[{full_path_item}]'
+
+
+def replace_file(full_path_item, dst_path_item, verbosity, test=False, rel=None):
+    """
+    Replaces a file in the destination that differs from the source
+    :param rel: path of the file relative to the source root
+    :return: description of the change
+    """
+    if os.path.isdir(full_path_item):
+        raise Exception('Found a directory in what should only be files {}.'.format(full_path_item))
+    else:
+        if verbosity and test:
+            print('Need to replace file {} with {}.'.format(dst_path_item, full_path_item))
+        if not test:
 
-    dir_compare = filecmp.dircmp( src, dst)
+            # need to remove the old link/file first otherwise if it is a linked file
+            # shutil overwrites the file linked to not just the linked file
+            os.remove( dst_path_item)
+            _copy_or_queue(full_path_item, dst_path_item, rel)
+        if verbosity and not test:
+            print('Replaced file {} with {}.'.format(dst_path_item, full_path_item))
 
-    pre_filter_diff = False
-    if len(dir_compare.right_only) > 0 or len(dir_compare.left_only) > 0 or len(dir_compare.diff_files) > 0:
-        pre_filter_diff = True
+    return f'[DIFF]:[{full_path_item}]'
 
-    dir_compare = ignore_filter.filter_dircmp(dir_compare)
 
-    local_diff=False
-    if len(dir_compare.right_only)> 0 or len(dir_compare.left_only) >0 or len(dir_compare.diff_files) > 0:
-        local_diff = True
+def _make_link_directory(dest, verbosity, ignore_filter:IgnoreFilesFilter, exist_ok=False):
+    if exist_ok and os.path.isdir(dest):
+        return
+    if not os.path.exists(dest) or not ignore_filter.in_list(dest):
+        os.mkdir(dest)
+        if verbosity:
+            print('Created directory {}.'.format(dest))
+    else:
+        print('WARNING: Directory {} already exists.'.format(dest))
 
-    if verbosity:
-        print(f'Comparing src [{src}] to dst [{dst}]\n\t '
-              f'[ Unfiltered Local Diff ] : [{pre_filter_diff}]\n\t'
-              f'[ Filtered   Local Diff ] : [{local_diff}]')
 
+def _make_link_again(src_path:str, lnk_path:str):
+    """
+    make_link for a resumed link farm, the link can already be there
+    :return: True if the link was created
+    """
+    if os.path.lexists(lnk_path):
+        if os.path.samefile(src_path, lnk_path):
+            return False
+        os.remove(lnk_path)
+    make_link(src_path, lnk_path)
+    return True
 
 
+def create_links_of_files_parallel(src, dest, verbosity, ignore_filter:IgnoreFilesFilter, workers=default_workers):
+    """
+    Creates the same tree as create_links_of_files, directories are listed with os.scandir (using the entry type
+    it returns instead of a stat per entry) and spread over a pool of worker threads.
+    :param src: Source directory
+    :param dest: Destination directory
+    :param verbosity: True to display information to console
+    :param ignore_filter: names to skip
+    :param workers: number of threads listing directories and creating links
+    :return: (number of links, number of directories) created
+    """
+    start = time.perf_counter()
+    # an interrupted link farm is completed: existing directories and links are kept and the directories the
+    # operation journal lists as linked are only walked for their sub directories
+    resuming = operation_journal is not None and operation_journal.resuming
+    _make_link_directory(dest, verbosity, ignore_filter, resuming)
+
+    work = queue.Queue()
+    work.put((src, dest, ''))
+    lock = threading.Lock()
+    totals = {'links': 0, 'directories': 1}
+    errors = []
+
+    def link_directory(curr_src, curr_dst, curr_rel):
+        links = 0
+        directories = 0
+        done = resuming and operation_journal.directory_done(curr_rel)
+        with os.scandir(curr_src) as it:
+            for entry in it:
+                curr_dst_item = os.path.join(curr_dst, entry.name)
+                entry_rel = os.path.join(curr_rel, entry.name) if curr_rel else entry.name
+                if ignore_filter.is_ignored(entry_rel, entry.is_dir):
+                    pass
+                elif entry.is_dir():
+                    # the directory is created before it is queued so its contents can be linked by any worker
+                    _make_link_directory(curr_dst_item, verbosity, ignore_filter, resuming)
+                    work.put((entry.path, curr_dst_item, entry_rel))
+                    directories += 1
+                elif done:
+                    pass
+                elif resuming:
+                    links += _make_link_again(entry.path, curr_dst_item)
+                else:
+                    make_link(entry.path, curr_dst_item)
+                    links += 1
+                    if verbosity:
+                        print('Linking source {} to {}'.format(entry.path, curr_dst_item))
+        if operation_journal is not None and not done:
+            operation_journal.record_directory(curr_rel)
+        with lock:
+            totals['links'] += links
+            totals['directories'] += directories
+
+    def worker():
+        while True:
+            item = work.get()
+            try:
+                if item is None:
+                    return
+                if not errors:
+                    link_directory(*item)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                work.task_done()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    runReport.count('files_linked', totals['links'])
+    runReport.count('directories_walked', totals['directories'])
+    print('[ Link Farm ] : [ {} links, {} directories in {:.1f}s ({:.0f} links/s) ]'.format(
+        totals['links'], totals['directories'], elapsed, totals['links'] / elapsed if elapsed > 0 else 0))
+    return totals['links'], totals['directories']
+
+
+def _funny_files_error(src, dst, funny_files, common_funny):
+    return Exception(f'There were funny files found when comparing {src} to {dst}\n'
+                     f'Funny Files: {funny_files}\n'
+                     f'Common Funny Files: {common_funny}'
+                     )
+
+
+def _join_rel(rel, name):
+    return os.path.join(rel, name) if rel else name
+
+
+def _list_directory(path):
+    with os.scandir(path) as it:
+        return {entry.name: entry for entry in it}
+
+
+def _same_file(src_entry, dst_entry, logical_size=None):
+    """
+    Same test as the shallow comparison of filecmp.dircmp, equal os.stat signatures (type, size, mtime) are
+    the same file, otherwise the contents are compared
+    :param logical_size: dst is a recipe of a file of this size (see deltaStorage.ChunkStore), it is the same file
+                         if that size and its mtime are the ones of src, its contents are never compared
+    """
+    s1 = src_entry.stat()
+    s2 = dst_entry.stat()
+    runReport.count('files_stated', 2)
+    if logical_size is not None:
+        return (stat.S_IFMT(s1.st_mode), s1.st_size, s1.st_mtime) == \
+            (stat.S_IFMT(s2.st_mode), logical_size, s2.st_mtime)
+    if (stat.S_IFMT(s1.st_mode), s1.st_size, s1.st_mtime) == (stat.S_IFMT(s2.st_mode), s2.st_size, s2.st_mtime):
+        return True
+    return filecmp.cmp(src_entry.path, dst_entry.path, shallow=True)
+
+
+def iter_changes(src, dst, verbosity=False, ignore_filter:IgnoreFilesFilter=None, recursive=True, root='',
+                 recipes=None):
+    """
+    Compares src to dst and yields the differences one at a time as backupManifest.ChangeEvents, directories are
+    walked with an explicit stack (no recursion limit) and only the listing of the directory being compared is
+    held in memory. Within a directory removals come first, then additions, then changed files, the same order
+    compare_replace_and_remove always used.
+    :param src: The source directory of data
+    :param dst: The directory compared with src
+    :param verbosity: if True each directory compared is displayed
+    :param ignore_filter: entries to skip on both sides, ignored directories are not listed
+    :param recursive: if False only the entries of src and dst are compared, not their sub directories
+    :param root: relative path of the directory (below src and dst) the comparison starts at
+    :param recipes: files of dst stored as blocks, relative path -> size of the file they restore to
+    """
+    if ignore_filter is None:
+        ignore_filter = IgnoreFilesFilter([])
+    if recipes is None:
+        recipes = {}
+
+    stack = [root]
+    while stack:
+        rel = stack.pop()
+        curr_src = os.path.join(src, rel) if rel else src
+        curr_dst = os.path.join(dst, rel) if rel else dst
+        left = _list_directory(curr_src)
+        right = _list_directory(curr_dst)
+        runReport.count('directories_walked')
+
+        left_only = [name for name in left if name not in right]
+        right_only = [name for name in right if name not in left]
+        pre_filter_diff = bool(left_only or right_only)
+        left_only = [name for name in left_only
+                     if not ignore_filter.is_ignored(_join_rel(rel, name), left[name].is_dir)]
+        right_only = [name for name in right_only
+                      if not ignore_filter.is_ignored(_join_rel(rel, name), right[name].is_dir)]
+
+        common_dirs = []
+        diff_files = []
+        funny_files = []
+        common_funny = []
+        for name in left:
+            if name not in right or ignore_filter.is_ignored(_join_rel(rel, name), left[name].is_dir):
+                continue
+            try:
+                left_is_dir = left[name].is_dir()
+                right_is_dir = right[name].is_dir()
+                if left_is_dir != right_is_dir:
+                    common_funny.append(name)
+                elif left_is_dir:
+                    common_dirs.append(name)
+                elif not _same_file(left[name], right[name], recipes.get(_join_rel(rel, name))):
+                    diff_files.append(name)
+            except OSError:
+                funny_files.append(name)
 
+        if verbosity:
+            print(f'Comparing src [{curr_src}] to dst [{curr_dst}]\n\t '
+                  f'[ Unfiltered Local Diff ] : [{pre_filter_diff or bool(diff_files)}]\n\t'
+                  f'[ Filtered   Local Diff ] : [{bool(left_only or right_only or diff_files)}]')
+
+        if funny_files or common_funny:
+            raise _funny_files_error(curr_src, curr_dst, funny_files, common_funny)
+
+        for name in right_only:
+            child_rel = _join_rel(rel, name)
+            kind = backupManifest.DIR_REMOVED if right[name].is_dir() else backupManifest.REMOVED
+            yield backupManifest.ChangeEvent(kind, child_rel, os.path.join(curr_src, name), right[name].path)
+        for name in left_only:
+            child_rel = _join_rel(rel, name)
+            kind = backupManifest.DIR_ADDED if left[name].is_dir() else backupManifest.ADDED
+            yield backupManifest.ChangeEvent(kind, child_rel, left[name].path, os.path.join(curr_dst, name))
+        for name in diff_files:
+            child_rel = _join_rel(rel, name)
+            yield backupManifest.ChangeEvent(backupManifest.MODIFIED, child_rel, left[name].path, right[name].path)
+
+        if recursive:
+            # reversed so sub directories are compared in listing order
+            stack.extend(_join_rel(rel, name) for name in reversed(common_dirs))
+
+
+def iter_dirty_directory_changes(src, dst, dirty_dirs, verbosity, ignore_filter:IgnoreFilesFilter=None):
+    """
+    Runs iter_changes only on the directories a change journal reported
+    :param dirty_dirs: dict of relative directory -> True to compare it recursively, see changeJournal.JournalReader
+    """
+    if ignore_filter is None:
+        ignore_filter = IgnoreFilesFilter([])
 
+    recursive_prefixes = []
+    for rel in sorted(dirty_dirs, key=lambda d: (d.count(os.sep) + (1 if d else 0), d)):
+        if any(prefix == '' or rel == prefix or rel.startswith(prefix + os.sep) for prefix in recursive_prefixes):
+            continue
+        if ignore_filter.path_excluded(rel):
+            continue
+        # a new or removed directory is handled by its parent
+        if not os.path.isdir(os.path.join(src, rel)) or not os.path.isdir(os.path.join(dst, rel)):
+            continue
+        yield from iter_changes(src, dst, verbosity, ignore_filter, dirty_dirs[rel], rel, latest_recipes)
+        if dirty_dirs[rel]:
+            recursive_prefixes.append(rel)
+
+
+def apply_change(event, verbosity, ignore_filter:IgnoreFilesFilter=None, test=False):
+    """
+    Applies one change to the destination (nothing changes if test is True)
+    :param event: backupManifest.ChangeEvent
+    :return: description of the change
+    """
+    if ignore_filter is None:
+        ignore_filter = IgnoreFilesFilter([])
 
+    if object_store is not None and not test and event.kind in (backupManifest.REMOVED, backupManifest.DIR_REMOVED,
+                                                                backupManifest.MODIFIED):
+        # the virtual snapshot still refers to the version about to be replaced or removed
+        if os.path.lexists(event.dst):
+            object_store.preserve(event.dst, event.rel)
+
+    if latest_recipes and not test and (event.kind == backupManifest.DIR_REMOVED or os.path.lexists(event.dst)):
+        _forget_recipes(event.rel, event.kind == backupManifest.DIR_REMOVED or os.path.isdir(event.dst))
+
+    if pack_store is not None and not test:
+        # a packed file is replaced by packing it again, or by a copy if it is no longer small
+        pack_store.discard(event.rel, event.kind == backupManifest.DIR_REMOVED)
+        if event.kind == backupManifest.REMOVED and not os.path.lexists(event.dst):
+            return f'[DST ONLY]:[{event.dst}]'
+
+    if event.kind in (backupManifest.REMOVED, backupManifest.DIR_REMOVED):
+        with runReport.phase('remove'):
+            return remove_item(event.dst, verbosity, test)
+    # the copies are timed on their own, they are also part of the compare phase they happen in
+    with runReport.phase('copy'):
+        if event.kind == backupManifest.MODIFIED and os.path.lexists(event.dst):
+            return replace_file(event.src, event.dst, verbosity, test, event.rel)
+        if not test and os.path.lexists(event.dst):
+            # anything already there (e.g. added to LATEST by hand when the manifest was used) is removed rather
+            # than copied over as it could be linked to an older snapshot
+            remove_item(event.dst, verbosity)
+            if deletion_engine is not None:
+                # a directory is only gone once the deletion queue is done with it
+                deletion_engine.wait()
+        return add_item(event.src, event.dst, verbosity, ignore_filter, test, event.rel)
+
+
+def _change_applied(event):
+    """
+    On a resumed run, True if the change was made before the run was interrupted: the item removed is gone, or
+    the file was copied (the operation journal recorded it) from a source that did not change since
+    """
+    if event.kind in (backupManifest.REMOVED, backupManifest.DIR_REMOVED):
+        return not os.path.lexists(event.dst) and (pack_store is None or not pack_store.holds(event.rel))
+    if event.kind == backupManifest.DIR_ADDED or not os.path.lexists(event.dst):
+        return False
+    try:
+        return operation_journal.copy_done(event.rel, os.stat(event.src))
+    except FileNotFoundError:
+        return False
 
-    if len(dir_compare.funny_files) > 0 or len(dir_compare.common_funny) >0:
-        raise Exception(f'There were funny files found when comparing {src} to {dst}\n'
-                        f'Funny Files: {dir_compare.funny_files}\n'
-                        f'Common Funny Files: {dir_compare.common_funny}'
-                        )
 
+def apply_changes(events, verbosity, ignore_filter:IgnoreFilesFilter=None, test=False):
+    """
+    Applies each change as it arrives and yields its description, nothing is collected so memory does not
+    grow with the size of the tree. When the run resumes an interrupted one, changes already made are skipped
+    and a new directory that was partly copied is compared to its copy so only what is missing is copied.
+    :param events: iterable of backupManifest.ChangeEvent, e.g. from iter_changes
+    """
+    resuming = not test and operation_journal is not None and operation_journal.resuming
+    for event in events:
+        if resuming:
+            if _change_applied(event):
+                runReport.count('changes_resumed')
+                continue
+            if event.kind == backupManifest.DIR_ADDED and os.path.isdir(event.dst):
+                src_root = event.src[:-len(event.rel)].rstrip(os.sep)
+                dst_root = event.dst[:-len(event.rel)].rstrip(os.sep)
+                yield from apply_changes(iter_changes(src_root, dst_root, verbosity, ignore_filter, root=event.rel,
+                                                      recipes=latest_recipes),
+                                         verbosity, ignore_filter, test)
+                continue
+        yield apply_change(event, verbosity, ignore_filter, test)
+
+
+def compare_replace_and_remove(src, dst, verbosity, ignore_filter:IgnoreFilesFilter=None, test = False, recursive = True):
+    """
+    :param ignore_filter:
+    :param recursive: if False only the entries of src and dst are compared, not their sub directories
+    :param src: The source directory of data
+    :param dst: The directory we will compare the src data with, if test is False different or new data is copied from src to dst
+    :param verbosity: if True output about the each operation performed or difference found is displayed
+    :param test: If test is True only information about compared data is displayed no changes occur
+    :return:  return empty list if no changes else a list of changes
+    """
+    return list(apply_changes(iter_changes(src, dst, verbosity, ignore_filter, recursive), verbosity, ignore_filter,
+                              test))
 
 
+def report_changes(descriptions):
+    """
+    Prints the description of each change as it is made
+    :return: number of changes
+    """
+    count = 0
+    for count, item in enumerate(descriptions, 1):
+        if count == 1:
+            print('[ Items Changed ] : ')
+        print(f'[ {count - 1} ] : [ {item} ]')
+    return count
 
-    for item in dir_compare.right_only:
 
+def start_recipe_index(recipes: dict) -> dict:
+    """
+    :param recipes: recipes of LATEST when the run started (the recipe index of the snapshot it was made from)
+    :return: the recipes of LATEST now, the ones an interrupted run stored, replaced or removed are taken from its
+             operation journal
+    """
+    recipes = dict(recipes)
+    if operation_journal is not None and operation_journal.resuming:
+        for rel, size in operation_journal.recipes.items():
+            if size is None:
+                recipes.pop(rel, None)
+            else:
+                recipes[rel] = size
+    return recipes
 
-        full_path_item = os.path.join(dst, item)
-        data_changed.append(f'[DST ONLY]:[{full_path_item}]')
-        if os.path.isdir(full_path_item):
 
-            if verbosity:
-                print('Need to remove directory and contents: {}.'.format(full_path_item))
-            if not test:
-                shutil.rmtree(full_path_item)
-                if verbosity:
-                    print('Removed directory and contents: {}.'.format(full_path_item))
+def _record_recipe(rel, size):
+    """
+    Called by deltaStorage.ChunkStore for every file of LATEST it stored as blocks
+    """
+    latest_recipes[rel] = size
+    if operation_journal is not None:
+        operation_journal.record_recipe(rel, size)
 
-        else:
-            if verbosity and test:
-                print('Need to remove file: {}.'.format(full_path_item))
-            if not test:
-                os.remove(full_path_item)
-                if verbosity and test:
-                    print('Removed file: {}.'.format(full_path_item))
-
-    # new item
-    for item in dir_compare.left_only:
-
-        full_path_item = os.path.join(src, item)
-        data_changed.append(f'[SRC ONLY]:[{full_path_item}]')
-        dst_path_item = os.path.join(dst, item)
-        if os.path.isdir(full_path_item):
-            if verbosity:
-                print('Need to copy directory {} to {}.'.format(full_path_item, dst_path_item))
-            if not test:
-                my_copy_tree(full_path_item, dst_path_item, verbose=verbosity, ignore_list=ignore_filter.ignore_list)
-            if verbosity:
-                print('Copied directory (recursively) {} to {}'.format(full_path_item, dst_path_item))
-        else:
-            if verbosity and test:
-                print('Need to copy file {} to {}.'.format(full_path_item,dst_path_item))
-            if not test:
-                shutil.copy2(full_path_item, dst_path_item)
-            if verbosity and not test:
-                print('Copied file {} to {}.'.format(full_path_item,dst_path_item))
-
-    for item in dir_compare.diff_files:
-
-        full_path_item = os.path.join(src, item)
-        data_changed.append(f'[DIFF]:[{full_path_item}]')
-        dst_path_item = os.path.join(dst, item)
-        if os.path.isdir(full_path_item):
-            raise Exception('Found a directory in what should only be files {}.'.format(full_path_item))
-        else:
-            if verbosity and test:
-                print('Need to replace file {} with {}.'.format(dst_path_item, full_path_item))
-            if not test:
 
-                # need to remove the old link/file first otherwise if it is a linked file
-                # shutil overwrites the file linked to not just the linked file
-                os.remove( dst_path_item)
-                shutil.copy2(full_path_item, dst_path_item)
-            if verbosity and not test:
-                print('Replaced file {} with {}.'.format(dst_path_item, full_path_item))
+def _forget_recipes(rel, directory):
+    """
+    The file at rel (every file below it for a directory) is about to be replaced or removed, it is not a recipe
+    any more. Recorded before the change is made so a resumed run does not take the new file for the recipe.
+    """
+    if directory:
+        prefix = rel + os.sep
+        # copied as the copy workers add the recipes they store
+        paths = [path for path in list(latest_recipes) if path == rel or path.startswith(prefix)]
+    else:
+        paths = [rel] if rel in latest_recipes else []
+    for path in paths:
+        latest_recipes.pop(path, None)
+        if operation_journal is not None:
+            operation_journal.record_recipe(path, None)
 
-    #check the common dirs:
-    for common_dir in dir_compare.common_dirs:
-        full_path_left =os.path.join(src, common_dir)
-        full_path_right = os.path.join(dst, common_dir)
-        data_changed += compare_replace_and_remove( full_path_left, full_path_right, verbosity, ignore_filter, test)
 
-    return data_changed
+def write_recipe_index(latest: str):
+    """
+    Records the files of LATEST stored as blocks (see deltaStorage.recipe_index_path), every snapshot of a backup set
+    with a block store has one
+    """
+    deltaStorage.write_recipe_index(latest, latest_recipes)
 
 
 if __name__ == '__main__':
@@ -300,15 +1006,34 @@ if __name__ == '__main__':
     print(f'[ Version        ] : [ {version} ]')
     print(f'[ Arguments      ] : [ {sys.argv} ]')
     args = init_args()
+    run_report = runReport.start('incrementalBackup', args.report, args.profile)
 
     print(f'[ Source         ] : [ {args.source} ]')
     print(f'[ Dest           ] : [ {args.latest} ]')
     print(f'[ Symbolic Links ] : [ {args.use_symbolic_links} ]')
+    print(f'[ Manifest       ] : [ {not args.no_manifest} ]')
+    print(f'[ Workers        ] : [ {args.workers} ]')
+    print(f'[ Copy Method    ] : [ {args.copy_method} ]')
+    print(f'[ Dedup          ] : [ {args.dedup} ]')
+    print(f'[ Delta Storage  ] : [ {args.delta_threshold} ]')
+    print(f'[ Journal        ] : [ {args.journal} ]')
+    print(f'[ Copy Workers   ] : [ {args.copy_workers} ]')
+    print(f'[ Virtual        ] : [ {args.virtual} ]')
+    print(f'[ Pack Threshold ] : [ {args.pack_threshold} ]')
 
     if not os.path.isdir(args.source):
         print('[ Error ] : [ Source location [{}] is not a directory. ]'.format(args.source))
+    if args.virtual and args.no_manifest:
+        raise Exception('--virtual needs the manifest of LATEST, it can not be used with --no_manifest.')
+    if args.pack_threshold is not None and (args.virtual or args.no_manifest):
+        raise Exception('--pack_threshold needs the manifest and a snapshot directory, it can not be used with '
+                        '--virtual or --no_manifest.')
+    if os.path.isfile(packStore.index_path(os.path.abspath(args.latest))) and (args.virtual or args.no_manifest):
+        raise Exception('{} has packed files (see packStore.py), it can not be updated with --virtual or '
+                        '--no_manifest.'.format(args.latest))
 
     default_use_symbolic = args.use_symbolic_links
+    default_copy_method = args.copy_method
 
     ignore_list = None
     if args.omit_list is not None:
@@ -316,9 +1041,58 @@ if __name__ == '__main__':
         if len(ignore_list) == 1:
             if len(ignore_list[0]) <1:
                 ignore_list = None
+    # the ignore file patterns come after the -o patterns, the combined list is what the manifest records
+    ignore_filter = IgnoreFilesFilter(ignore_list, args.ignore_file)
+    ignore_list = ignore_filter.ignore_list
+
+    copy_buffer_size = args.buffer_size
+    if args.bandwidth is not None or args.iops is not None:
+        copy_throttle = fileUtilities.Throttle(args.bandwidth, args.iops)
+    if args.copy_workers > 0 and not args.test:
+        copy_engine = copyEngine.CopyEngine(copy_file, args.copy_workers, args.large_file_size, args.large_workers,
+                                            _journal_copy)
+
+    snapshot_catalog = None
+    storage_root = os.path.dirname(os.path.abspath(args.latest))
+    if not args.test:
+        deletion_engine = deletionEngine.DeletionEngine(args.delete_workers,
+                                                        deletionEngine.trash_dir(storage_root) if args.trash else None)
+    if not args.test and (args.catalog or snapshotCatalog.SnapshotCatalog.exists(storage_root)):
+        if args.no_manifest:
+            # the catalog would miss the snapshot and compare it to the next one as if it was the previous one
+            raise Exception('The snapshot catalog of {} is built from the manifests, it cannot be kept with '
+                            '--no_manifest (remove {} to stop keeping it).'
+                            .format(storage_root, os.path.join(fileUtilities.metadata_dir_name,
+                                                               snapshotCatalog.catalog_file_name)))
+        snapshot_catalog = snapshotCatalog.SnapshotCatalog(storage_root)
+
+    if args.checksums and not args.test:
+        checksum_cache = contentStore.HashCache(storage_root, 1)
+
+    if args.delta_threshold is not None and not args.test:
+        chunk_store = deltaStorage.ChunkStore(storage_root, args.delta_threshold, args.delta_block_size, args.latest,
+                                              args.delta_chunking, _record_recipe)
+
+    # a journal left behind is a run that was interrupted, it is finished before anything else is done
+    journal_file = operationJournal.journal_path(os.path.dirname(os.path.abspath(args.latest)), args.latest,
+                                                 not args.test)
+    operation_journal = operationJournal.OperationJournal.load(journal_file)
+    if operation_journal is not None:
+        if operation_journal.header['source'] != os.path.abspath(args.source):
+            raise Exception('An interrupted run from {} into {} was found ({}), it must be finished from the same '
+                            'source.'.format(operation_journal.header['source'], args.latest, journal_file))
+        print('[ Interrupted Run ] : [ {} run started {} ]'.format(
+            operation_journal.header['kind'],
+            datetime.fromtimestamp(operation_journal.header['started_ns'] / 1e9).strftime("%Y-%m-%d %H:%M:%S")))
+        if args.test:
+            print('Run without --test to finish it.')
+            operation_journal.close()
+            operation_journal = None
 
     first_run = True
-    if os.path.isdir( args.latest ):
+    if operation_journal is not None:
+        first_run = operation_journal.header['kind'] == operationJournal.FIRST_RUN
+    elif os.path.isdir( args.latest ):
         first_run = False
     else:
         if args.test:
@@ -328,20 +1102,89 @@ if __name__ == '__main__':
         args.verbose = True
         print('Running in testing mode (comparison only)')
         print('Source: {}\nLatest: {}\n '.format(args.source, args.latest))
-        rtn = compare_replace_and_remove(args.source, args.latest, args.verbose, ignore_list, True)
+        manifest = None
+        if not args.no_manifest:
+            manifest = backupManifest.load_manifest(backupManifest.manifest_path(os.path.abspath(args.latest)),
+                                                    args.source, ignore_list, args.verbose)
+        if manifest is not None:
+            events = backupManifest.iter_manifest_changes(args.source, args.latest, manifest, {}, ignore_filter)
+        else:
+            if os.path.isdir(args.latest):
+                latest_recipes = deltaStorage.snapshot_recipes(args.latest, save=False)
+            events = iter_changes(args.source, args.latest, args.verbose, ignore_filter, recipes=latest_recipes)
+        with run_report.phase('compare'):
+            rtn = report_changes(apply_changes(events, args.verbose, ignore_filter, True))
         print('\nDifferences: {}\n'.format(rtn))
-        exit(rtn)
+        run_report.set_value('items_changed', rtn)
+        run_report.finish()
+        exit(1 if rtn else 0)
 
     if first_run:
         #if args.verbose:
         print('[ First Run ] : [ Copying all data from {} to {}. ]'.format(args.source, args.latest))
-        if os.path.isdir(args.latest):
-            shutil.rmtree(args.latest)
+        if operation_journal is None:
+            if os.path.isdir(args.latest):
+                deletion_engine.remove(args.latest)
+                deletion_engine.wait()
+            operation_journal = operationJournal.OperationJournal.create(journal_file, operationJournal.FIRST_RUN,
+                                                                         args.source, args.latest)
 
         #os.mkdir(args.latest)
 
-        my_copy_tree(args.source, args.latest, ignore_list=ignore_list, verbose=args.verbose)
+        # the source is stat'ed before it is copied, a file changing during the copy then differs from the
+        # manifest on the next run and is copied again
+        journal_reader = None
+        if args.journal is not None:
+            # starts reading the journal from here on the next run
+            journal_reader = changeJournal.JournalReader(args.journal, args.source)
+            journal_reader.dirty_directories(args.verbose)
+
+        scan_time_ns = time.time_ns()
+        if not args.no_manifest:
+            with run_report.phase('scan'):
+                entries = backupManifest.scan_tree(args.source, ignore_filter)
+
+        if args.dedup:
+            content_index = contentStore.ContentIndex(os.path.dirname(os.path.abspath(args.latest)),
+                                                      args.dedup_min_size)
+        if args.pack_threshold is not None:
+            pack_store = packStore.PackStore(storage_root, args.latest, args.pack_threshold)
+        if deltaStorage.has_block_store(storage_root):
+            latest_recipes = start_recipe_index({})
+
+        with run_report.phase('copy'):
+            if operation_journal.resuming and os.path.isdir(args.latest):
+                # the files copied before the interruption are the same as their source, only the rest is copied
+                print('[ Resuming ] : [ Copying what is missing from {} ]'.format(args.latest))
+                report_changes(apply_changes(iter_changes(args.source, args.latest, args.verbose, ignore_filter,
+                                                          recipes=latest_recipes),
+                                             args.verbose, ignore_filter))
+            else:
+                my_copy_tree(args.source, args.latest, ignore_filter=ignore_filter, verbose=args.verbose)
+            if copy_engine is not None:
+                copy_engine.wait()
         #copy_tree(args.source, args.latest, verbose = args.verbose)
+        if deletion_engine is not None:
+            # the metadata written next describes LATEST with every removal made
+            deletion_engine.wait()
+
+        if latest_recipes is not None:
+            with run_report.phase('write_metadata'):
+                write_recipe_index(os.path.abspath(args.latest))
+        if not args.no_manifest:
+            with run_report.phase('write_metadata'):
+                if pack_store is not None:
+                    pack_store.write_index(args.latest)
+                backupManifest.write_snapshot_metadata(os.path.abspath(args.latest), args.source, entries,
+                                                       ignore_list, scan_time_ns)
+        if snapshot_catalog is not None:
+            with run_report.phase('catalog'):
+                snapshot_catalog.add_snapshot(os.path.basename(os.path.abspath(args.latest)),
+                                              scan_time_ns, entries, os.path.abspath(args.source))
+        if journal_reader is not None:
+            journal_reader.commit()
+        operation_journal.finish()
+        print(f'[ Copied ] : [ {copy_stats.summary()} ]')
 
 
     else:
@@ -349,32 +1192,188 @@ if __name__ == '__main__':
         latest = os.path.abspath(args.latest)
 
         # Move current latest
-        source_name = source.split('\\')[-1]
-        storage_location = os.path.abspath('\\'.join(latest.split('\\')[:-1]))
-        folder_creation_time = datetime.fromtimestamp(os.stat(args.latest).st_ctime)
-        new_folder_name = os.path.join(storage_location,source_name+'_'+folder_creation_time.strftime("%Y-%m-%d-%Hh%Mm%Ss"))
-
-        os.rename(latest, new_folder_name)
-
-        #if args.verbose:
-        print(' [ Moving ] : [ {} -> {} ]'.format(latest, new_folder_name))
-
-        #Create link to latest into latest for comparison
-        #os.mkdir(latest)
-        ignore_filter = IgnoreFilesFilter(ignore_list)
-
-        create_links_of_files(new_folder_name, latest, args.verbose, ignore_filter)
-        if args.verbose:
-            print('Linked Data from {}  to {}.'.format(new_folder_name, latest))
-
-        change = compare_replace_and_remove(source, latest, args.verbose, ignore_filter)
+        source_name = os.path.basename(source)
+        storage_location = os.path.dirname(latest)
+        virtual = args.virtual
+        latest_manifest = None
+        if operation_journal is not None:
+            virtual = operation_journal.header['kind'] == operationJournal.VIRTUAL
+        elif virtual:
+            with run_report.phase('load_manifest'):
+                latest_manifest = backupManifest.load_manifest(backupManifest.manifest_path(latest), source,
+                                                               ignore_list, args.verbose)
+            if latest_manifest is None:
+                print('[ Virtual ] : [ No usable manifest of {}, making a linked snapshot instead ]'.format(latest))
+                virtual = False
+
+        if operation_journal is not None:
+            new_folder_name = operation_journal.header['snapshot']
+            print('[ Resuming ] : [ {} -> {} ]'.format(new_folder_name, latest))
+        elif virtual:
+            snapshot_time = datetime.fromtimestamp(latest_manifest[0]['created_ns'] / 1e9)
+            new_folder_name = virtualSnapshot.snapshot_path(storage_location, source_name + '_' +
+                                                            snapshot_time.strftime("%Y-%m-%d-%Hh%Mm%Ss"))
+            operation_journal = operationJournal.OperationJournal.create(journal_file, operationJournal.VIRTUAL,
+                                                                         source, latest, new_folder_name)
+        else:
+            folder_creation_time = datetime.fromtimestamp(os.stat(args.latest).st_ctime)
+            new_folder_name = os.path.join(storage_location,source_name+'_'+folder_creation_time.strftime("%Y-%m-%d-%Hh%Mm%Ss"))
+            # the plan is on disk before anything is changed
+            operation_journal = operationJournal.OperationJournal.create(journal_file, operationJournal.INCREMENTAL,
+                                                                         source, latest, new_folder_name)
+
+        if args.dedup:
+            content_index = contentStore.ContentIndex(storage_location, args.dedup_min_size)
+
+        manifest = None
+        if virtual:
+            # LATEST stays where it is, the snapshot is its manifest and the versions replaced from now on
+            with run_report.phase('rename'):
+                if not os.path.isfile(new_folder_name):
+                    if latest_manifest is None:
+                        # interrupted before the snapshot was written, LATEST has not changed yet
+                        latest_manifest = backupManifest.load_manifest(backupManifest.manifest_path(latest), source,
+                                                                       ignore_list, args.verbose)
+                        if latest_manifest is None:
+                            raise Exception('The manifest of {} needed to resume the run is gone.'.format(latest))
+                    virtualSnapshot.write_virtual_snapshot(new_folder_name, latest, latest_manifest)
+                    if deltaStorage.has_block_store(storage_location):
+                        # the recipes of LATEST as the snapshot sees it, before any is replaced
+                        deltaStorage.write_recipe_index(new_folder_name, deltaStorage.snapshot_recipes(latest))
+            print(' [ Virtual Snapshot ] : [ {} ]'.format(new_folder_name))
+            with run_report.phase('load_manifest'):
+                manifest = latest_manifest or virtualSnapshot.read_virtual_snapshot(new_folder_name)
+            object_store = virtualSnapshot.ObjectStore(storage_location, manifest[1])
+        else:
+            with run_report.phase('rename'):
+                if not operation_journal.has_phase(operationJournal.RENAMED):
+                    # interrupted after the directory was renamed, the sidecars and the index may not have been
+                    if not operation_journal.resuming or os.path.isdir(latest):
+                        os.rename(latest, new_folder_name)
+                    backupManifest.rename_snapshot_sidecars(latest, new_folder_name)
+                    if content_index is not None:
+                        content_index.rename_snapshot(os.path.basename(latest), os.path.basename(new_folder_name))
+                    operation_journal.record_phase(operationJournal.RENAMED)
+
+            #if args.verbose:
+            print(' [ Moving ] : [ {} -> {} ]'.format(latest, new_folder_name))
+
+            #Create link to latest into latest for comparison
+            #os.mkdir(latest)
+
+            if not operation_journal.has_phase(operationJournal.LINKED):
+                with run_report.phase('link_farm'):
+                    create_links_of_files_parallel(new_folder_name, latest, args.verbose, ignore_filter, args.workers)
+                operation_journal.record_phase(operationJournal.LINKED)
+            if args.verbose:
+                print('Linked Data from {}  to {}.'.format(new_folder_name, latest))
+
+            if not args.no_manifest:
+                with run_report.phase('load_manifest'):
+                    manifest = backupManifest.load_manifest(backupManifest.manifest_path(new_folder_name), source,
+                                                            ignore_list, args.verbose)
+
+        if deltaStorage.has_block_store(storage_location):
+            # the recipes LATEST started from
+            latest_recipes = start_recipe_index(virtualSnapshot.snapshot_recipes(new_folder_name) if virtual
+                                                else deltaStorage.snapshot_recipes(new_folder_name))
+
+        if not virtual and not args.no_manifest:
+            # once a snapshot has packed files every run packs, with the threshold it was made with if none is given
+            pack_header, pack_entries = packStore.read_index(packStore.index_path(new_folder_name))
+            if args.pack_threshold is not None or pack_header is not None:
+                pack_store = packStore.PackStore(storage_root, latest, args.pack_threshold or pack_header['threshold'],
+                                                 pack_entries if manifest is not None else None)
+
+        if content_index is not None and manifest is not None and content_index.is_empty():
+            # first run with the index, the previous snapshot is what can be linked from
+            content_index.add_entries(os.path.basename(latest if virtual else new_folder_name), manifest[1])
+
+        # read before the scan starts, changes made during the run are in the part of the journal the next run reads
+        journal_reader = None
+        dirty_dirs = None
+        if args.journal is not None:
+            journal_reader = changeJournal.JournalReader(args.journal, source)
+            dirty_dirs = journal_reader.dirty_directories(args.verbose)
+            if dirty_dirs is not None:
+                print('[ Journal ] : [ {} directories changed since the last run ]'.format(len(dirty_dirs)))
+
+        scan_time_ns = time.time_ns()
+        if manifest is not None:
+            print('[ Comparing ] : [ Using manifest of {} ]'.format(new_folder_name))
+            entries = {}
+            events = backupManifest.iter_manifest_changes(source, latest, manifest, entries, ignore_filter, dirty_dirs)
+        elif dirty_dirs is not None and args.no_manifest:
+            events = iter_dirty_directory_changes(source, latest, dirty_dirs, args.verbose, ignore_filter)
+        else:
+            if not args.no_manifest:
+                with run_report.phase('scan'):
+                    entries = backupManifest.scan_tree(source, ignore_filter)
+            events = iter_changes(source, latest, args.verbose, ignore_filter, recipes=latest_recipes)
+
+        # changes are printed as they are made rather than collected, the walk and the copies overlap
+        with run_report.phase('compare'):
+            change = report_changes(apply_changes(events, args.verbose, ignore_filter))
+        if copy_engine is not None:
+            # the copies still queued when the comparison finished
+            with run_report.phase('copy_wait'):
+                copy_engine.wait()
+        if deletion_engine is not None:
+            # the metadata and the catalog written next describe LATEST with every removal made
+            deletion_engine.wait()
+        run_report.set_value('items_changed', change)
+
+        if latest_recipes is not None:
+            with run_report.phase('write_metadata'):
+                write_recipe_index(latest)
+        if not args.no_manifest:
+            with run_report.phase('write_metadata'):
+                if pack_store is not None:
+                    pack_store.write_index(latest)
+                backupManifest.write_snapshot_metadata(latest, source, entries, ignore_list, scan_time_ns)
+        if snapshot_catalog is not None:
+            with run_report.phase('catalog'):
+                snapshot_catalog.rename_snapshot(os.path.basename(latest), os.path.basename(new_folder_name),
+                                                 snapshotCatalog.VIRTUAL if virtual else snapshotCatalog.DIRECTORY)
+                snapshot_catalog.add_snapshot(os.path.basename(latest), scan_time_ns, entries, source,
+                                              previous=manifest)
+        if journal_reader is not None:
+            journal_reader.commit()
+        operation_journal.finish()
         if not change:
             print('[ Finished ] : [ Directories were identical. ]')
         else:
-            print('[ Finished ] : [ Difference found in directories ]')
-            print('[ Items Changed ] : ')
-            for i, item in enumerate(change):
-                print(f'[ {i} ] : [ {item} ]')
-
-
-
+            print('[ Finished ] : [ Difference found in directories ({} items changed) ]'.format(change))
+        print(f'[ Copied ] : [ {copy_stats.summary()} ]')
+
+    if copy_engine is not None:
+        copy_engine.close()
+    if deletion_engine is not None:
+        deletion_engine.close()
+        if deletion_engine.directories or deletion_engine.trashed:
+            print(f'[ Deleted ] : [ {deletion_engine.summary()} ]')
+        run_report.set_value('files_deleted', deletion_engine.files)
+    if chunk_store is not None:
+        print(f'[ Delta Storage ] : [ {chunk_store.summary()} ]')
+    if pack_store is not None:
+        pack_store.close()
+        print(f'[ Packed ] : [ {pack_store.summary()} ]')
+        run_report.set_value('files_packed', pack_store.files)
+    if object_store is not None:
+        print(f'[ Virtual Snapshot ] : [ {object_store.preserved} replaced or removed versions kept ]')
+        run_report.set_value('versions_preserved', object_store.preserved)
+    if snapshot_catalog is not None:
+        snapshot_catalog.close()
+    if checksum_cache is not None:
+        print(f'[ Checksums ] : [ {checksum_cache.recorded_files} files recorded ]')
+        checksum_cache.close()
+    if content_index is not None:
+        print(f'[ Deduplicated ] : [ {content_index.summary()} ]')
+        run_report.set_value('files_deduplicated', content_index.deduplicated_files)
+        content_index.close()
+
+    run_report.set_value('files_copied', copy_stats.files)
+    run_report.set_value('bytes_copied', copy_stats.bytes_copied)
+    run_report.set_value('bytes_cloned', copy_stats.bytes_cloned)
+    run_report.finish()
+    print(f'[ Timing ] : [ {run_report.summary()} ]')
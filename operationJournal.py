@@ -0,0 +1,171 @@
+# Operation Journal
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import json
+import os
+import threading
+import time
+
+import fileUtilities
+
+version = '1.0'
+
+# layout of the journal file, a journal of another format is not resumed
+_format = 1
+
+# kinds of run
+FIRST_RUN = 'first'
+INCREMENTAL = 'incremental'
+# LATEST updated in place, the snapshot is a manifest (see virtualSnapshot)
+VIRTUAL = 'virtual'
+
+# phases recorded as they complete
+RENAMED = 'renamed'
+LINKED = 'linked'
+
+# records, one json list per line after the header line
+_PHASE = 'P'
+_DIRECTORY = 'D'   # every entry of the directory (relative to LATEST) is linked, its sub directories are created
+_COPIED = 'C'      # the file was copied from a source of this size and mtime
+_RECIPE = 'B'      # the file was stored as blocks restoring to this size, or (None) is no longer a recipe
+
+_sync_interval = 1.0
+
+
+def journal_path(storage_root: str, latest: str, create: bool = True) -> str:
+    """
+    :param create: create the metadata directory if it does not exist
+    :return: path of the journal of a run into latest, kept in the metadata directory of the backup set
+    """
+    return os.path.join(fileUtilities.metadata_dir(storage_root, create),
+                        'run-{}.journal'.format(os.path.basename(os.path.normpath(latest))))
+
+
+class OperationJournal:
+    """
+    Write-ahead journal of a backup run. The plan (source, LATEST, the name the previous LATEST is renamed to) is
+    written before anything changes, then the phases, the directories linked and the files copied are appended
+    as they complete. Every operation is repeatable, so records lost in a crash only mean that work is done again;
+    completed phases and the final steps are synced to disk right away. The journal is removed once the run
+    finished, if one is found the run was interrupted and resumes from what it records.
+    """
+
+    def __init__(self, path: str, header: dict, resuming: bool):
+        self._path = path
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self.header = header
+        self.resuming = resuming
+        self.phases = set()
+        self.directories = set()
+        self.copies = {}
+        # relative path -> size of the files stored as blocks, None for the recipes replaced or removed
+        self.recipes = {}
+        self._file = None
+
+    @classmethod
+    def create(cls, path: str, kind: str, source: str, latest: str, snapshot: str = None):
+        """
+        Starts the journal of a new run
+        :param kind: FIRST_RUN, INCREMENTAL or VIRTUAL
+        :param snapshot: directory the previous LATEST is renamed to, or the virtual snapshot written
+        """
+        header = {'format': _format, 'kind': kind, 'source': os.path.abspath(source),
+                  'latest': os.path.abspath(latest), 'snapshot': snapshot, 'started_ns': time.time_ns()}
+        journal = cls(path, header, False)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        journal._open()
+        return journal
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        :return: the journal of an interrupted run, None if there is none (or it is unreadable)
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                return None
+            if header.get('format') != _format:
+                return None
+            journal = cls(path, header, True)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line written before the crash
+                    break
+                if record[0] == _PHASE:
+                    journal.phases.add(record[1])
+                elif record[0] == _DIRECTORY:
+                    journal.directories.add(record[1])
+                elif record[0] == _COPIED:
+                    journal.copies[record[1]] = (record[2], record[3])
+                elif record[0] == _RECIPE:
+                    journal.recipes[record[1]] = record[2]
+        journal._open()
+        return journal
+
+    def _open(self):
+        self._file = open(self._path, 'a', encoding='utf-8')
+
+    def _append(self, record: list, sync: bool = False):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            now = time.monotonic()
+            if sync or now - self._last_sync >= _sync_interval:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+
+    def record_phase(self, phase: str):
+        self.phases.add(phase)
+        self._append([_PHASE, phase], sync=True)
+
+    def has_phase(self, phase: str) -> bool:
+        return phase in self.phases
+
+    def record_directory(self, rel: str):
+        self._append([_DIRECTORY, rel])
+
+    def directory_done(self, rel: str) -> bool:
+        return rel in self.directories
+
+    def record_copy(self, rel: str, size: int, mtime_ns: int):
+        self._append([_COPIED, rel, size, mtime_ns])
+
+    def record_recipe(self, rel: str, size):
+        """
+        Synced right away, the recipe index written at the end of the run is rebuilt from these records
+        :param size: size of the file the recipe restores to, None when rel is replaced or removed
+        """
+        self._append([_RECIPE, rel, size], sync=True)
+
+    def copy_done(self, rel: str, st: os.stat_result) -> bool:
+        """
+        :param st: stat of the source now, a copy made from an older version of the file does not count
+        """
+        return self.copies.get(rel) == (st.st_size, st.st_mtime_ns)
+
+    def finish(self):
+        """
+        The run completed, the journal is removed
+        """
+        self.close()
+        os.remove(self._path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,322 @@
+# Pack Store
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+import backupManifest
+import fileUtilities
+
+version = '1.0'
+
+packs_dir_name = 'packs'
+pack_suffix = '.pack'
+index_version = 1
+
+default_threshold = 64 * 1024
+default_pack_size = 256 * 1024 * 1024
+
+
+def index_path(snapshot_dir: str) -> str:
+    """
+    :return: pack index of a snapshot directory, a sidecar renamed and removed with the snapshot
+    """
+    return os.path.normpath(snapshot_dir) + backupManifest.pack_index_suffix
+
+
+def read_index(path: str):
+    """
+    :param path: pack index, see index_path
+    :return: (header, entries) where entries is a dict of relative path -> (pack, offset, size, mtime_ns, mode),
+             (None, {}) if the snapshot has no index
+    """
+    if not os.path.isfile(path):
+        return None, {}
+    entries = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != index_version:
+            raise Exception(f'Unknown pack index version in {path}')
+        for line in f:
+            rel, pack, offset, size, mtime_ns, mode = json.loads(line)
+            entries[rel] = (pack, offset, size, mtime_ns, mode)
+    if header.get('count') != len(entries):
+        raise Exception(f'The pack index {path} is incomplete')
+    return header, entries
+
+
+def write_index(path: str, entries: dict, threshold: int):
+    """
+    Writes a pack index atomically (temporary file then rename) as gzip'ed json lines, a header line followed by one
+    [path, pack, offset, size, mtime_ns, mode] line per packed file
+    """
+    header = {'version': index_version, 'threshold': threshold, 'count': len(entries)}
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        f.write(json.dumps(header) + '\n')
+        for rel, entry in entries.items():
+            f.write(json.dumps([rel, *entry]) + '\n')
+    os.replace(tmp_path, path)
+
+
+class PackStore:
+    """
+    Files smaller than a threshold are appended to pack files shared by the snapshots of a backup set (in its
+    metadata directory) instead of being copied into LATEST. Each snapshot has a pack index next to it listing
+    where its packed files are, the index of a new snapshot starts as a copy of the previous one, so a file that did
+    not change is kept by reference: it is neither copied, linked nor stat'ed in the backup set again. A snapshot
+    of a tree of small files is then its directories, its large files and one index, instead of one inode and one
+    link per file.
+
+    Packs are append-only and each run writes its own, so an interrupted run or two runs into the same backup set
+    never write to the same pack. A pack no index refers to any more is removed by collect_garbage.
+    """
+
+    def __init__(self, storage_root: str, latest: str, threshold: int = default_threshold, entries: dict = None,
+                 pack_size: int = default_pack_size):
+        """
+        :param latest: the snapshot directory files are packed for, the index keys are relative to it
+        :param threshold: files smaller than this are packed
+        :param entries: index of the previous snapshot, the entries are kept until replaced or discarded
+        :param pack_size: a new pack is started once the current one reaches this size
+        """
+        self._path = os.path.join(fileUtilities.metadata_dir(storage_root), packs_dir_name)
+        self._latest = os.path.abspath(latest)
+        self.threshold = threshold
+        self.entries = dict(entries) if entries is not None else {}
+        self._pack_size = pack_size
+        self._run_id = '{}-{}'.format(time.time_ns(), os.getpid())
+        self._lock = threading.Lock()
+        self._pack = None
+        self._pack_name = None
+        self._packs_written = 0
+        self.files = 0
+        self.bytes_packed = 0
+
+    def handles(self, src: str, dst: str) -> bool:
+        """
+        :return: True if src is small enough to be packed and dst is in the snapshot the store packs for
+        """
+        return os.path.abspath(dst).startswith(self._latest + os.sep) and os.path.getsize(src) < self.threshold
+
+    def _open_pack(self):
+        if self._pack is not None:
+            self._close_pack()
+        os.makedirs(self._path, exist_ok=True)
+        self._packs_written += 1
+        self._pack_name = '{}-{}{}'.format(self._run_id, self._packs_written, pack_suffix)
+        self._pack = open(os.path.join(self._path, self._pack_name), 'xb')
+
+    def _close_pack(self):
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+        self._pack.close()
+        self._pack = None
+
+    def pack_file(self, src: str, dst: str) -> str:
+        """
+        Appends src to the current pack and records it in the index under the path of dst, dst is not created
+        :return: dst
+        """
+        rel = os.path.relpath(os.path.abspath(dst), self._latest)
+        # stat'ed before the read, a file changing while it is read differs from the manifest on the next run
+        st = os.stat(src)
+        with open(src, 'rb') as f:
+            data = f.read()
+        with self._lock:
+            if self._pack is None or self._pack.tell() >= self._pack_size:
+                self._open_pack()
+            offset = self._pack.tell()
+            self._pack.write(data)
+            self.entries[rel] = (self._pack_name, offset, len(data), st.st_mtime_ns, st.st_mode)
+            self.files += 1
+            self.bytes_packed += len(data)
+        return dst
+
+    def discard(self, rel: str, is_dir: bool = False):
+        """
+        Drops the packed file rel, or every packed file below the directory rel, from the index
+        """
+        with self._lock:
+            if not is_dir:
+                self.entries.pop(rel, None)
+                return
+            prefix = rel + os.sep
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+    def holds(self, rel: str) -> bool:
+        """
+        :return: True if rel, or a file below the directory rel, is packed
+        """
+        if rel in self.entries:
+            return True
+        prefix = rel + os.sep
+        return any(key.startswith(prefix) for key in self.entries)
+
+    def write_index(self, snapshot_dir: str):
+        """
+        Flushes the pack being written to disk and then writes the index of snapshot_dir, the index never refers to
+        data that is not on disk yet
+        """
+        with self._lock:
+            if self._pack is not None:
+                self._close_pack()
+        write_index(index_path(snapshot_dir), self.entries, self.threshold)
+
+    def close(self):
+        with self._lock:
+            if self._pack is not None:
+                self._close_pack()
+
+    def summary(self) -> str:
+        kept = sum(1 for entry in self.entries.values() if not entry[0].startswith(self._run_id))
+        return '{} files packed ({} bytes), {} kept by reference'.format(self.files, self.bytes_packed, kept)
+
+
+def pack_dir(storage_root: str) -> str:
+    return os.path.join(storage_root, fileUtilities.metadata_dir_name, packs_dir_name)
+
+
+def read_packed(storage_root: str, entry: tuple) -> bytes:
+    """
+    :param entry: index entry (pack, offset, size, mtime_ns, mode)
+    :return: contents of the packed file
+    """
+    pack, offset, size = entry[:3]
+    with open(os.path.join(pack_dir(storage_root), pack), 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+    if len(data) != size:
+        raise Exception(f'Pack {pack} is truncated, read {len(data)} of {size} bytes at {offset}')
+    return data
+
+
+def extract(snapshot_dir: str, output: str, verbose: bool = False) -> int:
+    """
+    Writes the packed files of a snapshot into the tree of it restored in output, each gets the permissions and
+    times it was packed with. The directories holding them get the times of the snapshot directories back.
+    :return: number of files extracted
+    """
+    storage_root = os.path.dirname(os.path.abspath(snapshot_dir))
+    _, entries = read_index(index_path(snapshot_dir))
+    directories = set()
+    # one pack open at a time, the entries of a pack are read in order
+    for rel, entry in sorted(entries.items(), key=lambda item: (item[1][0], item[1][1])):
+        dst = os.path.join(output, rel)
+        parent = os.path.dirname(rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        directories.add(parent)
+        if verbose:
+            print(f'Extracting {rel}')
+        with open(dst, 'wb') as f:
+            f.write(read_packed(storage_root, entry))
+        os.chmod(dst, entry[4] & 0o7777)
+        os.utime(dst, ns=(entry[3], entry[3]))
+    for rel in sorted(directories, key=lambda d: d.count(os.sep), reverse=True):
+        snapshot_directory = os.path.join(snapshot_dir, rel)
+        if os.path.isdir(snapshot_directory):
+            shutil.copystat(snapshot_directory, os.path.join(output, rel))
+    return len(entries)
+
+
+def same_packed_files(src: str, dst: str, shallow: bool = True, ignore_files=None) -> bool:
+    """
+    Compares the packed files of two snapshot directories, the part of them compare_trees does not see. Entries
+    pointing at the same bytes of a pack are the same, otherwise the size and mtime are compared like filecmp does
+    and the contents when they differ or shallow is False. A file packed in one snapshot and stored as a file in the
+    other (the threshold changed) makes the snapshots differ.
+    :param ignore_files: IgnoreFilesFilter, matching paths are left out
+    """
+    _, src_entries = read_index(index_path(src))
+    _, dst_entries = read_index(index_path(dst))
+    if ignore_files is not None:
+        src_entries = {rel: entry for rel, entry in src_entries.items() if not ignore_files.path_excluded(rel, False)}
+        dst_entries = {rel: entry for rel, entry in dst_entries.items() if not ignore_files.path_excluded(rel, False)}
+    if src_entries.keys() != dst_entries.keys():
+        return False
+    storage_root = os.path.dirname(os.path.abspath(src))
+    for rel, src_entry in src_entries.items():
+        dst_entry = dst_entries[rel]
+        if src_entry[:3] == dst_entry[:3]:
+            continue
+        if src_entry[2] != dst_entry[2]:
+            return False
+        if shallow and src_entry[3] == dst_entry[3]:
+            continue
+        if read_packed(storage_root, src_entry) != read_packed(storage_root, dst_entry):
+            return False
+    return True
+
+
+def collect_garbage(storage_root: str, verbose: bool = False) -> int:
+    """
+    Removes the packs no pack index of the backup set refers to any more (e.g. after snapshots were purged), the
+    packs of a run that is going on are not referred to yet, so this is only run when no backup is running
+    :return: number of packs removed
+    """
+    root = os.path.abspath(storage_root)
+    packs = pack_dir(root)
+    if not os.path.isdir(packs):
+        return 0
+    used = set()
+    for name in os.listdir(root):
+        if name.endswith(backupManifest.pack_index_suffix):
+            _, entries = read_index(os.path.join(root, name))
+            used.update(entry[0] for entry in entries.values())
+
+    removed = 0
+    for name in os.listdir(packs):
+        if name.endswith(pack_suffix) and name not in used:
+            os.remove(os.path.join(packs, name))
+            removed += 1
+            if verbose:
+                print(f'Removed pack {name}')
+    return removed
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="packStore.py\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Lists or extracts the small files incrementalBackup.py "
+                                                 "--pack_threshold stored in packs, or removes\n\tthe packs no "
+                                                 "snapshot refers to.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    listing = subparsers.add_parser('list', help='List the packed files of a snapshot.')
+    listing.add_argument('snapshot', type=str, help='snapshot directory')
+
+    extract_parser = subparsers.add_parser('extract', help='Write the packed files of a snapshot into a directory '
+                                                           '(e.g. a copy of the snapshot).')
+    extract_parser.add_argument('snapshot', type=str, help='snapshot directory')
+    extract_parser.add_argument('output', type=str, help='directory to write them to')
+    extract_parser.add_argument('-v', '--verbose', action='store_true', help='List the files extracted.')
+
+    gc = subparsers.add_parser('gc', help='Remove packs not used by any snapshot.')
+    gc.add_argument('root', type=str, help='root backup directory')
+    gc.add_argument('-v', '--verbose', action='store_true', help='List the packs removed.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = init_args()
+    if args.command == 'list':
+        header, index = read_index(index_path(args.snapshot))
+        for rel, entry in sorted(index.items()):
+            print(f'[ {entry[2]:>10} ] : [ {entry[0]}@{entry[1]} ] : [ {rel} ]')
+        if header is not None:
+            print(f'[ Packed ] : [ {len(index)} files smaller than {header["threshold"]} bytes ]')
+    elif args.command == 'extract':
+        count = extract(args.snapshot, args.output, args.verbose)
+        print(f'[ Extracted ] : [ {count} files {args.snapshot} -> {args.output} ]')
+    else:
+        print(f'[ Removed ] : [ {collect_garbage(args.root, args.verbose)} packs ]')
@@ -4,13 +4,18 @@
 # Copyright (C) 2023
 
 import argparse
+import json
 import os
 import filecmp
 import shutil
 import stat
+import time
 
 version = '1.0'
 
+purge_state_file_name = 'purge_state.json'
+purge_state_version = 1
+
 from distutils import log
 
 log.set_verbosity(log.INFO)
@@ -18,60 +23,324 @@ log.set_threshold(log.INFO)
 
 from incrementalBackup import compare_replace_and_remove
 from incrementalBackup import IgnoreFilesFilter
+from backupManifest import snapshot_sidecars
+import backupManifest
+import contentStore
+import deletionEngine
+import deltaStorage
+import fileUtilities
+import packStore
+import runReport
+import snapshotCatalog
+import treeIndex
+import virtualSnapshot
+
+
+class CompareStats:
+    """
+    Counts the file comparisons made by compare_trees when shallow is off
+    """
+
+    def __init__(self):
+        self.compared = 0
+        self.by_inode = 0
+        self.by_content = 0
+
+    def summary(self) -> str:
+        return f'{self.compared} files compared, {self.by_inode} by inode identity, {self.by_content} by content'
+
 
+class PurgeState:
+    """
+    What earlier purges of a backup set found, kept in its metadata directory: the outcome of every pair of
+    snapshots compared with the fingerprints the two had, and the time of each snapshot. A pair whose snapshots still
+    have the same fingerprints is not compared again, so a purge only compares the snapshots that arrived since the
+    last one with their neighbours, however long the history is. Outcomes are only reused with the same comparison
+    options.
+
+    A fingerprint is the inode and mtime of the snapshot directory (or virtual snapshot) and the size and mtime of
+    its manifest. Snapshots are not changed once they are made, but a change made by hand deep inside one is not
+    seen (--full compares every pair again), so a pair found the same is compared again before a snapshot is deleted
+    for it: a saved outcome never deletes anything by itself.
+    """
 
-def compare_directories(src: str, dst: str, verbose: bool = False, shallow: bool = True, ignore_files: IgnoreFilesFilter = None):
+    def __init__(self, storage_root: str, options: dict, reuse: bool = True):
+        """
+        :param options: comparison options, the saved outcomes are dropped when they differ
+        :param reuse: False compares every pair again, the outcomes are still saved for the next purge
+        """
+        self._path = os.path.join(fileUtilities.metadata_dir(storage_root, False), purge_state_file_name)
+        self._options = options
+        self._fingerprints = {}
+        self._snapshots = {}
+        self._pairs = {}
+        self.reused = 0
+        if not reuse or not os.path.isfile(self._path):
+            return
+        try:
+            with open(self._path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'[ Purge State ] : [ Could not read {self._path}, comparing every pair ({e}) ]')
+            return
+        if state.get('version') != purge_state_version:
+            return
+        self._snapshots = state.get('snapshots', {})
+        if state.get('options') == options:
+            self._pairs = state.get('pairs', {})
+
+    def fingerprint(self, path: str) -> list:
+        fingerprint = self._fingerprints.get(path)
+        if fingerprint is None:
+            st = os.stat(path)
+            fingerprint = [st.st_ino, st.st_mtime_ns, 0, 0]
+            manifest = backupManifest.manifest_path(path)
+            if not virtualSnapshot.is_virtual_snapshot(path) and os.path.isfile(manifest):
+                manifest_st = os.stat(manifest)
+                fingerprint[2:] = [manifest_st.st_size, manifest_st.st_mtime_ns]
+            self._fingerprints[path] = fingerprint
+        return fingerprint
+
+    def snapshot_time(self, path: str) -> float:
+        """
+        virtualSnapshot.snapshot_time, read from the state while the snapshot keeps its fingerprint
+        """
+        name = os.path.basename(path)
+        saved = self._snapshots.get(name)
+        if saved is not None and saved['fingerprint'] == self.fingerprint(path):
+            return saved['time']
+        taken = virtualSnapshot.snapshot_time(path)
+        self._snapshots[name] = {'fingerprint': self.fingerprint(path), 'time': taken}
+        return taken
+
+    @staticmethod
+    def _key(src: str, dst: str) -> str:
+        # names of snapshots never hold a /
+        return os.path.basename(src) + '/' + os.path.basename(dst)
+
+    def outcome(self, src: str, dst: str, same: bool = True):
+        """
+        :param same: False only reuses the outcomes that found a difference, a pair found the same is compared again
+        :return: True or False if the pair was compared before and neither snapshot changed since, None otherwise
+        """
+        saved = self._pairs.get(self._key(src, dst))
+        if saved is None or saved[0] != self.fingerprint(src) or saved[1] != self.fingerprint(dst):
+            return None
+        if saved[2] and not same:
+            return None
+        self.reused += 1
+        return saved[2]
+
+    def record(self, src: str, dst: str, same: bool):
+        self._pairs[self._key(src, dst)] = [self.fingerprint(src), self.fingerprint(dst), same]
+
+    def save(self, snapshots: list):
+        """
+        Writes the state atomically (temporary file then rename), what is saved about snapshots no longer in the set
+        is dropped
+        :param snapshots: paths of the snapshots of the set
+        """
+        names = set(os.path.basename(path) for path in snapshots)
+        state = {'version': purge_state_version,
+                 'options': self._options,
+                 'snapshots': {name: saved for name, saved in self._snapshots.items() if name in names},
+                 'pairs': {key: saved for key, saved in self._pairs.items()
+                           if all(name in names for name in key.split('/'))}}
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path)
+
+
+def compare_files_by_hash(src: str, dst: str, files: list, hash_cache: contentStore.HashCache):
+    """
+    Deep comparison of the files found in both src and dst, files of different sizes differ without being read,
+    the others are compared by content hash (from the cache or hashed in parallel)
+    :return: (mismatch, errors) lists of names, the same as filecmp.cmpfiles
+    """
+    mismatch = []
+    errors = []
+    to_hash = []
+    for name in files:
+        try:
+            if os.path.getsize(os.path.join(src, name)) != os.path.getsize(os.path.join(dst, name)):
+                mismatch.append(name)
+            else:
+                to_hash.append(name)
+        except OSError:
+            errors.append(name)
+
+    digests = hash_cache.digests([os.path.join(src, name) for name in to_hash] +
+                                 [os.path.join(dst, name) for name in to_hash])
+    for name, src_digest, dst_digest in zip(to_hash, digests[:len(to_hash)], digests[len(to_hash):]):
+        if src_digest is None or dst_digest is None:
+            errors.append(name)
+        elif src_digest != dst_digest:
+            mismatch.append(name)
+    return mismatch, errors
+
+
+def _scan_tree(path: str, ignore_files: IgnoreFilesFilter, names: treeIndex.NameTable, tree_cache: dict,
+               keep: str = None) -> treeIndex.TreeIndex:
+    """
+    :return: TreeIndex of a snapshot, from tree_cache when it was scanned for the previous comparison
     """
-    Does a comparison of two directories and all subdirectories looking for a difference.
-    If a difference is found False is returned.
-    
+    tree = tree_cache.get(path)
+    if tree is None:
+        # only the other side of this comparison can be compared again
+        for cached in [cached for cached in tree_cache if cached != keep]:
+            del tree_cache[cached]
+        # files stored as blocks are compared by the size of the file they restore to
+        tree = treeIndex.TreeIndex.scan(path, ignore_files, names, deltaStorage.snapshot_recipes(path))
+        tree_cache[path] = tree
+    return tree
+
+
+def compare_trees(src: str, dst: str, verbose: bool = False, shallow: bool = True, ignore_files: IgnoreFilesFilter = None,
+                  identity: bool = True, stats: CompareStats = None, hash_cache: contentStore.HashCache = None,
+                  names: treeIndex.NameTable = None, tree_cache: dict = None):
+    """
+    Does a comparison of two directories and all subdirectories looking for a difference, made on a
+    treeIndex.TreeIndex of each side: both trees are scanned into compact columns and joined in one pass instead of
+    building a filecmp.dircmp per directory. Files whose os.stat signatures differ but have the same size are equal if
+    their contents are (as filecmp.cmp decides).
+
     :param src: left side compares to right
     :param dst: right side compares to left
     :param verbose: outputs info if true
     :param shallow: same as filecmp.cmp definition of shallow
     :param ignore_files: list of files to ignore (can use wild card)
+    :param identity: when shallow is off files that are the same inode are equal without reading them
+    :param stats: CompareStats counting the comparisons made
+    :param hash_cache: when shallow is off files are compared by cached content hashes instead of filecmp
+
+    :param names: treeIndex.NameTable shared by the snapshots compared
+    :param tree_cache: dict of path -> TreeIndex, a snapshot compared again (the left side stays the same until
+                       a difference is found) is not scanned again
     :return: True if same, False if different
     """
+    if stats is None:
+        stats = CompareStats()
+    if names is None:
+        names = treeIndex.NameTable()
+    if tree_cache is None:
+        tree_cache = {}
+    left = _scan_tree(src, ignore_files, names, tree_cache, dst)
+    right = _scan_tree(dst, ignore_files, names, tree_cache, src)
+    tree_diff = treeIndex.diff(left, right)
+
+    to_read = []
+    changed = []
+    for left_row, right_row in tree_diff.changed:
+        if not left.is_dir(left_row) and not right.is_dir(right_row) and left.size[left_row] == right.size[right_row]:
+            to_read.append((left_row, right_row))
+        else:
+            changed.append(left.path(left_row))
+    if len(tree_diff.added) or len(tree_diff.removed) or changed:
+        if verbose:
+            print(f'Difference in {src} when compared to {dst} ({tree_diff.summary()})')
+            # only the first of each, a new directory adds every entry below it
+            if len(tree_diff.removed):
+                print(f'The following where only found in left side [{src}]:\n '
+                      f'{[left.path(row) for row in tree_diff.removed[:10]]}')
+            if len(tree_diff.added):
+                print(f'The following where only found in right side [{dst}]:\n '
+                      f'{[right.path(row) for row in tree_diff.added[:10]]}')
+            if changed:
+                print(f'The following different files were found in {dst}:\n {changed[:10]}')
+        return False
+
+    if not shallow:
+        same_files = [(left_row, right_row) for left_row, right_row in tree_diff.same if not left.is_dir(left_row)]
+        stats.compared += len(same_files)
+        if identity and left.dev == right.dev:
+            # the same inode (hard links made by create_links_of_files) is the same file
+            to_compare = [(left_row, right_row) for left_row, right_row in same_files
+                          if left.ino[left_row] != right.ino[right_row]]
+            stats.by_inode += len(same_files) - len(to_compare)
+            same_files = to_compare
+        stats.by_content += len(same_files)
+        to_read += same_files
+    if to_read:
+        files = [left.path(left_row) for left_row, _ in to_read]
+        # a recipe on either side is compared by the contents it restores to, the hash cache keeps file contents
+        recipes = [rel for rel in files if rel in left.sizes or rel in right.sizes]
+        mismatch = []
+        if recipes:
+            storage_root = os.path.dirname(left.root)
+            mismatch = [rel for rel in recipes
+                        if not deltaStorage.same_contents(os.path.join(src, rel), os.path.join(dst, rel), storage_root,
+                                                          rel in left.sizes, rel in right.sizes)]
+            files = [rel for rel in files if rel not in left.sizes and rel not in right.sizes]
+        if hash_cache is not None:
+            file_mismatch, errors = compare_files_by_hash(src, dst, files, hash_cache)
+        else:
+            _, file_mismatch, errors = filecmp.cmpfiles(src, dst, files, shallow=False)
+        mismatch += file_mismatch
+        if mismatch:
+            if verbose:
+                print(f'The following files did not match when comparing {src} to {dst}:\n {mismatch[:10]}')
+            return False
+        if errors:
+            raise Exception(
+                f'The following files found when comparing {src} and {dst} caused errors and could not be compared.'
+                f'Files: {errors}')
+    return True
 
 
-    dir_comparison = filecmp.dircmp(src, dst)
+def compare_snapshot_digests(src: str, dst: str, verbose: bool = False, ignore_files: IgnoreFilesFilter = None,
+                             content_hash: bool = False, digest_cache: dict = None):
+    """
+    Compares two snapshots by the root of their Merkle digests (see backupManifest.compute_digests), the digests are
+    read from the digest file of each snapshot or computed and saved the first time a snapshot is compared.
 
-    if dir_comparison.funny_files or dir_comparison.common_funny:
-        raise Exception(f'There were funny files found when comparing {src} to {dst}\n'
-                        f'Funny Files: {dir_comparison.funny_files}\n'
-                        f'Common Funny Files: {dir_comparison.common_funny}'
-                        )
-    if ignore_files:
-        dir_comparison = ignore_files.filter_dircmp(dir_comparison)
+    :param src: left side compares to right
+    :param dst: right side compares to left
+    :param verbose: outputs the first directory that differs if true
+    :param ignore_files: list of files to ignore (can use wild card)
+    :param content_hash: include file content hashes in the digests
+    :param digest_cache: dict of snapshot -> digests, used to load each snapshot once per run
+    :return: True if same, False if different
+    """
+    if digest_cache is None:
+        digest_cache = {}
+    for snapshot in (src, dst):
+        if snapshot not in digest_cache:
+            if virtualSnapshot.is_virtual_snapshot(snapshot):
+                digest_cache[snapshot] = virtualSnapshot.snapshot_digests(snapshot, ignore_files, content_hash)
+            else:
+                digest_cache[snapshot] = backupManifest.snapshot_digests(snapshot, ignore_files, content_hash,
+                                                                         verbose)
 
-    if dir_comparison.right_only or dir_comparison.left_only or dir_comparison.diff_files:
+    difference = backupManifest.first_difference(digest_cache[src], digest_cache[dst])
+    if difference is None:
+        return True
+    if verbose:
+        print(f'Difference in {os.path.join(src, difference)} when compared to {os.path.join(dst, difference)}')
+    return False
 
-        if verbose:
-            print(f'Difference in {src} when compared to {dst}')
-            if dir_comparison.right_only:
-                print(f'The following where only found in right side [{src}]:\n {dir_comparison.right_only}')
-            if dir_comparison.left_only:
-                print(f'The following where only found in left side [{dst}]:\n {dir_comparison.left_only}')
-            if dir_comparison.diff_files:
-                print(f'The following different files were found in {dst}:\n {dir_comparison.diff_files}')
 
+def compare_snapshot_catalog(catalog: snapshotCatalog.SnapshotCatalog, seq_src: int, seq_dst: int, src: str, dst: str,
+                             verbose: bool = False, ignore_files: IgnoreFilesFilter = None):
+    """
+    Compares two snapshots by the versions the catalog records for them (names, sizes, modification times and
+    modes), nothing is read from the snapshots.
+
+    :param seq_src: catalog number of the left side, older than the right
+    :param seq_dst: catalog number of the right side
+    :param src: left side, for the messages
+    :param dst: right side, for the messages
+    :param verbose: outputs the first path that differs if true
+    :param ignore_files: paths to ignore
+    :return: True if same, False if different
+    """
+    for rel, mode in catalog.differences(seq_src, seq_dst):
+        if ignore_files is not None and ignore_files.path_excluded(rel, stat.S_ISDIR(mode)):
+            continue
+        if verbose:
+            print(f'Difference in {os.path.join(src, rel)} when compared to {os.path.join(dst, rel)}')
         return False
-    else:
-        if not shallow:
-            _, mismatch, errors = filecmp.cmpfiles(src, dst, dir_comparison.common_files, shallow=shallow)
-            if mismatch:
-                if verbose:
-                    print(f'The following files did not match when comparing {src} to {dst}:\n {mismatch}')
-                return False
-            if errors:
-                raise Exception(
-                    f'The following files found when comparing {src} and {dst} caused errors and could not be compared.'
-                    f'Files: {errors}')
-
-    for common_dir in dir_comparison.common_dirs:
-        if not compare_directories(os.path.join(src, common_dir), os.path.join(dst, common_dir), verbose, shallow):
-            return False
-
     return True
 
 
@@ -100,20 +369,55 @@ def init_args():
                                                                      'and modification time) to determine if files '
                                                                      'are equal')
     parser.add_argument('-i','--ignore_list',type=str,help='List of directory/file names to exclude, can use patterns,'
-                                                           'seperated by comma (e.g  -i test,logs,*.exe)')
+                                                           'seperated by comma (e.g  -i test,logs,*.exe), patterns with a / are\n'
+                                                           'matched against the path inside the snapshot (see incrementalBackup.py -o)')
+    parser.add_argument('--ignore_file', type=str, help='File of patterns to exclude, one per line, applied after -i.')
+    parser.add_argument('--no_identity', action='store_true', help='Without --shallow read and compare files even '
+                                                                   'when both sides are the same inode (hard link).')
+    parser.add_argument('-m', '--merkle', action='store_true', help='Compare snapshots by their Merkle digests (names, '
+                                                                    'sizes and modification times), computed once\n'
+                                                                    'per snapshot and stored next to it.')
+    parser.add_argument('-c', '--catalog', action='store_true', help='Take the snapshots and their order from the '
+                                                                     'snapshot catalog (see snapshotCatalog.py) and '
+                                                                     'compare\nthem by the versions it records, no '
+                                                                     'snapshot is listed or read.')
+    parser.add_argument('--content_hash', action='store_true', help='With --merkle include a hash of every file '
+                                                                    'in the digests.')
+    parser.add_argument('-w', '--workers', type=int, default=contentStore.default_hash_workers,
+                        help='Threads hashing files when --shallow is off (default {}).'
+                             ''.format(contentStore.default_hash_workers))
+    parser.add_argument('--no_hash_cache', action='store_true', help='Without --shallow compare files byte by byte '
+                                                                     'instead of by content hashes cached\nper inode '
+                                                                     'in the backup set (.backupMeta/hash_cache.db).')
+    parser.add_argument('--delete_workers', type=int, default=deletionEngine.default_workers,
+                        help='Threads deleting the duplicate snapshots (default {}).'.format(deletionEngine.default_workers))
+    parser.add_argument('--trash', action='store_true', help='Move the duplicate snapshots to the trash of the backup '
+                                                             'set (.backupMeta/trash) and delete\nthem in a background '
+                                                             'process, the purge returns right away.')
+    parser.add_argument('--full', action='store_true', help='Compare every pair of snapshots again, by default the '
+                                                            'pairs an earlier purge compared\n(.backupMeta/'
+                                                            'purge_state.json) are not compared again while neither '
+                                                            'snapshot changed\n(a pair found the same is always '
+                                                            'compared again before a snapshot is deleted).')
+    parser.add_argument('--report', type=str, help='Write the time of each phase and the counters of the run to this '
+                                                   'file when it ends,\nin the Prometheus text format if it ends in '
+                                                   '.prom, JSON otherwise.')
+    parser.add_argument('--profile', type=str, help='Profile the run with cProfile, the stats are saved to this file '
+                                                    'and the hottest functions printed.')
 
     return parser.parse_args()
 
 
 line_break = '[==============================================================================]'
 
-def remove_readonly(func, path, _):
-    "Clear readonly bit when deleting files to avoid WinError 5 that occurs when deleting files that are readonly"
-    os.chmod(path, stat.S_IWRITE)
-    func(path)
-
 def search_and_destroy(root_dir: str, verbose: bool = False, destroy: bool = False, prompt_before_destroy: bool = True,
-                       shallow: bool = True,  ignore_files: IgnoreFilesFilter = None):
+                       shallow: bool = True,  ignore_files: IgnoreFilesFilter = None, merkle: bool = False,
+                       content_hash: bool = False, identity: bool = True, workers: int = contentStore.default_hash_workers,
+                       use_hash_cache: bool = True, use_catalog: bool = False,
+                       delete_workers: int = deletionEngine.default_workers, trash: bool = False, full: bool = False):
+    """
+    :param full: compare every pair of snapshots, not only the ones the results saved by earlier purges do not cover
+    """
     if not os.path.isdir(root_dir):
         print(f"There was no directory {root_dir}")
         return
@@ -126,8 +430,34 @@ def search_and_destroy(root_dir: str, verbose: bool = False, destroy: bool = Fal
             print('Running purge of duplicate backups will prompt before deleting data.')
 
     root = os.path.abspath(root_dir)
-    dirs = [os.path.join(root, d) for d in os.listdir(root) if os.path.isdir(os.path.join(root, d))]
-    dirs_sorted = sorted(dirs, key=lambda d: os.path.getctime(d))
+    state = PurgeState(root, {'shallow': shallow, 'merkle': merkle, 'content_hash': content_hash,
+                              'identity': identity, 'catalog': use_catalog,
+                              'ignore_list': ignore_files.ignore_list if ignore_files is not None else None},
+                       not full)
+    catalog = None
+    catalog_seqs = {}
+    if use_catalog or snapshotCatalog.SnapshotCatalog.exists(root):
+        # kept up to date with the snapshots deleted even when it is not used to find them
+        catalog = snapshotCatalog.SnapshotCatalog(root, create=False)
+    with runReport.phase('list_snapshots'):
+        if use_catalog:
+            for seq, name, _, _ in catalog.snapshots():
+                path = os.path.join(root, name)
+                if not os.path.exists(path):
+                    print(f'[ Catalog ] : [ {name} no longer exists, removing it from the catalog ]')
+                    catalog.remove_snapshot(name)
+                    continue
+                catalog_seqs[path] = seq
+            dirs = list(catalog_seqs)
+            dirs_sorted = list(dirs)
+        else:
+            # virtual snapshots (manifest only) are in the timeline too, every snapshot is placed by the time its
+            # manifest was taken, a LATEST updated in place keeps its old ctime
+            dirs = [os.path.join(root, d) for d in os.listdir(root)
+                    if (os.path.isdir(os.path.join(root, d)) and d != fileUtilities.metadata_dir_name)
+                    or d.endswith(virtualSnapshot.vsnap_suffix)]
+            dirs_sorted = sorted(dirs, key=state.snapshot_time)
+    runReport.set_value('snapshots', len(dirs))
 
     keep_oldest = dirs_sorted.pop()
     if verbose:
@@ -137,6 +467,15 @@ def search_and_destroy(root_dir: str, verbose: bool = False, destroy: bool = Fal
         print(f'Going to compare directories starting with oldest: {dirs_sorted}')
 
     dirs_to_destroy = []
+    duplicate_of = {}
+    digest_cache = {}
+    compare_stats = CompareStats()
+    names = treeIndex.NameTable()
+    tree_cache = {}
+    hash_cache = None
+    if not shallow and not merkle and not use_catalog and use_hash_cache:
+        hash_cache = contentStore.HashCache(root, workers)
+    compare_start = time.perf_counter()
     curr_dir_index = 0
     while curr_dir_index < len(dirs_sorted) - 1:
         curr_dir = dirs_sorted[curr_dir_index]
@@ -149,8 +488,37 @@ def search_and_destroy(root_dir: str, verbose: bool = False, destroy: bool = Fal
             # todo use this if you want info on all the differences
             # directories_match_a = not compare_replace_and_remove(curr_dir, dirs_sorted[next_dir_index], True, test=True)
 
-            directories_match = compare_directories(curr_dir, dirs_sorted[next_dir_index], verbose=True,
-                                                    shallow=shallow, ignore_files=ignore_files)
+            # a snapshot is only deleted for a pair compared by this purge
+            directories_match = state.outcome(curr_dir, dirs_sorted[next_dir_index], not destroy)
+            if directories_match is not None:
+                if verbose:
+                    print('Same result as the last purge, neither snapshot changed since')
+            elif use_catalog:
+                directories_match = compare_snapshot_catalog(catalog, catalog_seqs[curr_dir],
+                                                             catalog_seqs[dirs_sorted[next_dir_index]], curr_dir,
+                                                             dirs_sorted[next_dir_index], verbose=True,
+                                                             ignore_files=ignore_files)
+            elif merkle or virtualSnapshot.is_virtual_snapshot(curr_dir) \
+                    or virtualSnapshot.is_virtual_snapshot(dirs_sorted[next_dir_index]):
+                # a virtual snapshot has no tree to walk, it is compared by the digests of its manifest
+                directories_match = compare_snapshot_digests(curr_dir, dirs_sorted[next_dir_index], verbose=True,
+                                                             ignore_files=ignore_files, content_hash=content_hash,
+                                                             digest_cache=digest_cache)
+                if directories_match and not virtualSnapshot.is_virtual_snapshot(curr_dir) \
+                        and not virtualSnapshot.is_virtual_snapshot(dirs_sorted[next_dir_index]):
+                    # digests computed from the tree (no usable digest file) do not see the packed files
+                    directories_match = packStore.same_packed_files(curr_dir, dirs_sorted[next_dir_index],
+                                                                    not content_hash, ignore_files)
+            else:
+                directories_match = compare_trees(curr_dir, dirs_sorted[next_dir_index], verbose=True,
+                                                  shallow=shallow, ignore_files=ignore_files, identity=identity,
+                                                  stats=compare_stats, hash_cache=hash_cache, names=names,
+                                                  tree_cache=tree_cache)
+                if directories_match:
+                    # the small files of a snapshot made with --pack_threshold are not in its tree
+                    directories_match = packStore.same_packed_files(curr_dir, dirs_sorted[next_dir_index], shallow,
+                                                                    ignore_files)
+            state.record(curr_dir, dirs_sorted[next_dir_index], directories_match)
 
 
             if verbose:
@@ -160,14 +528,33 @@ def search_and_destroy(root_dir: str, verbose: bool = False, destroy: bool = Fal
                 break
             else:
                 dirs_to_destroy.append(dirs_sorted[next_dir_index])
+                duplicate_of[dirs_sorted[next_dir_index]] = curr_dir
 
         curr_dir_index = next_dir_index
+    runReport.add_time('compare', time.perf_counter() - compare_start)
+    runReport.set_value('duplicates', len(dirs_to_destroy))
+    runReport.set_value('pairs_reused', state.reused)
+    print(f'[ Purge State ] : [ {state.reused} comparisons reused from earlier purges ]')
+    state.save(dirs)
+
+    if not shallow and not merkle and not use_catalog:
+        print(f'[ File Comparisons ] : [ {compare_stats.summary()} ]')
+        runReport.set_value('files_compared', compare_stats.compared)
+        runReport.set_value('files_by_inode', compare_stats.by_inode)
+        runReport.set_value('files_by_content', compare_stats.by_content)
+    if hash_cache is not None:
+        print(f'[ Hash Cache ] : [ {hash_cache.summary()} ]')
+        runReport.set_value('files_hashed', hash_cache.hashed_files)
+        runReport.set_value('bytes_hashed', hash_cache.hashed_bytes)
+        hash_cache.close()
 
     if dirs_to_destroy:
         print(f'\nThe directories which are the same and can be be removed are:\n')
         print('\n'.join(dirs_to_destroy))
     else:
         print('No duplicate directories found.')
+        if catalog is not None:
+            catalog.close()
         return
 
     if destroy:
@@ -180,14 +567,50 @@ def search_and_destroy(root_dir: str, verbose: bool = False, destroy: bool = Fal
             proceed_to_destroy = True
 
         if proceed_to_destroy:
+            content_index = None
+            if contentStore.ContentIndex.exists(root):
+                content_index = contentStore.ContentIndex(root)
+            deletion_engine = deletionEngine.DeletionEngine(delete_workers,
+                                                            deletionEngine.trash_dir(root) if trash else None)
             for dir in dirs_to_destroy:
                 print(f'Deleting {dir}')
-                shutil.rmtree(dir, onerror=remove_readonly )
+                if virtualSnapshot.is_virtual_snapshot(dir):
+                    os.remove(dir)
+                else:
+                    with runReport.phase('delete'):
+                        deletion_engine.remove(dir)
+                        # the sidecars and the catalog entry go once the snapshot is gone
+                        deletion_engine.wait()
+                for sidecar in snapshot_sidecars(dir):
+                    os.remove(sidecar)
+                if catalog is not None:
+                    catalog.remove_snapshot(os.path.basename(dir))
+                if content_index is not None:
+                    # the directory kept holds the same files
+                    content_index.rename_snapshot(os.path.basename(dir), os.path.basename(duplicate_of[dir]))
+            if content_index is not None:
+                content_index.close()
+            deletion_engine.close()
+            print(f'[ Deleted ] : [ {deletion_engine.summary()} ]')
+            runReport.set_value('files_deleted', deletion_engine.files)
+            # versions kept only for the virtual snapshots deleted
+            with runReport.phase('delete'):
+                removed = virtualSnapshot.ObjectStore(root, create=False).collect_garbage(
+                    virtualSnapshot.list_virtual_snapshots(root), verbose)
+            if removed:
+                print(f'[ Objects ] : [ {removed} versions no virtual snapshot refers to removed ]')
+            with runReport.phase('delete'):
+                removed = packStore.collect_garbage(root, verbose)
+            if removed:
+                print(f'[ Packs ] : [ {removed} packs no snapshot refers to removed ]')
+    if catalog is not None:
+        catalog.close()
 
 
 if __name__ == "__main__":
 
     args = init_args()
+    run_report = runReport.start('purgeDuplicateBackups', args.report, args.profile)
     destroy = args.destroy
     prompt_before_death = not args.no_prompt
 
@@ -198,6 +621,10 @@ if __name__ == "__main__":
             if len(ignore_list[0]) <1:
                 ignore_list = None
 
-    ignore_filter = IgnoreFilesFilter(ignore_list)
+    ignore_filter = IgnoreFilesFilter(ignore_list, args.ignore_file)
 
-    search_and_destroy(args.root, args.verbose, destroy, prompt_before_death, args.shallow, ignore_filter)
+    search_and_destroy(args.root, args.verbose, destroy, prompt_before_death, args.shallow, ignore_filter,
+                       args.merkle, args.content_hash, not args.no_identity, args.workers, not args.no_hash_cache,
+                       args.catalog, args.delete_workers, args.trash, args.full)
+    run_report.finish()
+    print(f'[ Timing ] : [ {run_report.summary()} ]')
@@ -0,0 +1,99 @@
+# Restore Backup Script
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import os
+from datetime import datetime
+
+import deltaStorage
+import fileUtilities
+import packStore
+import virtualSnapshot
+
+version = '1.0'
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="restoreBackup.py\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Lists the snapshots of a backup set made by incrementalBackup.py and "
+                                                 "rebuilds the tree of any of them,\n\tvirtual snapshots (--virtual) "
+                                                 "included.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    listing = subparsers.add_parser('list', help='List the snapshots of a backup set, oldest first.')
+    listing.add_argument('root', type=str, help='root backup directory')
+
+    restore = subparsers.add_parser('restore', help='Rebuild the tree of a snapshot.')
+    restore.add_argument('root', type=str, help='root backup directory')
+    restore.add_argument('snapshot', type=str, help='name of the snapshot (directory or .vsnap, see list)')
+    restore.add_argument('output', type=str, help='directory to create')
+    restore.add_argument('-l', '--link', action='store_true',
+                         help='Hard link the files of a virtual snapshot instead of copying them (nothing is copied,\n'
+                              'but changing a restored file changes the backup).')
+    restore.add_argument('-c', '--copy_method', type=str, default=fileUtilities.default_copy_method,
+                         choices=fileUtilities.copy_methods,
+                         help='First method tried when copying (default {}).'.format(fileUtilities.default_copy_method))
+    restore.add_argument('-v', '--verbose', action='store_true', help='List the files restored.')
+
+    gc = subparsers.add_parser('gc', help='Remove the versions kept for virtual snapshots that no longer exist.')
+    gc.add_argument('root', type=str, help='root backup directory')
+    gc.add_argument('-v', '--verbose', action='store_true', help='List the versions removed.')
+    return parser.parse_args()
+
+
+def list_snapshots(root: str) -> list:
+    """
+    :return: paths of the snapshot directories and virtual snapshots of a backup set, oldest first
+    """
+    root = os.path.abspath(root)
+    snapshots = [os.path.join(root, name) for name in os.listdir(root)
+                 if name != fileUtilities.metadata_dir_name
+                 and (os.path.isdir(os.path.join(root, name)) or name.endswith(virtualSnapshot.vsnap_suffix))]
+    return sorted(snapshots, key=virtualSnapshot.snapshot_time)
+
+
+def restore_snapshot(root: str, snapshot: str, output: str, link: bool = False,
+                     method: str = fileUtilities.default_copy_method, verbose: bool = False) -> list:
+    """
+    Rebuilds a snapshot in output, files stored as blocks are reassembled and packed files extracted
+    :param snapshot: name or path of a snapshot directory or virtual snapshot
+    :return: relative paths of the files that could not be restored
+    """
+    path = snapshot if os.path.isabs(snapshot) else os.path.join(os.path.abspath(root), snapshot)
+    if not os.path.exists(path) and os.path.isfile(path + virtualSnapshot.vsnap_suffix):
+        path += virtualSnapshot.vsnap_suffix
+    if virtualSnapshot.is_virtual_snapshot(path):
+        stats, missing = virtualSnapshot.materialize(path, output, link, method, verbose)
+        print(f'[ Copied ] : [ {stats.summary()} ]')
+        return missing
+    if not os.path.isdir(path):
+        raise Exception(f'No snapshot {snapshot} in {root}')
+    deltaStorage.restore_tree(path, output)
+    extracted = packStore.extract(path, output, verbose)
+    if extracted:
+        print(f'[ Extracted ] : [ {extracted} packed files ]')
+    return []
+
+
+if __name__ == '__main__':
+    args = init_args()
+    if args.command == 'list':
+        for path in list_snapshots(args.root):
+            kind = 'virtual' if path.endswith(virtualSnapshot.vsnap_suffix) else 'directory'
+            taken = datetime.fromtimestamp(virtualSnapshot.snapshot_time(path)).strftime('%Y-%m-%d %H:%M:%S')
+            print(f'[ {taken} ] : [ {kind:9} ] : [ {os.path.basename(path)} ]')
+    elif args.command == 'restore':
+        missing = restore_snapshot(args.root, args.snapshot, args.output, args.link, args.copy_method, args.verbose)
+        print(f'[ Restored ] : [ {args.snapshot} -> {args.output} ]')
+        if missing:
+            print(f'[ Missing ] : [ {len(missing)} files ]')
+            exit(1)
+    else:
+        store = virtualSnapshot.ObjectStore(args.root, create=False)
+        removed = store.collect_garbage(virtualSnapshot.list_virtual_snapshots(args.root), args.verbose)
+        print(f'[ Removed ] : [ {removed} versions ]')
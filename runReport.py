@@ -0,0 +1,167 @@
+# Run Report
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import atexit
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import re
+import socket
+import threading
+import time
+
+version = '1.0'
+
+# functions listed when a profile is printed
+profile_top = 25
+
+
+class RunReport:
+    """
+    Timers per phase and counters of a run, written as JSON or as a Prometheus textfile (node_exporter textfile
+    collector) when the run ends. Phases can nest (time spent copying is also part of the compare), counters are
+    safe to update from worker threads.
+    """
+
+    def __init__(self, script: str):
+        self.script = script
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.phases = {}
+        self.counters = {}
+        self.success = False
+        self.duration = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_value(self, name: str, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def finish(self, success: bool = True):
+        self.success = success
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._start
+        return {'script': self.script,
+                'version': version,
+                'host': socket.gethostname(),
+                'started': self.started,
+                'duration_seconds': duration,
+                'success': self.success,
+                'phases': dict(self.phases),
+                'counters': dict(self.counters)}
+
+    def to_prometheus(self) -> str:
+        prefix = re.sub(r'(?<!^)(?=[A-Z])', '_', self.script).lower()
+        report = self.to_dict()
+        lines = [f'# HELP {prefix}_phase_seconds Time spent in each phase of the last run',
+                 f'# TYPE {prefix}_phase_seconds gauge']
+        for name, seconds in report['phases'].items():
+            lines.append(f'{prefix}_phase_seconds{{phase="{name}"}} {seconds:.6f}')
+        for name, value in report['counters'].items():
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name} {value}')
+        lines += [f'# TYPE {prefix}_duration_seconds gauge',
+                  f'{prefix}_duration_seconds {report["duration_seconds"]:.6f}',
+                  f'# TYPE {prefix}_last_run_timestamp_seconds gauge',
+                  f'{prefix}_last_run_timestamp_seconds {report["started"]:.0f}',
+                  f'# TYPE {prefix}_success gauge',
+                  f'{prefix}_success {int(report["success"])}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """
+        Writes the report atomically (temporary file then rename), a .prom path is written in the Prometheus
+        text format, anything else as JSON
+        """
+        if path.endswith('.prom'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2) + '\n'
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def summary(self) -> str:
+        return ', '.join('{} {:.1f}s'.format(name, seconds) for name, seconds in self.phases.items())
+
+
+# report of the running script, the module level functions do nothing until start is called so the instrumented
+# modules can be used on their own
+_active = None
+
+
+def start(script: str, report_path: str = None, profile_path: str = None) -> RunReport:
+    """
+    Starts the report of this run, it is written when the interpreter exits (also after an error, with success 0)
+    :param script: name of the script, the prefix of the Prometheus metrics
+    :param report_path: file to write, .prom for the Prometheus text format, JSON otherwise
+    :param profile_path: if given the run is profiled with cProfile, the stats are saved there and the hottest
+                         functions printed
+    """
+    global _active
+    _active = RunReport(script)
+    profiler = None
+    if profile_path is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def at_exit(report=_active):
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f'[ Profile ] : [ {profile_path} ]')
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(profile_top)
+        if report_path is not None:
+            report.write(report_path)
+            print(f'[ Report ] : [ {report_path} ]')
+
+    atexit.register(at_exit)
+    return _active
+
+
+def active() -> RunReport:
+    return _active
+
+
+def phase(name: str):
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.phase(name)
+
+
+def add_time(name: str, seconds: float):
+    if _active is not None:
+        _active.add_time(name, seconds)
+
+
+def count(name: str, amount: int = 1):
+    if _active is not None:
+        _active.count(name, amount)
+
+
+def set_value(name: str, value):
+    if _active is not None:
+        _active.set_value(name, value)
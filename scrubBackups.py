@@ -0,0 +1,286 @@
+# Scrub Backups
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import os
+import sqlite3
+import stat
+import time
+
+import backupManifest
+import contentStore
+import fileUtilities
+import operationJournal
+import packStore
+import runReport
+
+version = '1.0'
+
+scrub_file_name = 'scrub.db'
+
+_commit_every = 1000
+
+
+class ScrubLog:
+    """
+    When each inode of a backup set was last verified, kept in sqlite in the metadata directory of the set. A scrub
+    verifies the inodes never verified first and then the ones verified longest ago, so scrubs with a time budget
+    cover the whole set over several runs.
+    """
+
+    def __init__(self, storage_root: str):
+        self._db = sqlite3.connect(os.path.join(fileUtilities.metadata_dir(storage_root), scrub_file_name))
+        self._db.execute('CREATE TABLE IF NOT EXISTS verified (dev INTEGER, ino INTEGER, verified_ns INTEGER, '
+                         'PRIMARY KEY (dev, ino))')
+        # the inodes of each snapshot walked, a snapshot is known by the time of its manifest
+        self._db.execute('CREATE TABLE IF NOT EXISTS trees (created_ns INTEGER PRIMARY KEY)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tree_inodes (created_ns INTEGER, dev INTEGER, ino INTEGER, '
+                         'path TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tree_inodes_tree ON tree_inodes (created_ns)')
+        self._db.commit()
+        self._pending = 0
+
+    def verified(self) -> dict:
+        """
+        :return: dict of (dev, ino) -> time it was last verified (ns)
+        """
+        return {(dev, ino): verified_ns for dev, ino, verified_ns in self._db.execute('SELECT * FROM verified')}
+
+    def mark(self, key: tuple, verified_ns: int):
+        self._db.execute('INSERT OR REPLACE INTO verified VALUES (?, ?, ?)', key + (verified_ns,))
+        self._pending += 1
+        if self._pending >= _commit_every:
+            self._db.commit()
+            self._pending = 0
+
+    def tree_inodes(self, created_ns: int):
+        """
+        :return: dict of (dev, ino) -> path relative to the snapshot of the snapshot whose manifest was taken at
+                 created_ns, None if it was not walked
+        """
+        if self._db.execute('SELECT 1 FROM trees WHERE created_ns = ?', (created_ns,)).fetchone() is None:
+            return None
+        return {(dev, ino): path for dev, ino, path in self._db.execute(
+            'SELECT dev, ino, path FROM tree_inodes WHERE created_ns = ?', (created_ns,))}
+
+    def save_tree(self, created_ns: int, inodes: dict):
+        """
+        :param inodes: dict of (dev, ino) -> path relative to the snapshot
+        """
+        self._db.execute('DELETE FROM tree_inodes WHERE created_ns = ?', (created_ns,))
+        self._db.executemany('INSERT INTO tree_inodes VALUES (?, ?, ?, ?)',
+                             ((created_ns,) + key + (path,) for key, path in inodes.items()))
+        self._db.execute('INSERT OR REPLACE INTO trees VALUES (?)', (created_ns,))
+        self._db.commit()
+
+    def forget_trees(self, kept):
+        """
+        Drops the inodes of the snapshots no longer in the backup set
+        :param kept: manifest times of the snapshots of the set
+        """
+        gone = [(created_ns,) for created_ns, in self._db.execute('SELECT created_ns FROM trees')
+                if created_ns not in kept]
+        self._db.executemany('DELETE FROM tree_inodes WHERE created_ns = ?', gone)
+        self._db.executemany('DELETE FROM trees WHERE created_ns = ?', gone)
+        self._db.commit()
+
+    def forget(self, keys):
+        """
+        Drops inodes no longer in the backup set (their snapshots were purged)
+        """
+        self._db.executemany('DELETE FROM verified WHERE dev = ? AND ino = ?', keys)
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+class ScrubStats:
+    """
+    Counts the inodes a scrub read and what it found
+    """
+
+    def __init__(self):
+        self.inodes = 0
+        self.scrubbed = 0
+        self.bytes = 0
+        self.recorded = 0
+        self.ok = 0
+        self.corrupt = 0
+        self.errors = 0
+
+    def summary(self) -> str:
+        return '{} of {} inodes ({} bytes), {} ok, {} checksums recorded, {} CORRUPT, {} unreadable'.format(
+            self.scrubbed, self.inodes, self.bytes, self.ok, self.recorded, self.corrupt, self.errors)
+
+
+def _walk_inodes(top: str) -> dict:
+    """
+    :return: dict of (dev, ino) -> path relative to top of the regular files below top, one path per inode
+    """
+    inodes = {}
+    stack = [top] if os.path.isdir(top) else []
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                st = entry.stat(follow_symlinks=False)
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append(entry.path)
+                elif stat.S_ISREG(st.st_mode):
+                    key = contentStore.HashCache.key(st)[:2]
+                    if key not in inodes:
+                        inodes[key] = os.path.relpath(entry.path, top)
+        runReport.count('directories_walked')
+    return inodes
+
+
+def _snapshot_time(snapshot_dir: str):
+    """
+    :return: time of the manifest of a snapshot directory nothing is writing to, None if it may still change
+             (no manifest, or a run into it was interrupted)
+    """
+    root = os.path.dirname(snapshot_dir)
+    if os.path.isfile(operationJournal.journal_path(root, snapshot_dir, False)):
+        return None
+    try:
+        return backupManifest.read_manifest_header(backupManifest.manifest_path(snapshot_dir))['created_ns']
+    except (OSError, ValueError, EOFError, KeyError):
+        return None
+
+
+def unique_inodes(storage_root: str, log: ScrubLog = None) -> dict:
+    """
+    Lists the regular files of every snapshot of a backup set, of the versions kept for virtual snapshots and the
+    packs of small files, the hard links of one inode are listed once. A snapshot does not change once a manifest
+    describes it (a run into LATEST writes a new one), with a log each snapshot is walked once and its inodes are
+    read back from the log afterwards, only new snapshots and the metadata directory are walked.
+    :param log: ScrubLog keeping the inodes of the snapshots walked
+    :return: dict of (dev, ino) -> path of one of its links
+    """
+    root = os.path.abspath(storage_root)
+    tops = [os.path.join(root, name) for name in os.listdir(root)
+            if name != fileUtilities.metadata_dir_name and os.path.isdir(os.path.join(root, name))]
+    inodes = {}
+    kept = set()
+    for top in tops:
+        created_ns = _snapshot_time(top) if log is not None else None
+        tree = log.tree_inodes(created_ns) if created_ns is not None else None
+        if tree is None:
+            tree = _walk_inodes(top)
+            if created_ns is not None:
+                log.save_tree(created_ns, tree)
+        if created_ns is not None:
+            kept.add(created_ns)
+        for key, rel in tree.items():
+            if key not in inodes:
+                inodes[key] = os.path.join(top, rel)
+    if log is not None:
+        log.forget_trees(kept)
+    for top in (os.path.join(root, fileUtilities.metadata_dir_name, fileUtilities.objects_dir_name),
+                packStore.pack_dir(root)):
+        for key, rel in _walk_inodes(top).items():
+            if key not in inodes:
+                inodes[key] = os.path.join(top, rel)
+    return inodes
+
+
+def scrub(storage_root: str, time_budget: float = None, bandwidth: int = None, verbose: bool = False) -> ScrubStats:
+    """
+    Reads every unique inode of a backup set (or as many as the time budget allows, least recently verified
+    first) and compares it with the checksum stored for it in the hash cache of the set, an inode without one has
+    its checksum recorded. A corrupt inode is corrupt in every snapshot holding a link to it.
+    :param time_budget: seconds of reading after which no new inode is started, listing the inodes is not counted
+    :param bandwidth: bytes read per second at most
+    :return: ScrubStats
+    """
+    stats = ScrubStats()
+    log = ScrubLog(storage_root)
+    hash_cache = contentStore.HashCache(storage_root, 1)
+    throttle = fileUtilities.Throttle(bandwidth) if bandwidth else None
+    try:
+        with runReport.phase('walk'):
+            inodes = unique_inodes(storage_root, log)
+        stats.inodes = len(inodes)
+        start = time.monotonic()
+        verified = log.verified()
+        log.forget([key for key in verified if key not in inodes])
+        order = sorted(inodes, key=lambda key: verified.get(key, 0))
+        with runReport.phase('scrub'):
+            for key in order:
+                if time_budget is not None and time.monotonic() - start >= time_budget:
+                    break
+                path = inodes[key]
+                try:
+                    st = os.stat(path)
+                    if (st.st_dev, st.st_ino) != key:
+                        # the snapshot was changed by hand since it was listed, listed again when it is walked
+                        continue
+                    digest = fileUtilities.hash_file(path, throttle=throttle)
+                    current = os.stat(path)
+                except OSError as e:
+                    print(f'WARNING: Could not read {path}: {e}')
+                    stats.errors += 1
+                    continue
+                stats.scrubbed += 1
+                stats.bytes += st.st_size
+                if (current.st_size, current.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                    # changed while it was read, verified on the next scrub
+                    continue
+                stored = hash_cache.lookup(st)
+                if stored is None:
+                    hash_cache.record(st, digest)
+                    stats.recorded += 1
+                elif stored != digest:
+                    stats.corrupt += 1
+                    print(f'CORRUPT: {path} (inode {st.st_ino}, {st.st_nlink} links, checksum {digest} '
+                          f'expected {stored})')
+                    # not marked verified, it is read first again by the next scrub
+                    continue
+                else:
+                    stats.ok += 1
+                if verbose:
+                    print(f'Verified {path}')
+                log.mark(key, time.time_ns())
+    finally:
+        hash_cache.close()
+        log.close()
+    return stats
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="scrubBackups.py <ROOT>\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Verifies every unique inode of a backup set made by "
+                                                 "incrementalBackup.py against the checksum stored\n\tfor it, "
+                                                 "recording the checksums it does not have yet.".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('root', type=str, help='root backup directory')
+    parser.add_argument('-t', '--time_budget', type=float,
+                        help='Minutes of reading after which no new file is started (listing the inodes is not\n'
+                             'counted), the next scrub continues with the files verified longest ago.')
+    parser.add_argument('-b', '--bandwidth', type=fileUtilities.parse_size,
+                        help='Read at most this many bytes per second (e.g. 50M).')
+    parser.add_argument('-v', '--verbose', action='store_true', help='List the files verified.')
+    parser.add_argument('--report', type=str, help='Write the time of each phase and the counters of the run to this '
+                                                   'file when it ends,\nin the Prometheus text format if it ends in '
+                                                   '.prom, JSON otherwise.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = init_args()
+    run_report = runReport.start('scrubBackups', args.report)
+    result = scrub(args.root, args.time_budget * 60 if args.time_budget is not None else None, args.bandwidth,
+                   args.verbose)
+    print(f'[ Scrubbed ] : [ {result.summary()} ]')
+    run_report.set_value('inodes', result.inodes)
+    run_report.set_value('inodes_scrubbed', result.scrubbed)
+    run_report.set_value('bytes_scrubbed', result.bytes)
+    run_report.set_value('inodes_corrupt', result.corrupt)
+    run_report.set_value('inodes_unreadable', result.errors)
+    run_report.finish(result.corrupt == 0)
+    print(f'[ Timing ] : [ {run_report.summary()} ]')
+    exit(1 if result.corrupt else 0)
@@ -0,0 +1,390 @@
+# Snapshot Catalog
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import argparse
+import os
+import sqlite3
+import stat
+from datetime import datetime
+
+import backupManifest
+import fileUtilities
+import virtualSnapshot
+
+version = '1.0'
+
+catalog_file_name = 'catalog.db'
+
+# kinds of snapshot
+DIRECTORY = 'directory'
+VIRTUAL = 'virtual'
+
+_dir_mode_check = '(v.mode & {}) = {}'.format(stat.S_IFMT(0o177777), stat.S_IFDIR)
+
+
+def _prefix_range(prefix: str):
+    """
+    :return: (low, high) bounding the paths below prefix, the sqlite index on path is used for the range
+    """
+    return prefix + os.sep, prefix + chr(ord(os.sep) + 1)
+
+
+def _same_version(old, entry: tuple) -> bool:
+    """
+    :param old: (size, mtime_ns, mode) of a recorded version, or None
+    :return: True if entry is the same version, a directory by its mode only
+    """
+    return old is not None and (tuple(old[:3]) == tuple(entry[:3]) or (old[2] == entry[2] and
+                                                                       stat.S_ISDIR(entry[2])))
+
+
+class SnapshotCatalog:
+    """
+    Catalog of the snapshots of a backup set and of every version of every path they hold, kept in sqlite in the
+    metadata directory of the set. Snapshots are numbered in the order they were taken (seq), a version (size,
+    mtime, mode of a path) is stored once with the first and last snapshot holding it, the last is NULL while
+    LATEST still holds it. Directories are versioned by their mode only, their mtime changes whenever an entry is
+    added. A run only writes the versions that changed, point in time queries are a range lookup
+    and a deleted snapshot only removes its row (and the versions no other snapshot held).
+    """
+
+    def __init__(self, storage_root: str, create: bool = True):
+        self._root = os.path.abspath(storage_root)
+        path = os.path.join(fileUtilities.metadata_dir(self._root, create), catalog_file_name)
+        if not create and not os.path.isfile(path):
+            raise Exception(f'No snapshot catalog in {storage_root}, build one with snapshotCatalog.py rebuild')
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS snapshots (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'name TEXT UNIQUE, kind TEXT, taken_ns INTEGER, source TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS snapshots_taken ON snapshots (taken_ns)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, path TEXT UNIQUE)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS versions (id INTEGER PRIMARY KEY, path_id INTEGER, '
+                         'size INTEGER, mtime_ns INTEGER, mode INTEGER, ino INTEGER, first_seq INTEGER, '
+                         'last_seq INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS versions_path ON versions (path_id, first_seq)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS versions_first ON versions (first_seq)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS versions_last ON versions (last_seq)')
+        self._db.commit()
+
+    @staticmethod
+    def exists(storage_root: str) -> bool:
+        return os.path.isfile(os.path.join(storage_root, fileUtilities.metadata_dir_name, catalog_file_name))
+
+    def snapshots(self) -> list:
+        """
+        :return: list of (seq, name, kind, taken_ns) oldest first
+        """
+        return self._db.execute('SELECT seq, name, kind, taken_ns FROM snapshots ORDER BY seq').fetchall()
+
+    def snapshot(self, name: str):
+        """
+        :return: (seq, name, kind, taken_ns) of the snapshot called name (with or without .vsnap), None if unknown
+        """
+        row = self._db.execute('SELECT seq, name, kind, taken_ns FROM snapshots WHERE name = ?', (name,)).fetchone()
+        if row is None and not name.endswith(virtualSnapshot.vsnap_suffix):
+            return self.snapshot(name + virtualSnapshot.vsnap_suffix)
+        return row
+
+    def snapshot_at(self, taken_ns: int):
+        """
+        :return: the newest snapshot taken at or before taken_ns, None if there is none
+        """
+        return self._db.execute('SELECT seq, name, kind, taken_ns FROM snapshots WHERE taken_ns <= ? '
+                                'ORDER BY taken_ns DESC LIMIT 1', (taken_ns,)).fetchone()
+
+    def _tip(self) -> int:
+        return self._db.execute('SELECT MAX(seq) FROM snapshots').fetchone()[0]
+
+    def _current_versions(self, paths: list = None) -> dict:
+        """
+        :param paths: only look these paths up, every path LATEST holds if not given
+        :return: dict of path -> (version id, size, mtime_ns, mode, first_seq) of the versions LATEST holds
+        """
+        query = ('SELECT p.path, v.id, v.size, v.mtime_ns, v.mode, v.first_seq FROM versions v '
+                 'JOIN paths p ON p.id = v.path_id WHERE v.last_seq IS NULL')
+        if paths is None:
+            rows = self._db.execute(query)
+        else:
+            rows = (row for path in paths for row in self._db.execute(query + ' AND p.path = ?', (path,)))
+        return {path: (version_id, size, mtime_ns, mode, first_seq)
+                for path, version_id, size, mtime_ns, mode, first_seq in rows}
+
+    def rename_snapshot(self, old_name: str, new_name: str, kind: str = DIRECTORY):
+        """
+        Renames a snapshot (LATEST becoming a dated snapshot), nothing is done if it was already renamed
+        """
+        if self.snapshot(new_name) is not None:
+            return
+        self._db.execute('UPDATE snapshots SET name = ?, kind = ? WHERE name = ?', (new_name, kind, old_name))
+        self._db.commit()
+
+    def add_snapshot(self, name: str, taken_ns: int, entries: dict, source: str = None, kind: str = DIRECTORY,
+                     previous=None):
+        """
+        Records a new snapshot from its manifest entries, only what changed since the newest snapshot is written.
+        Adding the newest snapshot again (a resumed run) only records the differences with what was added before.
+        :param entries: dict of relative path -> (size, mtime_ns, mode, inode), see backupManifest.scan_tree
+        :param previous: (header, entries) of the manifest of the newest snapshot, only the paths that differ from
+                         it are looked up so the cost follows the changes, every version LATEST holds is loaded
+                         without it (or when the newest snapshot is not the one it describes)
+        :return: (versions added, versions ended)
+        """
+        tip = self._tip()
+        existing = self.snapshot(name)
+        if existing is not None and existing[0] != tip:
+            raise Exception(f'Snapshot {name} is already in the catalog and is not the newest')
+
+        if previous is not None and existing is None and tip is not None and previous[0]['created_ns'] == \
+                self._db.execute('SELECT taken_ns FROM snapshots WHERE seq = ?', (tip,)).fetchone()[0]:
+            old_entries = previous[1]
+            changed = [rel for rel, entry in entries.items() if not _same_version(old_entries.get(rel), entry)]
+            changed += [rel for rel in old_entries if rel not in entries]
+            current = self._current_versions(changed)
+            entries = {rel: entries[rel] for rel in changed if rel in entries}
+        else:
+            current = self._current_versions()
+
+        if existing is None:
+            previous = tip
+            seq = self._db.execute('INSERT INTO snapshots (name, kind, taken_ns, source) VALUES (?, ?, ?, ?)',
+                                   (name, kind, taken_ns, source)).lastrowid
+        else:
+            seq = existing[0]
+            previous = self._db.execute('SELECT MAX(seq) FROM snapshots WHERE seq < ?', (seq,)).fetchone()[0]
+            self._db.execute('UPDATE snapshots SET taken_ns = ? WHERE seq = ?', (taken_ns, seq))
+
+        added = []
+        ended = []
+        for rel, entry in entries.items():
+            old = current.pop(rel, None)
+            if old is not None and _same_version(old[1:4], entry):
+                continue
+            if old is not None:
+                ended.append(old)
+            # st_ino is unsigned 64 bit, sqlite integers are signed
+            ino = entry[3] - (1 << 64) if entry[3] >= (1 << 63) else entry[3]
+            added.append((entry[0], entry[1], entry[2], ino, seq, rel))
+        ended.extend(current.values())
+
+        # a version that started in this snapshot (added before a resumed run) is dropped, an older one ends at
+        # the snapshot before this one
+        self._db.executemany('DELETE FROM versions WHERE id = ?', ((old[0],) for old in ended if old[4] == seq))
+        self._db.executemany('UPDATE versions SET last_seq = ? WHERE id = ?',
+                             ((previous, old[0]) for old in ended if old[4] != seq))
+        self._db.executemany('INSERT OR IGNORE INTO paths (path) VALUES (?)', ((version[5],) for version in added))
+        self._db.executemany('INSERT INTO versions (path_id, size, mtime_ns, mode, ino, first_seq, last_seq) '
+                             'SELECT id, ?, ?, ?, ?, ?, NULL FROM paths WHERE path = ?', added)
+        self._db.commit()
+        return len(added), len(ended)
+
+    def remove_snapshot(self, name: str):
+        """
+        Removes a deleted snapshot, the versions no remaining snapshot holds are dropped
+        """
+        self._db.execute('DELETE FROM snapshots WHERE name = ?', (name,))
+        tip = self._tip()
+        if tip is None:
+            self._db.execute('DELETE FROM versions')
+        else:
+            self._db.execute('DELETE FROM versions WHERE NOT EXISTS (SELECT 1 FROM snapshots s WHERE s.seq '
+                             'BETWEEN versions.first_seq AND COALESCE(versions.last_seq, ?))', (tip,))
+        self._db.execute('DELETE FROM paths WHERE id NOT IN (SELECT path_id FROM versions)')
+        self._db.commit()
+
+    def differences(self, seq_a: int, seq_b: int):
+        """
+        :return: iterator of (path, mode) of the paths whose version differs between two snapshots (seq_a < seq_b),
+                 a version starting or ending between them
+        """
+        return self._db.execute(
+            'SELECT p.path, v.mode FROM versions v JOIN paths p ON p.id = v.path_id '
+            'WHERE (v.first_seq > ? AND v.first_seq <= ?) OR (v.last_seq >= ? AND v.last_seq < ?)',
+            (seq_a, seq_b, seq_a, seq_b))
+
+    def history(self, path: str) -> list:
+        """
+        :return: list of (size, mtime_ns, mode, names of the snapshots holding the version) of every version of path
+        """
+        tip = self._tip()
+        versions = []
+        for size, mtime_ns, mode, first_seq, last_seq in self._db.execute(
+                'SELECT v.size, v.mtime_ns, v.mode, v.first_seq, v.last_seq FROM versions v '
+                'JOIN paths p ON p.id = v.path_id WHERE p.path = ? ORDER BY v.first_seq', (path,)).fetchall():
+            names = [row[0] for row in self._db.execute('SELECT name FROM snapshots WHERE seq BETWEEN ? AND ? '
+                                                        'ORDER BY seq', (first_seq, tip if last_seq is None
+                                                                         else last_seq))]
+            versions.append((size, mtime_ns, mode, names))
+        return versions
+
+    def files_at(self, seq: int, prefix: str = ''):
+        """
+        :return: iterator of (path, size, mtime_ns, mode) of the entries below prefix in the snapshot seq
+        """
+        query = ('SELECT p.path, v.size, v.mtime_ns, v.mode FROM versions v JOIN paths p ON p.id = v.path_id '
+                 'WHERE v.first_seq <= ? AND (v.last_seq IS NULL OR v.last_seq >= ?)')
+        parameters = [seq, seq]
+        prefix = prefix.strip(os.sep)
+        if prefix:
+            low, high = _prefix_range(prefix)
+            query += ' AND (p.path = ? OR (p.path >= ? AND p.path < ?))'
+            parameters += [prefix, low, high]
+        return self._db.execute(query + ' ORDER BY p.path', parameters)
+
+    def unique_bytes(self, seq: int):
+        """
+        :return: (files, bytes) held by no other snapshot than seq, what deleting it frees (ignoring hard links
+                 made by --dedup)
+        """
+        tip = self._tip()
+        return self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(v.size), 0) FROM versions v WHERE v.first_seq <= ? '
+            'AND COALESCE(v.last_seq, ?) >= ? AND NOT ' + _dir_mode_check + ' AND NOT EXISTS (SELECT 1 FROM '
+            'snapshots s WHERE s.seq BETWEEN v.first_seq AND COALESCE(v.last_seq, ?) AND s.seq != ?)',
+            (seq, tip, seq, tip, seq)).fetchone()
+
+    def clear(self):
+        for table in ('snapshots', 'paths', 'versions'):
+            self._db.execute(f'DELETE FROM {table}')
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+def snapshot_manifest(path: str):
+    """
+    :return: (header, entries) of the manifest of a snapshot directory or virtual snapshot, None if it has none
+    """
+    manifest = path if path.endswith(virtualSnapshot.vsnap_suffix) else backupManifest.manifest_path(path)
+    if not os.path.isfile(manifest):
+        return None
+    return backupManifest.read_manifest(manifest)
+
+
+def rebuild(storage_root: str, verbose: bool = False) -> int:
+    """
+    Builds the catalog of a backup set from the manifests of its snapshots (oldest first), snapshots without a
+    manifest are skipped
+    :return: number of snapshots cataloged
+    """
+    root = os.path.abspath(storage_root)
+    names = [name for name in os.listdir(root)
+             if name != fileUtilities.metadata_dir_name
+             and (os.path.isdir(os.path.join(root, name)) or name.endswith(virtualSnapshot.vsnap_suffix))]
+    paths = sorted((os.path.join(root, name) for name in names), key=virtualSnapshot.snapshot_time)
+    catalog = SnapshotCatalog(root)
+    catalog.clear()
+    count = 0
+    for path in paths:
+        manifest = snapshot_manifest(path)
+        if manifest is None:
+            print(f'[ Catalog ] : [ {os.path.basename(path)} has no manifest, skipped ]')
+            continue
+        header, entries = manifest
+        kind = VIRTUAL if path.endswith(virtualSnapshot.vsnap_suffix) else DIRECTORY
+        added, ended = catalog.add_snapshot(os.path.basename(path), header['created_ns'], entries,
+                                            header.get('source'), kind)
+        count += 1
+        if verbose:
+            print(f'[ Catalog ] : [ {os.path.basename(path)} : {added} versions added, {ended} ended ]')
+    catalog.close()
+    return count
+
+
+def parse_time(text: str) -> int:
+    """
+    :param text: date and time in ISO format (e.g. 2026-01-31 or 2026-01-31 18:30)
+    :return: time in ns since the epoch
+    """
+    return int(datetime.fromisoformat(text).timestamp() * 1e9)
+
+
+def _format_time(taken_ns: int) -> str:
+    return datetime.fromtimestamp(taken_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def init_args():
+    parser = argparse.ArgumentParser(description="snapshotCatalog.py\n"
+                                                 " Version: {}\n"
+                                                 " Description:\n\t"
+                                                 "Queries the catalog of the snapshots of a backup set and of the "
+                                                 "versions of every path they hold\n\t(.backupMeta/catalog.db, kept up "
+                                                 "to date by incrementalBackup.py --catalog).".format(version),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    snapshots = subparsers.add_parser('snapshots', help='List the snapshots, oldest first.')
+    snapshots.add_argument('root', type=str, help='root backup directory')
+    snapshots.add_argument('--since', type=str, help='Only snapshots taken at or after this time (ISO format).')
+    snapshots.add_argument('--until', type=str, help='Only snapshots taken at or before this time (ISO format).')
+
+    history = subparsers.add_parser('history', help='List the versions of a path and the snapshots holding each.')
+    history.add_argument('root', type=str, help='root backup directory')
+    history.add_argument('path', type=str, help='path relative to SOURCE')
+
+    files = subparsers.add_parser('files', help='List the entries below a path in a snapshot.')
+    files.add_argument('root', type=str, help='root backup directory')
+    files.add_argument('prefix', type=str, nargs='?', default='', help='path relative to SOURCE (default all)')
+    files.add_argument('-s', '--snapshot', type=str, help='Name of the snapshot (default the newest).')
+    files.add_argument('-a', '--at', type=str, help='The snapshot as it was at this time (ISO format).')
+
+    unique = subparsers.add_parser('unique', help='Files and bytes only held by each snapshot (what deleting it '
+                                                  'frees).')
+    unique.add_argument('root', type=str, help='root backup directory')
+    unique.add_argument('-s', '--snapshot', type=str, help='Only this snapshot.')
+
+    rebuild_parser = subparsers.add_parser('rebuild', help='Build the catalog from the manifests of the snapshots.')
+    rebuild_parser.add_argument('root', type=str, help='root backup directory')
+    rebuild_parser.add_argument('-v', '--verbose', action='store_true', help='List the versions added per snapshot.')
+    return parser.parse_args()
+
+
+def _find_snapshot(catalog: SnapshotCatalog, name: str = None, at: str = None):
+    if name is not None:
+        snapshot = catalog.snapshot(name)
+        if snapshot is None:
+            raise Exception(f'No snapshot {name} in the catalog')
+    elif at is not None:
+        snapshot = catalog.snapshot_at(parse_time(at))
+        if snapshot is None:
+            raise Exception(f'No snapshot taken before {at}')
+    else:
+        snapshots = catalog.snapshots()
+        if not snapshots:
+            raise Exception('The catalog is empty')
+        snapshot = snapshots[-1]
+    return snapshot
+
+
+if __name__ == '__main__':
+    args = init_args()
+    if args.command == 'rebuild':
+        print(f'[ Cataloged ] : [ {rebuild(args.root, args.verbose)} snapshots ]')
+        exit(0)
+
+    catalog = SnapshotCatalog(args.root, create=False)
+    if args.command == 'snapshots':
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until) if args.until else None
+        for seq, name, kind, taken_ns in catalog.snapshots():
+            if (since is None or taken_ns >= since) and (until is None or taken_ns <= until):
+                print(f'[ {seq:5} ] : [ {_format_time(taken_ns)} ] : [ {kind:9} ] : [ {name} ]')
+    elif args.command == 'history':
+        for size, mtime_ns, mode, names in catalog.history(os.path.normpath(args.path)):
+            kind = 'dir' if stat.S_ISDIR(mode) else f'{size} bytes'
+            print(f'[ {_format_time(mtime_ns)} ] : [ {kind} ] : [ {", ".join(names) or "no snapshot"} ]')
+    elif args.command == 'files':
+        snapshot = _find_snapshot(catalog, args.snapshot, args.at)
+        print(f'[ Snapshot ] : [ {snapshot[1]} ({_format_time(snapshot[3])}) ]')
+        for path, size, mtime_ns, mode in catalog.files_at(snapshot[0], args.prefix):
+            kind = 'dir' if stat.S_ISDIR(mode) else size
+            print(f'{_format_time(mtime_ns)}  {kind:>12}  {path}')
+    else:
+        snapshots = [_find_snapshot(catalog, args.snapshot)] if args.snapshot else catalog.snapshots()
+        for seq, name, kind, taken_ns in snapshots:
+            files, size = catalog.unique_bytes(seq)
+            print(f'[ {name} ] : [ {files} files, {size} bytes only in this snapshot ]')
+    catalog.close()
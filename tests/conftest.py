@@ -0,0 +1,69 @@
+# Test configuration
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+
+
+def run_script(script: str, *args, check: bool = True, code: str = None) -> subprocess.CompletedProcess:
+    """
+    Runs one of the scripts of the repository, their work is done under __main__
+    :param code: python run instead of the script (with the script arguments in sys.argv), e.g. to patch it first
+    """
+    command = [sys.executable, '-c', code, script] if code is not None else [sys.executable,
+                                                                                os.path.join(repo_root, script)]
+    result = subprocess.run(command + [str(arg) for arg in args], cwd=repo_root, capture_output=True, text=True)
+    if check and result.returncode != 0:
+        raise AssertionError(f'{script} {args} exited with {result.returncode}\n{result.stdout}\n{result.stderr}')
+    return result
+
+
+def write_tree(root: str, files: dict, mtime: float = None):
+    """
+    :param files: dict of relative path -> bytes or str
+    :param mtime: time given to every file and directory written
+    """
+    for rel, data in files.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+    if mtime is not None:
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in dirnames + filenames:
+                os.utime(os.path.join(dirpath, name), (mtime, mtime))
+
+
+@pytest.fixture
+def backup(tmp_path):
+    """
+    :return: function running incrementalBackup.py from tmp_path/SRC into tmp_path/store/LATEST, a new snapshot is
+             named by the second LATEST was made so runs are spaced by more than a second
+    """
+    os.makedirs(tmp_path / 'store')
+    last = []
+
+    def run(*args, **kwargs):
+        if last:
+            time.sleep(max(0.0, last[0] + 1.1 - time.time()))
+        result = run_script('incrementalBackup.py', tmp_path / 'SRC', tmp_path / 'store' / 'LATEST', *args, **kwargs)
+        last[:] = [time.time()]
+        return result
+    return run
+
+
+def snapshots(store: str) -> list:
+    """
+    :return: names of the snapshots (directories and virtual snapshots) of a backup set, LATEST included
+    """
+    return sorted(name for name in os.listdir(store)
+                  if name.endswith('.vsnap') or (os.path.isdir(os.path.join(store, name)) and not name.startswith('.')))
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+import backupManifest
+import purgeDuplicateBackups
+from conftest import run_script, snapshots, write_tree
+
+
+def _make_set(tmp_path, backup) -> list:
+    """
+    :return: snapshots of the set oldest first, the third is a duplicate of the second, LATEST is last
+    """
+    write_tree(tmp_path / 'SRC', {'a/f1': 'one', 'a/b/f2': 'two', 'c/f3': 'three'}, 1600000000)
+    backup()
+    write_tree(tmp_path / 'SRC', {'a/b/f2': 'TWO'})
+    os.utime(tmp_path / 'SRC' / 'a' / 'b' / 'f2', (1600001000, 1600001000))
+    backup()
+    backup()
+    write_tree(tmp_path / 'SRC', {'c/new': 'new'})
+    backup()
+    store = tmp_path / 'store'
+    return [str(store / name) for name in snapshots(store) if name != 'LATEST'] + [str(store / 'LATEST')]
+
+
+def test_manifest_digests_match_recomputed(tmp_path, backup):
+    for snapshot in _make_set(tmp_path, backup):
+        path = backupManifest.digest_path(snapshot)
+        from_manifest = backupManifest.load_digests(path)
+        assert from_manifest is not None
+        os.remove(path)
+        assert backupManifest.snapshot_digests(snapshot) == from_manifest
+        assert os.path.isfile(path)
+
+
+@pytest.mark.parametrize('options', [[], ['--content_hash'],
+                                     # the digest files do not match the ignore list, digests come from the trees
+                                     ['-i', 'nothing*'], ['--content_hash', '-i', 'nothing*']])
+def test_purge_by_digests(tmp_path, backup, options):
+    first, second, duplicate, latest = _make_set(tmp_path, backup)
+    assert backupManifest.first_difference(backupManifest.snapshot_digests(first),
+                                           backupManifest.snapshot_digests(second)) == os.path.join('a', 'b')
+    run_script('purgeDuplicateBackups.py', tmp_path / 'store', '-d', '-n', '-m', *options)
+    assert snapshots(tmp_path / 'store') == sorted(os.path.basename(path) for path in (first, second, latest))
+
+
+def test_content_hash_sees_same_stat_change(tmp_path, backup):
+    _, second, duplicate, _ = _make_set(tmp_path, backup)
+    # same size and mtime, other contents (a new inode, the old one is shared with the other snapshots)
+    path = os.path.join(duplicate, 'a', 'b', 'f2')
+    write_tree(tmp_path / 'tmp', {'f2': 'two'}, 1600001000)
+    os.replace(tmp_path / 'tmp' / 'f2', path)
+    for snapshot in (second, duplicate):
+        os.remove(backupManifest.digest_path(snapshot))
+    assert purgeDuplicateBackups.compare_snapshot_digests(second, duplicate)
+    assert not purgeDuplicateBackups.compare_snapshot_digests(second, duplicate, verbose=True, content_hash=True)
+
+
+def _changes(src, manifest, **kwargs) -> tuple:
+    entries = {}
+    events = [(event.kind, event.rel) for event in
+              backupManifest.iter_manifest_changes(str(src), 'LATEST', manifest, entries, **kwargs)]
+    return events, entries
+
+
+def test_manifest_changes(tmp_path):
+    src = tmp_path / 'SRC'
+    write_tree(src, {'same': 'x', 'size': 'x', 'gone': 'x', 'gone_dir/f': 'x', 'type': 'x', 'd/e/deep': 'x'},
+               1600000000)
+    manifest = ({'created_ns': 1600001000 * 10 ** 9}, backupManifest.scan_tree(str(src)))
+    assert _changes(src, manifest) == ([], manifest[1])
+
+    write_tree(src, {'size': 'xx', 'new': 'x', 'new_dir/sub/f': 'x', 'd/e/added': 'x'}, 1600000000)
+    os.remove(src / 'gone')
+    os.remove(src / 'gone_dir' / 'f')
+    os.rmdir(src / 'gone_dir')
+    os.remove(src / 'type')
+    write_tree(src, {'type/f': 'x'}, 1600000000)
+    events, entries = _changes(src, manifest)
+    assert sorted(events) == sorted([
+        (backupManifest.MODIFIED, 'size'), (backupManifest.ADDED, 'new'), (backupManifest.DIR_ADDED, 'new_dir'),
+        (backupManifest.ADDED, os.path.join('d', 'e', 'added')), (backupManifest.REMOVED, 'gone'),
+        (backupManifest.DIR_REMOVED, 'gone_dir'),
+        # a file replaced by a directory is removed then added
+        (backupManifest.REMOVED, 'type'), (backupManifest.DIR_ADDED, 'type')])
+    assert events.index((backupManifest.REMOVED, 'type')) < events.index((backupManifest.DIR_ADDED, 'type'))
+    # the new manifest, new directories scanned completely
+    assert entries == backupManifest.scan_tree(str(src))
+
+
+def test_racy_entries_are_modified(tmp_path):
+    src = tmp_path / 'SRC'
+    write_tree(src, {'old': 'x', 'racy': 'x'}, 1600000000)
+    os.utime(src / 'racy', (1600000999, 1600000999))
+    # taken a second after racy was written, a write in the same tick would not change its signature
+    manifest = ({'created_ns': 1600001000 * 10 ** 9}, backupManifest.scan_tree(str(src)))
+    assert _changes(src, manifest)[0] == [(backupManifest.MODIFIED, 'racy')]
+
+
+def test_stale_manifest_is_not_used(tmp_path):
+    src = tmp_path / 'SRC'
+    write_tree(src, {'a': 'x'}, 1600000000)
+    path = str(tmp_path / 'LATEST.manifest')
+    backupManifest.write_manifest(path, str(src), backupManifest.scan_tree(str(src)), ['*.log'])
+    assert backupManifest.load_manifest(path, str(src), ['*.log']) is not None
+    assert backupManifest.load_manifest(path, str(src), ['*.tmp']) is None
+    assert backupManifest.load_manifest(path, str(tmp_path), ['*.log']) is None
+    assert backupManifest.load_manifest(str(tmp_path / 'missing'), str(src)) is None
+    with open(path, 'r+b') as f:
+        f.truncate(20)
+    assert backupManifest.load_manifest(path, str(src), ['*.log']) is None
+
+
+def test_backup_from_manifest_sees_same_size_change(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'a': 'one', 'd/b': 'two'}, 1600000000)
+    backup()
+    assert os.path.isfile(backupManifest.manifest_path(str(tmp_path / 'store' / 'LATEST')))
+    write_tree(tmp_path / 'SRC', {'d/b': 'TWO'}, None)
+    os.utime(tmp_path / 'SRC' / 'd' / 'b', (1600001000, 1600001000))
+    backup()
+    assert (tmp_path / 'store' / 'LATEST' / 'd' / 'b').read_text() == 'TWO'
+    previous = [name for name in snapshots(tmp_path / 'store') if name != 'LATEST']
+    assert (tmp_path / 'store' / previous[0] / 'd' / 'b').read_text() == 'two'
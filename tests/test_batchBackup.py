@@ -0,0 +1,69 @@
+import threading
+import time
+
+import batchBackup
+
+
+def _run_with_timeout(jobs, *args):
+    thread = threading.Thread(target=batchBackup.run_jobs, args=(jobs, *args), daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), 'the scheduler did not return'
+
+
+def test_job_failing_before_start_does_not_hang(tmp_path):
+    (tmp_path / 'file').write_text('not a directory')
+    # the metadata directory of the job cannot be created
+    job = batchBackup.BackupJob('broken', tmp_path, tmp_path / 'file' / 'LATEST', volumes=['v'])
+    other = batchBackup.BackupJob('other', tmp_path, tmp_path / 'file' / 'LATEST2', volumes=['v'])
+    _run_with_timeout([job, other], 1, 2)
+    assert job.returncode == -1 and other.returncode == -1
+    assert job.duration is not None
+    assert batchBackup.BackupJob('never', tmp_path, tmp_path / 'LATEST').summary().startswith('FAILED (None), not run')
+
+
+class _TimedJob(batchBackup.BackupJob):
+    """
+    Job sleeping instead of running a backup, the copiers of the jobs running at once are recorded
+    """
+    lock = threading.Lock()
+    in_use = 0
+    peak = 0
+
+    def run(self, copiers: int):
+        with self.lock:
+            _TimedJob.in_use += self.copiers(copiers)
+            _TimedJob.peak = max(_TimedJob.peak, _TimedJob.in_use)
+        time.sleep(0.2)
+        with self.lock:
+            _TimedJob.in_use -= self.copiers(copiers)
+        self.returncode = 0
+        self.duration = 0.2
+
+
+def test_copiers_of_the_batch_are_a_limit(tmp_path):
+    jobs = [_TimedJob(str(i), tmp_path, tmp_path / str(i) / 'LATEST', volumes=[str(i)]) for i in range(6)]
+    # asks for more than its share, the others wait for room
+    jobs[1].options = ['--copy_workers', '5']
+    assert [job.copiers(2) for job in jobs[:2]] == [2, 6]
+    _run_with_timeout(jobs, 4, 8)
+    assert all(job.returncode == 0 for job in jobs)
+    assert _TimedJob.peak <= 8
+
+
+def test_volume_limit_below_one_does_not_hang(tmp_path):
+    jobs = [_TimedJob(str(i), tmp_path, tmp_path / str(i) / 'LATEST', volumes=['v']) for i in range(2)]
+    _run_with_timeout(jobs, 2, 4, 0)
+    assert all(job.returncode == 0 for job in jobs)
+
+
+def test_job_asking_for_more_than_the_batch_runs_with_the_copiers(tmp_path):
+    job = batchBackup.BackupJob('greedy', tmp_path, tmp_path / 'LATEST', options=['--copy_workers', '20'])
+    assert job.copiers(2) == 21
+    command = job.command(8)
+    # the last value wins
+    assert command[-4:] == ['--copy_workers', '7', '--large_workers', '1']
+    job = batchBackup.BackupJob('large', tmp_path, tmp_path / 'LATEST', options=['--large_workers', '3'])
+    assert job.copy_threads(2) == (1, 3)
+    # given what it asks for, it runs with it
+    assert job.command(job.copiers(2))[-4:] == ['--copy_workers', '1', '--large_workers', '3']
@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+import benchmarkBackup
+from conftest import run_script
+
+
+def _tree(root) -> dict:
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+def _generator(root, seed: int = 0, distribution: str = 'lognormal') -> benchmarkBackup.TreeGenerator:
+    return benchmarkBackup.TreeGenerator(str(root), 200, 3, 20, distribution, 2048, 64 * 1024, seed)
+
+
+def test_same_seed_same_tree(tmp_path):
+    generated = [_generator(tmp_path / name).generate() for name in ('a', 'b')]
+    assert generated[0] == generated[1]
+    assert generated[0]['files'] == 200 and generated[0]['directories'] == 10
+    assert _tree(tmp_path / 'a') == _tree(tmp_path / 'b')
+    _generator(tmp_path / 'c', seed=1).generate()
+    assert _tree(tmp_path / 'c') != _tree(tmp_path / 'a')
+    # every file starts with its own random bytes
+    contents = list(_tree(tmp_path / 'a').values())
+    assert len(set(contents)) == len(contents)
+
+
+@pytest.mark.parametrize('distribution', benchmarkBackup.size_distributions)
+def test_sizes_are_capped(tmp_path, distribution):
+    tree = _generator(tmp_path / 'a', distribution=distribution).generate()
+    sizes = [len(data) for data in _tree(tmp_path / 'a').values()]
+    assert sum(sizes) == tree['bytes']
+    assert max(sizes) <= 64 * 1024
+    if distribution == 'fixed':
+        assert set(sizes) == {2048}
+
+
+def test_churn(tmp_path):
+    generator = _generator(tmp_path / 'a')
+    generator.generate()
+    before = _tree(tmp_path / 'a')
+    churned = generator.churn(0.1)
+    assert churned == {'modified': 12, 'added': 4, 'deleted': 4}
+    after = _tree(tmp_path / 'a')
+    assert len(after) == len(before)
+    assert len(set(before) - set(after)) == 4
+    assert sum(1 for rel in before if rel in after and before[rel] != after[rel]) == 12
+
+
+def test_benchmark_writes_every_phase(tmp_path):
+    output = tmp_path / 'results.json'
+    run_script('benchmarkBackup.py', tmp_path, '-f', 100, '-k', 3, '--mean_size', '1K', '-o', output)
+    with open(output) as f:
+        results = json.load(f)
+    assert [(phase['phase'], phase['snapshot']) for phase in results['phases']] == [
+        ('first_run', 0), ('link_farm', 1), ('compare', 1), ('link_farm', 2), ('compare', 2), ('purge', 2)]
+    assert results['phases'][0]['files'] == 100
+    assert all(phase['seconds'] > 0 for phase in results['phases'])
+    assert len(results['churn']) == 2
+    # the generated trees are removed
+    assert os.listdir(tmp_path) == ['results.json']
@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import changeJournal
+from conftest import repo_root, write_tree
+
+
+def _journal(tmp_path, source, records=(), **header) -> str:
+    path = str(tmp_path / 'journal')
+    header = {'version': changeJournal.version, 'session': 'one', 'source': str(source), 'pid': os.getpid(),
+              'host': os.uname().nodename, 'started_ns': 0, **header}
+    with open(path, 'w') as f:
+        f.write(json.dumps(header) + '\n')
+    _append(path, records)
+    return path
+
+
+def _append(path: str, records, partial: str = ''):
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.write(partial)
+
+
+def _read(path: str, source, commit: bool = True):
+    reader = changeJournal.JournalReader(path, str(source))
+    dirty = reader.dirty_directories()
+    if commit:
+        reader.commit()
+    return dirty
+
+
+def test_changes_since_the_last_run(tmp_path):
+    path = _journal(tmp_path, tmp_path, [[changeJournal.CHANGED, 'before']])
+    # the first run does a full scan and starts reading from the end
+    assert _read(path, tmp_path) is None
+    _append(path, [[changeJournal.CHANGED, os.path.join('d', 'f')], [changeJournal.CHANGED, 'top'],
+                   [changeJournal.CHANGED, 'new'], [changeJournal.TREE, 'new']], '["C", "par')
+    assert _read(path, tmp_path) == {'d': False, '': False, 'new': True}
+    # the partly written record is read once it is complete
+    _append(path, [], 'tly"]\n')
+    assert _read(path, tmp_path, commit=False) == {'': False}
+    # not committed, read again by the next run
+    assert _read(path, tmp_path) == {'': False}
+    assert _read(path, tmp_path) == {}
+
+
+@pytest.mark.parametrize('record', [[changeJournal.OVERFLOW], [changeJournal.STOP]])
+def test_lost_changes_force_a_full_scan(tmp_path, record):
+    path = _journal(tmp_path, tmp_path)
+    _read(path, tmp_path)
+    _append(path, [[changeJournal.CHANGED, 'a'], record])
+    assert _read(path, tmp_path) is None
+
+
+def test_journal_that_can_not_be_trusted(tmp_path):
+    path = _journal(tmp_path, tmp_path)
+    _read(path, tmp_path)
+    assert _read(path, tmp_path / 'other') is None
+    # a new watcher session
+    _journal(tmp_path, tmp_path, session='two')
+    assert _read(path, tmp_path) is None
+    assert _read(path, tmp_path) == {}
+    # the watcher is gone
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    _journal(tmp_path, tmp_path, session='two', pid=int(dead.stdout))
+    assert _read(path, tmp_path) is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is only on Linux')
+def test_backup_compares_the_directories_the_watcher_saw(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'d/a': 'one', 'e/b': 'two', 'k': 'k'}, 1600000000)
+    journal = str(tmp_path / 'journal')
+    watcher = subprocess.Popen([sys.executable, os.path.join(repo_root, 'changeJournal.py'), tmp_path / 'SRC',
+                                journal], stdout=subprocess.PIPE, text=True)
+    try:
+        for line in watcher.stdout:
+            if line.startswith('[ Watches ]'):
+                break
+        backup('-j', journal)
+        write_tree(tmp_path / 'SRC', {'d/a': 'ONE!', 'e/new/c': 'three'})
+        time.sleep(1)
+        result = backup('-j', journal)
+        assert '[ Journal ] : [ 3 directories changed since the last run ]' in result.stdout
+        latest = tmp_path / 'store' / 'LATEST'
+        assert (latest / 'd' / 'a').read_text() == 'ONE!'
+        assert (latest / 'e' / 'new' / 'c').read_text() == 'three'
+    finally:
+        watcher.terminate()
+        watcher.wait(30)
+    with open(journal) as f:
+        assert json.loads(f.readlines()[-1]) == [changeJournal.STOP]
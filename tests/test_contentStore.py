@@ -0,0 +1,144 @@
+import os
+import shutil
+
+import contentStore
+from conftest import run_script, write_tree
+
+_data = b'x' * 100000
+
+
+def _store(tmp_path, files: dict) -> contentStore.ContentIndex:
+    """
+    :return: ContentIndex of a backup set whose snapshot old holds files, every file with the same mtime
+    """
+    write_tree(tmp_path / 'set' / 'old', files, 1600000000)
+    index = contentStore.ContentIndex(str(tmp_path / 'set'), 1024)
+    for rel, data in files.items():
+        index.add('old', rel, len(data), 1600000000 * 10 ** 9)
+    os.makedirs(tmp_path / 'set' / 'new')
+    return index
+
+
+def _source(tmp_path, data: bytes) -> str:
+    write_tree(tmp_path / 'src', {'moved': data}, 1600000000)
+    return str(tmp_path / 'src' / 'moved')
+
+
+def test_same_contents_are_linked(tmp_path):
+    index = _store(tmp_path, {'a': _data})
+    dst = index.link_or_copy(_source(tmp_path, _data), str(tmp_path / 'set' / 'new' / 'moved'), shutil.copyfile)
+    assert os.path.samefile(dst, tmp_path / 'set' / 'old' / 'a')
+    assert index.summary() == '1 files, 100000 bytes'
+    # the copy is in the index too, with the digest computed for it
+    candidate, digest = index.find(dst, os.stat(dst))
+    assert candidate is not None and digest == contentStore.fileUtilities.hash_file(dst)
+    index.close()
+
+
+def test_same_size_and_mtime_other_contents_is_copied(tmp_path):
+    index = _store(tmp_path, {'a': _data})
+    other = b'y' * len(_data)
+    dst = index.link_or_copy(_source(tmp_path, other), str(tmp_path / 'set' / 'new' / 'moved'), shutil.copyfile)
+    assert not os.path.samefile(dst, tmp_path / 'set' / 'old' / 'a')
+    assert open(dst, 'rb').read() == other
+    assert index.deduplicated_files == 0
+    index.close()
+
+
+def test_small_files_are_not_looked_up(tmp_path):
+    index = _store(tmp_path, {'a': b'small'})
+    dst = index.link_or_copy(_source(tmp_path, b'small'), str(tmp_path / 'set' / 'new' / 'moved'), shutil.copyfile)
+    assert not os.path.samefile(dst, tmp_path / 'set' / 'old' / 'a')
+    index.close()
+
+
+def test_other_permissions_are_copied(tmp_path):
+    index = _store(tmp_path, {'a': _data})
+    src = _source(tmp_path, _data)
+    os.chmod(src, 0o600)
+    os.chmod(tmp_path / 'set' / 'old' / 'a', 0o644)
+    dst = index.link_or_copy(src, str(tmp_path / 'set' / 'new' / 'moved'), shutil.copyfile)
+    assert not os.path.samefile(dst, tmp_path / 'set' / 'old' / 'a')
+    index.close()
+
+
+def test_entries_no_longer_matching_are_dropped(tmp_path):
+    index = _store(tmp_path, {'a': _data, 'b': _data})
+    os.remove(tmp_path / 'set' / 'old' / 'a')
+    os.utime(tmp_path / 'set' / 'old' / 'b', (1600001000, 1600001000))
+    src = _source(tmp_path, _data)
+    # neither is hashed, a removed file and one whose mtime changed are dropped
+    assert index.find(src, os.stat(src)) == (None, None)
+    assert index.is_empty()
+    index.close()
+
+
+def test_renamed_snapshot_keeps_its_entries(tmp_path):
+    index = _store(tmp_path, {'a': _data})
+    os.rename(tmp_path / 'set' / 'old', tmp_path / 'set' / 'older')
+    index.rename_snapshot('old', 'older')
+    src = _source(tmp_path, _data)
+    candidate, _ = index.find(src, os.stat(src))
+    assert candidate == str(tmp_path / 'set' / 'older' / 'a')
+    index.close()
+
+
+def test_backup_links_a_moved_file(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'d/a': _data, 'k': 'k'}, 1600000000)
+    backup('-d')
+    os.makedirs(tmp_path / 'SRC' / 'e')
+    os.rename(tmp_path / 'SRC' / 'd' / 'a', tmp_path / 'SRC' / 'e' / 'a')
+    backup('-d')
+    store = tmp_path / 'store'
+    previous = [name for name in os.listdir(store) if name not in ('LATEST', '.backupMeta')
+                and os.path.isdir(store / name)]
+    assert os.path.samefile(store / 'LATEST' / 'e' / 'a', store / previous[0] / 'd' / 'a')
+
+
+def test_hash_cache_reads_each_inode_once(tmp_path):
+    write_tree(tmp_path / 'set' / 'one', {'a': 'aaa', 'b': 'bbb'}, 1600000000)
+    os.makedirs(tmp_path / 'set' / 'two')
+    os.link(tmp_path / 'set' / 'one' / 'a', tmp_path / 'set' / 'two' / 'a')
+    paths = [str(tmp_path / 'set' / 'one' / 'a'), str(tmp_path / 'set' / 'one' / 'b'),
+             str(tmp_path / 'set' / 'two' / 'a'), str(tmp_path / 'set' / 'missing')]
+    expected = [contentStore.fileUtilities.hash_file(paths[0]), contentStore.fileUtilities.hash_file(paths[1]),
+                contentStore.fileUtilities.hash_file(paths[0]), None]
+    cache = contentStore.HashCache(str(tmp_path / 'set'), 2)
+    assert cache.digests(paths) == expected
+    assert (cache.hashed_files, cache.hashed_bytes, cache.cached_files) == (2, 6, 0)
+    cache.close()
+
+    # kept for the next run
+    cache = contentStore.HashCache(str(tmp_path / 'set'), 2)
+    assert cache.digests(paths) == expected
+    assert (cache.hashed_files, cache.cached_files) == (0, 2)
+    # a new mtime is a new key
+    write_tree(tmp_path / 'set' / 'one', {'b': 'BBB'}, 1600001000)
+    assert cache.digests(paths[1:2]) == [contentStore.fileUtilities.hash_file(paths[1])]
+    assert cache.hashed_files == 1
+    assert cache.lookup(os.stat(paths[1])) == contentStore.fileUtilities.hash_file(paths[1])
+    cache.close()
+
+
+def test_recorded_hashes_are_not_read_again(tmp_path):
+    write_tree(tmp_path / 'set' / 'one', {'a': 'aaa'}, 1600000000)
+    path = str(tmp_path / 'set' / 'one' / 'a')
+    cache = contentStore.HashCache(str(tmp_path / 'set'))
+    cache.record(os.stat(path), 'recorded')
+    assert cache.digests([path]) == ['recorded']
+    assert (cache.recorded_files, cache.hashed_files, cache.cached_files) == (1, 0, 1)
+    cache.close()
+
+
+def test_purge_reuses_the_hash_cache(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'a': 'one', 'd/b': 'two'}, 1600000000)
+    backup()
+    backup()
+    write_tree(tmp_path / 'SRC', {'c': 'three'})
+    backup()
+    store = tmp_path / 'store'
+    # with --no_identity every file is compared by its hash
+    first = run_script('purgeDuplicateBackups.py', store, '--no_identity', '--full')
+    assert '[ Hash Cache ] : [ 2 files hashed' in first.stdout
+    again = run_script('purgeDuplicateBackups.py', store, '--no_identity', '--full')
+    assert '[ Hash Cache ] : [ 0 files hashed (0 bytes), 2 from cache ]' in again.stdout
@@ -0,0 +1,125 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+import copyEngine
+from conftest import snapshots, write_tree
+
+
+def test_large_file_does_not_hold_up_small_files(tmp_path):
+    write_tree(tmp_path / 'src', {'large': 'x' * 100, **{f's{i}': str(i) for i in range(20)}})
+    release = threading.Event()
+
+    def copy(src, dst):
+        if os.path.basename(src) == 'large':
+            release.wait(30)
+        shutil.copy2(src, dst)
+    os.makedirs(tmp_path / 'dst')
+    engine = copyEngine.CopyEngine(copy, workers=2, large_file_size=100, large_workers=1)
+    try:
+        for name in os.listdir(tmp_path / 'src'):
+            engine.submit(str(tmp_path / 'src' / name), str(tmp_path / 'dst' / name))
+        # the small file queue drains while the large file worker is held
+        engine._queues[0][0].join()
+        assert len(os.listdir(tmp_path / 'dst')) == 20
+        assert not os.path.exists(tmp_path / 'dst' / 'large')
+        release.set()
+        engine.wait()
+        assert engine.files == 21
+    finally:
+        release.set()
+        engine.close()
+
+
+def test_submit_blocks_while_the_queue_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyEngine, '_queue_per_worker', 2)
+    write_tree(tmp_path / 'src', {f'f{i}': str(i) for i in range(10)})
+    os.makedirs(tmp_path / 'dst')
+    release = threading.Event()
+
+    def copy(src, dst):
+        release.wait(30)
+        shutil.copy2(src, dst)
+    engine = copyEngine.CopyEngine(copy, workers=1)
+    submitted = []
+
+    def walk():
+        for i in range(10):
+            engine.submit(str(tmp_path / 'src' / f'f{i}'), str(tmp_path / 'dst' / f'f{i}'), tag=i)
+            submitted.append(i)
+    walker = threading.Thread(target=walk)
+    try:
+        walker.start()
+        walker.join(1)
+        # one job held by the worker, two queued, the fourth submit waits
+        assert walker.is_alive()
+        assert len(submitted) == 3
+        release.set()
+        walker.join(30)
+        assert submitted == list(range(10))
+    finally:
+        release.set()
+        engine.close()
+    assert sorted(os.listdir(tmp_path / 'dst')) == sorted(f'f{i}' for i in range(10))
+
+
+def test_existing_destination_is_replaced_not_written_through(tmp_path):
+    write_tree(tmp_path / 'src', {'f': 'new'})
+    write_tree(tmp_path / 'old', {'f': 'old'})
+    os.makedirs(tmp_path / 'dst')
+    # LATEST shares the inode with the older snapshot
+    os.link(tmp_path / 'old' / 'f', tmp_path / 'dst' / 'f')
+    done = []
+    engine = copyEngine.CopyEngine(shutil.copy2, on_done=done.append)
+    engine.submit(str(tmp_path / 'src' / 'f'), str(tmp_path / 'dst' / 'f'), tag='f')
+    engine.close()
+    assert (tmp_path / 'dst' / 'f').read_text() == 'new'
+    assert (tmp_path / 'old' / 'f').read_text() == 'old'
+    assert done == ['f']
+
+
+def test_error_is_raised_by_wait_and_submit(tmp_path):
+    def failing(src, dst):
+        raise OSError(f'cannot copy {src}')
+    write_tree(tmp_path / 'src', {'f': 'x'})
+    engine = copyEngine.CopyEngine(failing, workers=2)
+    engine.submit(str(tmp_path / 'src' / 'f'), str(tmp_path / 'f'))
+    with pytest.raises(OSError):
+        engine.wait()
+    with pytest.raises(OSError):
+        engine.submit(str(tmp_path / 'src' / 'f'), str(tmp_path / 'f'))
+    with pytest.raises(OSError):
+        engine.close()
+    assert not any(thread.is_alive() for thread in engine._threads)
+
+
+def test_directory_times_are_set_after_the_copies(tmp_path):
+    write_tree(tmp_path / 'src', {'d/e/f1': '1', 'd/e/f2': '2', 'd/g': 'g'}, 1600000000)
+    engine = copyEngine.CopyEngine(shutil.copy2, workers=3)
+    for dirpath, dirnames, filenames in os.walk(tmp_path / 'src'):
+        dst = os.path.normpath(os.path.join(tmp_path / 'dst', os.path.relpath(dirpath, tmp_path / 'src')))
+        os.mkdir(dst)
+        engine.add_directory(dirpath, dst)
+        for name in filenames:
+            engine.submit(os.path.join(dirpath, name), os.path.join(dst, name))
+    engine.close()
+    for rel in ('d', os.path.join('d', 'e')):
+        assert os.stat(tmp_path / 'dst' / rel).st_mtime == 1600000000
+
+
+def test_backup_with_the_large_file_lane_and_limits(tmp_path, backup):
+    files = {'big/a': os.urandom(200000), 'big/b': os.urandom(300000), **{f'small/f{i}': str(i) for i in range(30)}}
+    write_tree(tmp_path / 'SRC', files, 1600000000)
+    backup()
+    write_tree(tmp_path / 'SRC', {'big/a': os.urandom(200000), 'small/f0': 'changed'})
+    options = ['--copy_workers', 3, '--large_file_size', '100K', '--large_workers', 2, '--buffer_size', '64K',
+               '--bandwidth', '100M', '--iops', 100000]
+    backup(*options)
+    store = tmp_path / 'store'
+    previous = [name for name in snapshots(store) if name != 'LATEST']
+    assert len(previous) == 1
+    for rel, data in files.items():
+        assert (store / previous[0] / rel).read_bytes() == (data.encode() if isinstance(data, str) else data)
+        assert (store / 'LATEST' / rel).read_bytes() == (tmp_path / 'SRC' / rel).read_bytes()
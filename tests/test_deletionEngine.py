@@ -0,0 +1,147 @@
+import os
+import shutil
+import stat
+import threading
+
+import pytest
+
+import deletionEngine
+from conftest import run_script, snapshots, write_tree
+
+
+def _tree(root, count=50):
+    write_tree(root, {f'd{i % 5}/e/f{i}': str(i) for i in range(count)})
+    return root
+
+
+def test_remove_queues_and_wait_is_the_barrier(tmp_path, monkeypatch):
+    tree = _tree(tmp_path / 'tree')
+    release = threading.Event()
+    remove = deletionEngine._remove
+
+    def blocked(func, path):
+        release.wait(30)
+        remove(func, path)
+    monkeypatch.setattr(deletionEngine, '_remove', blocked)
+    engine = deletionEngine.DeletionEngine(4)
+    try:
+        engine.remove(str(tree))
+        # returned while the workers are held
+        assert os.path.isdir(tree)
+        release.set()
+        engine.wait()
+        assert not os.path.exists(tree)
+        assert engine.files == 50
+    finally:
+        release.set()
+        engine.close()
+
+
+def test_error_is_raised_by_wait(tmp_path, monkeypatch):
+    tree = _tree(tmp_path / 'tree')
+
+    def failing(func, path):
+        raise OSError(f'cannot remove {path}')
+    monkeypatch.setattr(deletionEngine, '_remove', failing)
+    engine = deletionEngine.DeletionEngine(2)
+    engine.remove(str(tree))
+    with pytest.raises(OSError):
+        engine.wait()
+    engine.close()
+
+
+def test_close_deletes_the_trees_still_queued(tmp_path):
+    trees = [_tree(tmp_path / f'tree{i}') for i in range(3)]
+    engine = deletionEngine.DeletionEngine(2)
+    for tree in trees:
+        engine.remove(str(tree))
+    engine.close()
+    assert not any(os.path.exists(tree) for tree in trees)
+    assert engine.directories == 3 * 11
+
+
+# runs incrementalBackup.py with every unlink and rmdir of the deletion engine slowed down
+_slow_deletions = '''
+import runpy, sys, time
+import deletionEngine
+sys.argv = sys.argv[1:]
+remove = deletionEngine._remove
+def slow(func, path):
+    time.sleep(0.1)
+    remove(func, path)
+deletionEngine._remove = slow
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def test_directory_replaced_by_a_file(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'d/a': 'a', 'd/sub/b': 'b', 'k': 'k'}, 1600000000)
+    backup()
+    shutil.rmtree(tmp_path / 'SRC' / 'd')
+    write_tree(tmp_path / 'SRC', {'d': 'now a file'})
+    # the file is copied once the directory queued for deletion is gone
+    backup(code=_slow_deletions)
+    assert (tmp_path / 'store' / 'LATEST' / 'd').read_text() == 'now a file'
+
+
+def _permissions_enforced(monkeypatch):
+    """
+    Entries of a directory without write permission cannot be removed, even when the tests run as root
+    """
+    for name in ('unlink', 'rmdir'):
+        func = getattr(os, name)
+
+        def checked(path, func=func):
+            if not os.stat(os.path.dirname(path)).st_mode & stat.S_IWUSR:
+                raise PermissionError(13, 'Permission denied', path)
+            func(path)
+        monkeypatch.setattr(os, name, checked)
+
+
+def test_read_only_files_and_directories(tmp_path, monkeypatch):
+    tree = _tree(tmp_path / 'tree')
+    for dirpath, dirnames, filenames in os.walk(tree, topdown=False):
+        for name in filenames:
+            os.chmod(os.path.join(dirpath, name), 0o444)
+        os.chmod(dirpath, 0o555)
+    _permissions_enforced(monkeypatch)
+    engine = deletionEngine.DeletionEngine(4)
+    engine.remove(str(tree))
+    engine.wait()
+    engine.close()
+    assert not os.path.exists(tree)
+    assert engine.files == 50
+
+
+def test_trash_is_reclaimed_later(tmp_path, monkeypatch):
+    trees = [_tree(tmp_path / f'tree{i}') for i in range(2)]
+    trash = str(tmp_path / 'set' / '.backupMeta' / 'trash')
+    reclaimed = []
+    monkeypatch.setattr(deletionEngine, 'reclaim_in_background', reclaimed.append)
+    engine = deletionEngine.DeletionEngine(2, trash)
+    for tree in trees:
+        engine.remove(str(tree))
+    # moved, nothing deleted yet
+    assert not any(os.path.exists(tree) for tree in trees)
+    assert len(os.listdir(trash)) == 2
+    engine.wait()
+    engine.close()
+    assert reclaimed == [trash]
+    assert engine.summary() == '2 directories moved to the trash'
+    assert deletionEngine.reclaim(trash).files == 100
+    assert os.listdir(trash) == []
+
+
+def test_purge_moves_the_duplicates_to_the_trash(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'a/f1': 'one', 'k': 'k'}, 1600000000)
+    backup()
+    backup()
+    write_tree(tmp_path / 'SRC', {'c/new': 'new'})
+    backup()
+    store = tmp_path / 'store'
+    assert len(snapshots(store)) == 3
+    run_script('purgeDuplicateBackups.py', store, '-s', '-d', '-n', '--trash')
+    assert len(snapshots(store)) == 2
+    # the background reclaim may still be running, the command line one finishes it
+    run_script('deletionEngine.py', store)
+    assert os.listdir(deletionEngine.trash_dir(str(store))) == []
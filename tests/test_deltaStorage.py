@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+import backupManifest
+import deltaStorage
+import purgeDuplicateBackups
+import treeIndex
+from conftest import run_script, snapshots, write_tree
+
+
+def _store(root, name, files, chunking=deltaStorage.FIXED, block_size=1024 * 1024, mtime=1600000000):
+    """
+    Makes snapshot root/name from files, every file is stored as blocks, and writes its recipe index
+    """
+    source = os.path.join(root, 'src_' + name)
+    write_tree(source, files, mtime)
+    snapshot = os.path.join(root, name)
+    store = deltaStorage.ChunkStore(root, 0, block_size, snapshot, chunking)
+    for rel in files:
+        os.makedirs(os.path.dirname(os.path.join(snapshot, rel)), exist_ok=True)
+        store.store_file(os.path.join(source, rel), os.path.join(snapshot, rel))
+    deltaStorage.write_recipe_index(snapshot, store.recipes)
+    return snapshot
+
+
+@pytest.mark.skipif(deltaStorage.numpy is None, reason='content defined chunking needs numpy')
+def test_cdc_insertion_reuses_blocks(tmp_path):
+    data = os.urandom(4 * 1024 * 1024)
+    write_tree(tmp_path, {'a': data, 'b': data[:100000] + b'inserted' + data[100000:]})
+    store = deltaStorage.ChunkStore(tmp_path, 0, 128 * 1024, tmp_path / 'LATEST', deltaStorage.CDC)
+    os.makedirs(tmp_path / 'LATEST')
+    store.store_file(tmp_path / 'a', tmp_path / 'LATEST' / 'a')
+    store.store_file(tmp_path / 'b', tmp_path / 'LATEST' / 'b')
+    # only the blocks around the insertion are new
+    assert store.bytes_reused > len(data) - 1024 * 1024
+    assert store.recipes == {'a': len(data), 'b': len(data) + 8}
+    deltaStorage.restore_file(tmp_path / 'LATEST' / 'b', tmp_path / 'out', tmp_path)
+    assert (tmp_path / 'out').read_bytes() == (tmp_path / 'b').read_bytes()
+
+
+def test_same_contents_of_recipes_and_files(tmp_path):
+    data = os.urandom(300000)
+    left = _store(str(tmp_path), 'left', {'f': data}, block_size=64 * 1024)
+    right = _store(str(tmp_path), 'right', {'f': data}, block_size=100 * 1024)
+    root = str(tmp_path)
+    assert deltaStorage.same_contents(os.path.join(left, 'f'), os.path.join(right, 'f'), root, True, True)
+    assert deltaStorage.same_contents(os.path.join(left, 'f'), os.path.join(root, 'src_left', 'f'), root, True)
+    assert deltaStorage.hash_logical(os.path.join(left, 'f'), root, True) == \
+        deltaStorage.hash_logical(os.path.join(root, 'src_left', 'f'), root)
+    changed = _store(root, 'changed', {'f': data[:-1] + b'x'}, block_size=64 * 1024)
+    assert not deltaStorage.same_contents(os.path.join(left, 'f'), os.path.join(changed, 'f'), root, True, True)
+
+
+def _same_size_recipes(root):
+    """
+    Two snapshots whose recipe files have the same size and mtime but restore to files of different sizes
+    """
+    left = _store(root, 'left', {'d/f': b'a' * 2000000})
+    right = _store(root, 'right', {'d/f': b'a' * 2000001})
+    assert os.path.getsize(os.path.join(left, 'd/f')) == os.path.getsize(os.path.join(right, 'd/f'))
+    return left, right
+
+
+def test_compare_trees_uses_logical_size(tmp_path):
+    left, right = _same_size_recipes(str(tmp_path))
+    assert not purgeDuplicateBackups.compare_trees(left, right, shallow=True)
+    assert not purgeDuplicateBackups.compare_trees(left, right, shallow=False)
+    tree = treeIndex.TreeIndex.scan(left, sizes=deltaStorage.snapshot_recipes(left))
+    assert 2000000 in tree.size
+
+
+def test_recomputed_digests_use_logical_size(tmp_path):
+    left, right = _same_size_recipes(str(tmp_path))
+    for content_hash in (False, True):
+        assert not purgeDuplicateBackups.compare_snapshot_digests(left, right, content_hash=content_hash)
+    # a snapshot made before the recipe indexes is scanned for its recipes once
+    os.remove(deltaStorage.recipe_index_path(left))
+    os.remove(backupManifest.digest_path(left))
+    digests = backupManifest.snapshot_digests(left, content_hash=True)
+    assert deltaStorage.read_recipe_index(left) == {os.path.join('d', 'f'): 2000000}
+    assert backupManifest.snapshot_digests(right, content_hash=True) != digests
+
+
+def test_equal_recipes_with_other_blocks_compare_equal(tmp_path):
+    root = str(tmp_path)
+    data = os.urandom(3 * 1024 * 1024)
+    left = _store(root, 'left', {'f': data}, block_size=1024 * 1024)
+    right = _store(root, 'right', {'f': data}, block_size=512 * 1024)
+    os.utime(os.path.join(right, 'f'), ns=(1, 1))
+    assert purgeDuplicateBackups.compare_trees(left, right, shallow=False, identity=False)
+
+
+def test_collect_garbage_reads_only_indexed_recipes(tmp_path):
+    root = str(tmp_path)
+    kept = _store(root, 'kept', {'f': b'k' * 3000000})
+    gone = _store(root, 'gone', {'f': b'g' * 3000000})
+    # a recipe not listed in the index is not read
+    unlisted = _store(root, 'unlisted', {'f': b'u' * 3000000})
+    deltaStorage.write_recipe_index(unlisted, {})
+    for sidecar in backupManifest.snapshot_sidecars(gone):
+        os.remove(sidecar)
+    os.remove(os.path.join(gone, 'f'))
+    os.rmdir(gone)
+    # two blocks of each file removed
+    assert deltaStorage.collect_garbage(root) == 4
+    deltaStorage.restore_file(os.path.join(kept, 'f'), os.path.join(root, 'out'), root)
+
+
+def test_backup_runs_keep_recipe_indexes(tmp_path, backup):
+    store = tmp_path / 'store'
+    write_tree(tmp_path / 'SRC', {'big': os.urandom(3000000), 'small': 'x'}, 1600000000)
+    backup('--delta_threshold', '1M', '--delta_block_size', '256K')
+    assert deltaStorage.read_recipe_index(store / 'LATEST') == {'big': 3000000}
+    write_tree(tmp_path / 'SRC', {'big': os.urandom(2000000)}, 1600001000)
+    backup('--delta_threshold', '1M', '--delta_block_size', '256K')
+    old = [name for name in snapshots(store) if name != 'LATEST']
+    assert deltaStorage.read_recipe_index(store / 'LATEST') == {'big': 2000000}
+    assert deltaStorage.read_recipe_index(store / old[0]) == {'big': 3000000}
+    # a run without the threshold keeps the recipes it did not replace
+    write_tree(tmp_path / 'SRC', {'small': 'y'})
+    backup()
+    assert deltaStorage.read_recipe_index(store / 'LATEST') == {'big': 2000000}
+    run_script('deltaStorage.py', 'gc', store)
+    for name in snapshots(store):
+        run_script('deltaStorage.py', 'restore', store / name, tmp_path / ('out_' + name))
+    assert (tmp_path / 'out_LATEST' / 'big').read_bytes() == (tmp_path / 'SRC' / 'big').read_bytes()
+
+
+@pytest.mark.parametrize('options', [[], ['--delta_threshold', '100K']])
+def test_no_manifest_runs_compare_recipes_by_logical_size(tmp_path, backup, options):
+    store = tmp_path / 'store'
+    write_tree(tmp_path / 'SRC', {'big': os.urandom(300000), 'small': 'x'}, 1600000000)
+    backup('--delta_threshold', '100K')
+    for _ in range(2):
+        assert 'Directories were identical' in backup('--no_manifest', *options).stdout
+    assert run_script('incrementalBackup.py', tmp_path / 'SRC', store / 'LATEST', '--no_manifest', '--test',
+                      check=False).returncode == 0
+    # the file stored as blocks is still replaced when its source changes
+    write_tree(tmp_path / 'SRC', {'big': os.urandom(300000)}, 1600001000)
+    assert '(1 items changed)' in backup('--no_manifest', *options).stdout
+    run_script('deltaStorage.py', 'restore', store / 'LATEST', tmp_path / 'out')
+    assert (tmp_path / 'out' / 'big').read_bytes() == (tmp_path / 'SRC' / 'big').read_bytes()
+
+
+def test_files_like_recipes_are_files(tmp_path, backup):
+    store = tmp_path / 'store'
+    fake = deltaStorage.recipe_magic + b'{"size": 1, "block_size": 1, "blocks": ["00"]}'
+    write_tree(tmp_path / 'SRC', {'big': os.urandom(300000), 'fake': fake}, 1600000000)
+    backup('--delta_threshold', '100K')
+    backup('--no_manifest', '--delta_threshold', '100K')
+    assert deltaStorage.read_recipe_index(store / 'LATEST') == {'big': 300000}
+    run_script('deltaStorage.py', 'gc', store)
+    for name in snapshots(store):
+        run_script('restoreBackup.py', 'restore', store, name, tmp_path / ('out_' + name))
+        assert (tmp_path / ('out_' + name) / 'fake').read_bytes() == fake
+        assert (tmp_path / ('out_' + name) / 'big').read_bytes() == (tmp_path / 'SRC' / 'big').read_bytes()
+    run_script('purgeDuplicateBackups.py', store, '-d', '-n', '--full')
@@ -0,0 +1,124 @@
+import errno
+import hashlib
+import os
+import time
+
+import pytest
+
+import fileUtilities
+
+_data = os.urandom(300000)
+
+
+def _source(tmp_path) -> str:
+    path = str(tmp_path / 'src')
+    with open(path, 'wb') as f:
+        f.write(_data)
+    os.chmod(path, 0o640)
+    os.utime(path, (1600000000, 1600000000))
+    return path
+
+
+def _same_copy(src: str, dst: str):
+    with open(dst, 'rb') as f:
+        assert f.read() == _data
+    src_st, dst_st = os.stat(src), os.stat(dst)
+    assert dst_st.st_mtime_ns == src_st.st_mtime_ns
+    assert dst_st.st_mode == src_st.st_mode
+    assert not os.path.samefile(src, dst)
+
+
+@pytest.mark.parametrize('method', fileUtilities.copy_methods)
+def test_every_method_copies_data_and_metadata(tmp_path, method):
+    src = _source(tmp_path)
+    stats = fileUtilities.CopyStats()
+    assert fileUtilities.copy_file(src, str(tmp_path / 'dst'), method, stats) == str(tmp_path / 'dst')
+    _same_copy(src, str(tmp_path / 'dst'))
+    assert stats.files == 1
+    assert stats.bytes_cloned + stats.bytes_copied == len(_data)
+
+
+def test_copy_into_a_directory(tmp_path):
+    src = _source(tmp_path)
+    os.makedirs(tmp_path / 'out')
+    assert fileUtilities.copy_file(src, str(tmp_path / 'out')) == str(tmp_path / 'out' / 'src')
+    _same_copy(src, str(tmp_path / 'out' / 'src'))
+
+
+def test_unsupported_method_falls_back(tmp_path, monkeypatch):
+    def unsupported(*args, **kwargs):
+        raise OSError(errno.EOPNOTSUPP, 'not supported')
+    monkeypatch.setattr(fileUtilities, '_reflink', unsupported)
+    monkeypatch.setattr(fileUtilities, '_copy_file_range', unsupported)
+    src = _source(tmp_path)
+    stats = fileUtilities.CopyStats()
+    fileUtilities.copy_file(src, str(tmp_path / 'dst'), 'reflink', stats)
+    # what a failed method wrote is dropped before the next one
+    _same_copy(src, str(tmp_path / 'dst'))
+    assert (stats.files, stats.bytes_cloned, stats.bytes_copied) == (1, 0, len(_data))
+
+
+def test_other_errors_are_raised(tmp_path, monkeypatch):
+    def failing(*args, **kwargs):
+        raise OSError(errno.EIO, 'input/output error')
+    monkeypatch.setattr(fileUtilities, '_reflink', failing)
+    with pytest.raises(OSError):
+        fileUtilities.copy_file(_source(tmp_path), str(tmp_path / 'dst'), 'reflink')
+
+
+def test_sparse_file_keeps_its_size_and_data(tmp_path):
+    path = str(tmp_path / 'sparse')
+    with open(path, 'wb') as f:
+        f.write(b'start')
+        f.seek(8 * 1024 * 1024)
+        f.write(b'end')
+    for method in ('copy_file_range', 'sendfile'):
+        dst = str(tmp_path / method)
+        fileUtilities.copy_file(path, dst, method)
+        with open(path, 'rb') as f_src, open(dst, 'rb') as f_dst:
+            assert f_src.read() == f_dst.read()
+
+
+def test_copy_with_hash_buffer_and_throttle(tmp_path):
+    src = _source(tmp_path)
+    hasher = hashlib.sha256()
+    fileUtilities.copy_file(src, str(tmp_path / 'hashed'), hasher=hasher, buffer_size=4096)
+    _same_copy(src, str(tmp_path / 'hashed'))
+    assert hasher.hexdigest() == fileUtilities.hash_file(src)
+    fileUtilities.copy_file(src, str(tmp_path / 'buffered'), 'copy2', buffer_size=4096,
+                            throttle=fileUtilities.Throttle(ops_per_second=1000000))
+    _same_copy(src, str(tmp_path / 'buffered'))
+
+
+@pytest.mark.parametrize('limits, calls, seconds', [
+    ({'bytes_per_second': 100000}, [(10000, 0)] * 5, 0.5),
+    ({'ops_per_second': 20}, [(0, 1)] * 10, 0.5),
+    # the slower of the two limits
+    ({'bytes_per_second': 10 ** 9, 'ops_per_second': 20}, [(1000, 1)] * 10, 0.5),
+])
+def test_throttle_paces_the_copies(limits, calls, seconds):
+    throttle = fileUtilities.Throttle(**limits, burst=0)
+    start = time.monotonic()
+    for nbytes, ops in calls:
+        throttle.consume(nbytes, ops)
+    assert seconds * 0.9 <= time.monotonic() - start < seconds + 1
+
+
+def test_throttle_allows_a_burst():
+    throttle = fileUtilities.Throttle(ops_per_second=10, burst=1)
+    start = time.monotonic()
+    for _ in range(10):
+        throttle.consume()
+    assert time.monotonic() - start < 0.5
+
+
+@pytest.mark.parametrize('text, size', [('4096', 4096), ('512K', 512 * 1024), ('40G', 40 * 1024 ** 3),
+                                        ('1.5m', 3 * 512 * 1024), (' 2MB ', 2 * 1024 ** 2), ('1T', 1024 ** 4)])
+def test_parse_size(text, size):
+    assert fileUtilities.parse_size(text) == size
+
+
+@pytest.mark.parametrize('text', ['xx', '', 'K', '10Q'])
+def test_parse_size_rejects_other_text(text):
+    with pytest.raises(ValueError):
+        fileUtilities.parse_size(text)
@@ -0,0 +1,177 @@
+import os
+
+import pytest
+
+import deletionEngine
+import incrementalBackup
+from incrementalBackup import IgnoreFilesFilter
+from conftest import snapshots, write_tree
+
+
+@pytest.mark.parametrize('patterns, rel, is_dir, ignored', [
+    # a pattern without a / matches a name at any depth
+    (['*.exe'], 'a.exe', False, True),
+    (['*.exe'], os.path.join('d', 'e', 'b.exe'), False, True),
+    (['*.exe'], 'a.exe.txt', False, False),
+    # a trailing / matches directories only
+    (['logs/'], 'logs', True, True),
+    (['logs/'], 'logs', False, False),
+    (['logs/'], os.path.join('d', 'logs'), True, True),
+    # a / anchors the pattern to the root of the walk
+    (['/build'], 'build', True, True),
+    (['/build'], os.path.join('d', 'build'), True, False),
+    (['d/*.tmp'], os.path.join('d', 'a.tmp'), False, True),
+    (['d/*.tmp'], os.path.join('d', 'e', 'a.tmp'), False, False),
+    (['d/**/*.tmp'], os.path.join('d', 'e', 'f', 'a.tmp'), False, True),
+    (['build/**'], os.path.join('build', 'x'), False, True),
+    (['build/**'], 'build', True, False),
+    # the last matching pattern wins
+    (['*.log', '!keep.log'], 'keep.log', False, False),
+    (['*.log', '!keep.log'], 'other.log', False, True),
+    (['!keep.log', '*.log'], 'keep.log', False, True),
+    # mixed with anchored patterns a name pattern still matches at any depth
+    (['/build', '*.o'], os.path.join('src', 'a.o'), False, True),
+    (['a[0-9]'], 'a1', False, True),
+])
+def test_is_ignored(patterns, rel, is_dir, ignored):
+    assert IgnoreFilesFilter(patterns).is_ignored(rel, is_dir) == ignored
+
+
+def test_is_dir_is_only_asked_for_directory_only_patterns():
+    asked = []
+
+    def is_dir():
+        asked.append(True)
+        return True
+    assert IgnoreFilesFilter(['*.exe']).is_ignored('a.exe', is_dir)
+    assert not asked
+    assert IgnoreFilesFilter(['logs/', '*.exe']).is_ignored('logs', is_dir)
+    assert asked == [True]
+    assert not IgnoreFilesFilter([]).is_ignored('logs', is_dir)
+
+
+def test_path_excluded_looks_at_the_directories_above():
+    ignore = IgnoreFilesFilter(['logs/', '/d/e', '!*.keep'])
+    assert ignore.path_excluded(os.path.join('x', 'logs', 'a', 'b.txt'), False)
+    assert ignore.path_excluded(os.path.join('d', 'e', 'c'), False)
+    assert not ignore.path_excluded(os.path.join('x', 'd', 'e', 'c'), False)
+    assert not ignore.path_excluded(os.path.join('x', 'b.txt'), False)
+    # a file named like an ignored directory
+    assert not ignore.path_excluded(os.path.join('x', 'logs'), False)
+    assert not ignore.path_excluded('', True)
+
+
+def test_ignore_file_patterns_come_after_the_list(tmp_path):
+    (tmp_path / 'ignore').write_text('# comment\n\n*.log\n\\#hash\n')
+    ignore = IgnoreFilesFilter(['!keep.log'], str(tmp_path / 'ignore'))
+    assert ignore.ignore_list == ['!keep.log', '*.log', '#hash']
+    assert ignore.is_ignored('keep.log') and ignore.is_ignored('#hash')
+
+
+def test_filter_list_tells_directories_from_files(tmp_path):
+    write_tree(tmp_path, {'logs/a': 'a', 'd/logs': 'a file', 'd/b': 'b'})
+    ignore = IgnoreFilesFilter(['logs/'])
+    assert ignore.filter_list(['logs', 'd'], '', str(tmp_path)) == ['d']
+    assert ignore.filter_list(['logs', 'b'], 'd', str(tmp_path / 'd')) == ['logs', 'b']
+
+
+def test_backup_leaves_out_the_ignored_paths(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'logs/a': 'a', 'd/logs': 'a file', 'top.tmp': 't', 'd/top.tmp': 't',
+                                  'd/sub/logs/b': 'b', 'k': 'k'})
+    backup('-o', 'logs/,/top.tmp')
+    latest = tmp_path / 'store' / 'LATEST'
+    found = sorted(os.path.relpath(os.path.join(dirpath, name), latest)
+                   for dirpath, _, filenames in os.walk(latest) for name in filenames)
+    assert found == sorted([os.path.join('d', 'logs'), os.path.join('d', 'top.tmp'), 'k'])
+
+
+def _files(root) -> list:
+    return sorted(os.path.relpath(os.path.join(dirpath, name), root)
+                  for dirpath, dirnames, filenames in os.walk(root) for name in dirnames + filenames)
+
+
+def test_parallel_link_farm_is_the_same_tree(tmp_path):
+    write_tree(tmp_path / 'src', {f'd{i % 4}/e{i % 3}/f{i}': str(i) for i in range(60)})
+    write_tree(tmp_path / 'src', {'empty/.keep': '', 'top': 't', 'd1/skip.log': 'l', 'logs/a': 'a'})
+    ignore = IgnoreFilesFilter(['*.log', 'logs/'])
+    incrementalBackup.create_links_of_files(str(tmp_path / 'src'), str(tmp_path / 'serial'), False, ignore)
+    links, directories = incrementalBackup.create_links_of_files_parallel(str(tmp_path / 'src'),
+                                                                          str(tmp_path / 'parallel'), False, ignore,
+                                                                          workers=4)
+    assert _files(tmp_path / 'parallel') == _files(tmp_path / 'serial')
+    assert links == 62
+    # the root, d0..d3 with e0..e2 in each and empty
+    assert directories == 1 + 4 + 12 + 1
+    for rel in ('top', os.path.join('d2', 'e2', 'f14')):
+        assert os.path.samefile(tmp_path / 'parallel' / rel, tmp_path / 'src' / rel)
+
+
+def test_error_of_a_worker_is_raised(tmp_path):
+    write_tree(tmp_path / 'src', {'d/a': 'a', 'd/e/b': 'b'})
+    # a file where the link farm creates a directory
+    write_tree(tmp_path / 'dest', {'d': 'not a directory'})
+    with pytest.raises(OSError):
+        incrementalBackup.create_links_of_files_parallel(str(tmp_path / 'src'), str(tmp_path / 'dest'), False,
+                                                         IgnoreFilesFilter([]))
+
+
+def test_unchanged_files_are_linked_to_the_previous_snapshot(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'a': 'one', 'd/b': 'two'}, 1600000000)
+    backup()
+    write_tree(tmp_path / 'SRC', {'c': 'three'}, 1600000000)
+    backup()
+    store = tmp_path / 'store'
+    previous = [name for name in snapshots(store) if name != 'LATEST'][0]
+    assert os.path.samefile(store / 'LATEST' / 'd' / 'b', store / previous / 'd' / 'b')
+    assert not os.path.exists(store / previous / 'c')
+
+
+def test_changes_are_yielded_per_directory(tmp_path):
+    write_tree(tmp_path / 'src', {'same': 'x', 'changed': 'x', 'added': 'x', 'd/new/f': 'x', 'd/e/f': 'x'},
+               1600000000)
+    write_tree(tmp_path / 'dst', {'same': 'x', 'changed': 'xx', 'removed': 'x', 'gone/f': 'x', 'd/e/f': 'yy',
+                                  'd/e/old': 'x'}, 1600000000)
+    events = [(event.kind, event.rel) for event in incrementalBackup.iter_changes(str(tmp_path / 'src'),
+                                                                                  str(tmp_path / 'dst'))]
+    # removals, then additions, then changed files, a directory at a time
+    assert sorted(events[:2]) == [('dir-removed', 'gone'), ('removed', 'removed')]
+    assert events[2] == ('added', 'added')
+    assert events[3:] == [('modified', 'changed'), ('dir-added', os.path.join('d', 'new')),
+                          ('removed', os.path.join('d', 'e', 'old')), ('modified', os.path.join('d', 'e', 'f'))]
+
+
+def test_changes_are_found_as_they_are_consumed(tmp_path, monkeypatch):
+    write_tree(tmp_path / 'src', {f'd{i}/f': 'x' for i in range(10)})
+    write_tree(tmp_path / 'dst', {f'd{i}/f': 'changed' for i in range(10)})
+    listed = []
+    list_directory = incrementalBackup._list_directory
+    monkeypatch.setattr(incrementalBackup, '_list_directory', lambda path: listed.append(path) or list_directory(path))
+    events = incrementalBackup.iter_changes(str(tmp_path / 'src'), str(tmp_path / 'dst'))
+    assert not listed
+    next(events)
+    # the root and the first directory on each side
+    assert len(listed) == 4
+    assert len(list(events)) == 9
+
+
+def test_deep_tree_is_not_limited_by_recursion(tmp_path):
+    deep = os.path.join(*['d'] * 1100)
+    for side, data in (('src', 'new!'), ('dst', 'old')):
+        # os.makedirs recurses too
+        path = str(tmp_path / side)
+        for _ in range(1101):
+            os.mkdir(path)
+            path = os.path.join(path, 'd')
+        write_tree(tmp_path / side / deep, {'f': data}, 1600000000)
+    try:
+        changes = incrementalBackup.compare_replace_and_remove(str(tmp_path / 'src'), str(tmp_path / 'dst'), False,
+                                                               test=True)
+        assert changes == [f'[DIFF]:[{os.path.join(tmp_path, "src", deep, "f")}]']
+        # nothing changed when testing
+        assert (tmp_path / 'dst' / deep / 'f').read_text() == 'old'
+    finally:
+        # shutil.rmtree (the clean up of pytest) recurses
+        engine = deletionEngine.DeletionEngine()
+        for side in ('src', 'dst'):
+            engine.remove(str(tmp_path / side))
+        engine.close()
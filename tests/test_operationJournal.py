@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import deltaStorage
+import operationJournal
+from conftest import run_script, snapshots, write_tree
+
+# runs incrementalBackup.py and kills the process (no clean up) after a number of hard links, copies or files
+# stored as blocks
+_crash = '''
+import os, runpy, sys
+import deltaStorage, fileUtilities
+sys.argv = sys.argv[1:]
+what, limit = os.environ['CRASH_ON'], int(os.environ['CRASH_AFTER'])
+calls = [0]
+def counted(call):
+    def run(*args, **kwargs):
+        calls[0] += 1
+        if calls[0] > limit:
+            os._exit(9)
+        return call(*args, **kwargs)
+    return run
+if what == 'links':
+    os.link = counted(os.link)
+elif what == 'blocks':
+    deltaStorage.ChunkStore.store_file = counted(deltaStorage.ChunkStore.store_file)
+else:
+    fileUtilities.copy_file = counted(fileUtilities.copy_file)
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def _read_bytes(root) -> dict:
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, root)] = f.read()
+    return tree
+
+
+@pytest.mark.parametrize('what, limit', [('links', 25), ('copies', 5)])
+def test_interrupted_run_resumes(tmp_path, backup, monkeypatch, what, limit):
+    files = {}
+    for i in range(20):
+        files.update({f'd{i}/f{j}': f'{i} {j}' for j in range(3)})
+        files.update({f'd{i}/s/g{j}': f'x{i}{j}' for j in range(3)})
+    write_tree(tmp_path / 'SRC', files, 1600000000)
+    backup()
+    old = _read_bytes(tmp_path / 'store' / 'LATEST')
+
+    for i in range(20):
+        write_tree(tmp_path / 'SRC', {f'd{i}/f1': f'changed {i}'})
+        os.remove(tmp_path / 'SRC' / f'd{i}' / 'f2')
+    write_tree(tmp_path / 'SRC', {f'new/a/n{j}': f'n{j}' for j in range(10)})
+    monkeypatch.setenv('CRASH_ON', what)
+    monkeypatch.setenv('CRASH_AFTER', str(limit))
+    assert backup(check=False, code=_crash).returncode == 9
+    store = tmp_path / 'store'
+    journal = operationJournal.journal_path(store, store / 'LATEST', create=False)
+    assert os.path.isfile(journal)
+
+    monkeypatch.delenv('CRASH_ON')
+    backup()
+    assert not os.path.exists(journal)
+    assert _read_bytes(store / 'LATEST') == _read_bytes(tmp_path / 'SRC')
+    names = snapshots(store)
+    assert len(names) == 2
+    assert _read_bytes(store / names[1]) == old
+
+
+def test_resumed_run_keeps_recipe_index(tmp_path, backup, monkeypatch):
+    store = tmp_path / 'store'
+    write_tree(tmp_path / 'SRC', {f'big{i}': os.urandom(200000) for i in range(4)}, 1600000000)
+    backup('--delta_threshold', '100K')
+    write_tree(tmp_path / 'SRC', {f'big{i}': os.urandom(150000 + i) for i in range(3)})
+    os.remove(tmp_path / 'SRC' / 'big3')
+    write_tree(tmp_path / 'SRC', {'small': 'x'})
+    monkeypatch.setenv('CRASH_ON', 'blocks')
+    monkeypatch.setenv('CRASH_AFTER', '2')
+    assert backup('--delta_threshold', '100K', '--copy_workers', '0', check=False, code=_crash).returncode == 9
+    # the index of LATEST does not list what the interrupted run stored yet
+    assert run_script('deltaStorage.py', 'gc', store, check=False).returncode != 0
+
+    monkeypatch.delenv('CRASH_ON')
+    backup('--delta_threshold', '100K')
+    assert deltaStorage.read_recipe_index(store / 'LATEST') == {f'big{i}': 150000 + i for i in range(3)}
+    run_script('deltaStorage.py', 'gc', store)
+    run_script('restoreBackup.py', 'restore', store, 'LATEST', tmp_path / 'out')
+    assert _read_bytes(tmp_path / 'out') == _read_bytes(tmp_path / 'SRC')
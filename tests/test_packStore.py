@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import packStore
+from conftest import run_script, snapshots, write_tree
+
+
+@pytest.fixture
+def packed_set(tmp_path, backup):
+    """
+    Two snapshots that only differ in a packed file of the same size, and LATEST (never purged)
+    """
+    write_tree(tmp_path / 'SRC', {'small': 'aaaa', 'd/other': 'x', 'big': 'b' * 100000}, 1600000000)
+    backup('--pack_threshold', '64K')
+    write_tree(tmp_path / 'SRC', {'small': 'bbbb'}, 1600000000)
+    os.utime(tmp_path / 'SRC' / 'small', (1600001000, 1600001000))
+    backup()
+    backup()
+    store = tmp_path / 'store'
+    assert len(snapshots(store)) == 3
+    assert 'small' in packStore.read_index(packStore.index_path(store / 'LATEST'))[1]
+    return store
+
+
+@pytest.mark.parametrize('options', [[], ['-s'], ['-m'], ['-m', '--content_hash'],
+                                     # the digest files do not match the ignore list, digests come from the trees
+                                     ['-m', '-i', 'nothing*'], ['-m', '--content_hash', '-i', 'nothing*']])
+def test_purge_sees_packed_files(packed_set, options):
+    before = snapshots(packed_set)
+    run_script('purgeDuplicateBackups.py', packed_set, '-d', '-n', '--full', *options)
+    assert snapshots(packed_set) == before
+
+
+def test_purge_removes_packed_duplicates(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'small': 'aaaa', 'big': 'b' * 100000}, 1600000000)
+    backup('--pack_threshold', '64K')
+    backup()
+    backup()
+    store = tmp_path / 'store'
+    run_script('purgeDuplicateBackups.py', store, '-d', '-n', '-m', '-i', 'nothing*')
+    kept = snapshots(store)
+    assert len(kept) == 2
+    assert packStore.same_packed_files(store / kept[0], store / kept[1])
+    out = tmp_path / 'out'
+    run_script('restoreBackup.py', 'restore', store, 'LATEST', out)
+    assert (out / 'small').read_text() == 'aaaa'
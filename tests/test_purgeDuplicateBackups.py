@@ -0,0 +1,106 @@
+import filecmp
+import os
+
+import pytest
+
+import backupManifest
+import contentStore
+import purgeDuplicateBackups
+from conftest import run_script, snapshots, write_tree
+
+
+def _make_set(tmp_path, backup) -> list:
+    """
+    :return: snapshots of the set oldest first, the second is a duplicate of the first, LATEST is last
+    """
+    write_tree(tmp_path / 'SRC', {'a/f1': 'one', 'a/b/f2': 'two', 'c/f3': 'three'}, 1600000000)
+    backup()
+    backup()
+    write_tree(tmp_path / 'SRC', {'c/new': 'new'})
+    backup()
+    store = tmp_path / 'store'
+    return [str(store / name) for name in snapshots(store) if name != 'LATEST'] + [str(store / 'LATEST')]
+
+
+def test_pair_found_the_same_is_compared_again_before_deleting(tmp_path, backup):
+    first, duplicate, latest = _make_set(tmp_path, backup)
+    result = run_script('purgeDuplicateBackups.py', tmp_path / 'store', '-s')
+    assert '[ Purge State ] : [ 0 comparisons reused' in result.stdout
+    result = run_script('purgeDuplicateBackups.py', tmp_path / 'store', '-s')
+    assert '[ Purge State ] : [ 1 comparisons reused' in result.stdout
+    # changed by hand deep inside the snapshot (a new inode, the old one is shared with the first snapshot), the
+    # fingerprint of the snapshot stays the same
+    write_tree(tmp_path / 'tmp', {'f2': 'TWO'}, 1600001000)
+    os.replace(tmp_path / 'tmp' / 'f2', os.path.join(duplicate, 'a', 'b', 'f2'))
+    result = run_script('purgeDuplicateBackups.py', tmp_path / 'store', '-s', '-d', '-n')
+    assert '[ Purge State ] : [ 0 comparisons reused' in result.stdout
+    assert snapshots(tmp_path / 'store') == sorted(os.path.basename(path) for path in (first, duplicate, latest))
+
+
+def _reused(tmp_path, *options) -> int:
+    result = run_script('purgeDuplicateBackups.py', tmp_path / 'store', *options)
+    return int(result.stdout.split('[ Purge State ] : [ ')[1].split()[0])
+
+
+def test_pairs_are_reused_with_the_same_options(tmp_path, backup):
+    _make_set(tmp_path, backup)
+    assert _reused(tmp_path, '-s') == 0
+    assert _reused(tmp_path, '-s') == 1
+    # other options, the saved outcomes are dropped
+    assert _reused(tmp_path) == 0
+    assert _reused(tmp_path) == 1
+    assert _reused(tmp_path, '-i', 'nothing*') == 0
+    assert _reused(tmp_path, '--full') == 0
+
+
+def test_pair_is_compared_again_when_a_snapshot_changes(tmp_path, backup):
+    first, duplicate, _ = _make_set(tmp_path, backup)
+    assert _reused(tmp_path, '-s') == 0
+    os.utime(duplicate, (1600002000, 1600002000))
+    assert _reused(tmp_path, '-s') == 0
+    assert _reused(tmp_path, '-s') == 1
+    # the manifest of the first snapshot written again
+    os.utime(backupManifest.manifest_path(first), (1600002000, 1600002000))
+    assert _reused(tmp_path, '-s') == 0
+
+
+def test_state_forgets_the_snapshots_deleted(tmp_path, backup):
+    first, duplicate, latest = _make_set(tmp_path, backup)
+    state = purgeDuplicateBackups.PurgeState(str(tmp_path / 'store'), {})
+    state.record(first, duplicate, True)
+    state.record(duplicate, latest, False)
+    state.save([first, latest])
+    state = purgeDuplicateBackups.PurgeState(str(tmp_path / 'store'), {})
+    assert state.outcome(first, duplicate) is None and state.outcome(duplicate, latest) is None
+    state.record(first, latest, False)
+    state.save([first, latest])
+    state = purgeDuplicateBackups.PurgeState(str(tmp_path / 'store'), {})
+    assert state.outcome(first, latest) is False
+    assert state.reused == 1
+
+
+@pytest.mark.parametrize('use_hash_cache', [True, False])
+def test_same_inode_is_equal_without_reading(tmp_path, backup, use_hash_cache):
+    first, duplicate, _ = _make_set(tmp_path, backup)
+    hash_cache = contentStore.HashCache(str(tmp_path / 'store')) if use_hash_cache else None
+    stats = purgeDuplicateBackups.CompareStats()
+    assert purgeDuplicateBackups.compare_trees(first, duplicate, shallow=False, stats=stats, hash_cache=hash_cache)
+    # every file of the duplicate is a link to the one of the first snapshot
+    assert (stats.compared, stats.by_inode, stats.by_content) == (3, 3, 0)
+    stats = purgeDuplicateBackups.CompareStats()
+    assert purgeDuplicateBackups.compare_trees(first, duplicate, shallow=False, identity=False, stats=stats,
+                                               hash_cache=hash_cache)
+    assert (stats.compared, stats.by_inode, stats.by_content) == (3, 0, 3)
+
+    # same size and mtime, other contents and a new inode
+    write_tree(tmp_path / 'tmp', {'f2': 'TWO'}, 1600000000)
+    os.replace(tmp_path / 'tmp' / 'f2', os.path.join(duplicate, 'a', 'b', 'f2'))
+    assert purgeDuplicateBackups.compare_trees(first, duplicate, shallow=True)
+    # filecmp caches its outcomes by path and os.stat signature
+    filecmp.clear_cache()
+    stats = purgeDuplicateBackups.CompareStats()
+    assert not purgeDuplicateBackups.compare_trees(first, duplicate, shallow=False, stats=stats,
+                                                   hash_cache=hash_cache)
+    assert (stats.by_inode, stats.by_content) == (2, 1)
+    if hash_cache is not None:
+        hash_cache.close()
@@ -0,0 +1,67 @@
+import json
+import threading
+
+import runReport
+from conftest import run_script, write_tree
+
+
+def test_phases_add_up_and_counters_are_thread_safe():
+    report = runReport.RunReport('incrementalBackup')
+    with report.phase('compare'):
+        with report.phase('copy'):
+            pass
+    report.add_time('copy', 2.0)
+    assert report.phases['copy'] >= 2.0 and report.phases['compare'] < report.phases['copy']
+
+    def count():
+        for _ in range(1000):
+            report.count('files_copied')
+            report.count('bytes_copied', 10)
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.set_value('snapshots', 3)
+    assert report.counters == {'files_copied': 8000, 'bytes_copied': 80000, 'snapshots': 3}
+
+
+def test_report_formats(tmp_path):
+    report = runReport.RunReport('purgeDuplicateBackups')
+    report.add_time('compare', 1.5)
+    report.set_value('duplicates', 2)
+    report.finish()
+    report.write(str(tmp_path / 'report.json'))
+    with open(tmp_path / 'report.json') as f:
+        written = json.load(f)
+    assert written['script'] == 'purgeDuplicateBackups' and written['success'] is True
+    assert written['phases'] == {'compare': 1.5} and written['counters'] == {'duplicates': 2}
+    report.write(str(tmp_path / 'report.prom'))
+    lines = (tmp_path / 'report.prom').read_text().splitlines()
+    assert 'purge_duplicate_backups_phase_seconds{phase="compare"} 1.500000' in lines
+    assert 'purge_duplicate_backups_duplicates 2' in lines
+    assert 'purge_duplicate_backups_success 1' in lines
+    assert not (tmp_path / 'report.prom.tmp').exists()
+
+
+def test_module_functions_do_nothing_until_started(monkeypatch):
+    monkeypatch.setattr(runReport, '_active', None)
+    with runReport.phase('scan'):
+        runReport.count('files_stated')
+        runReport.add_time('copy', 1.0)
+        runReport.set_value('snapshots', 1)
+    assert runReport.active() is None
+
+
+def test_backup_writes_its_report(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'a': 'one', 'd/b': 'two'}, 1600000000)
+    backup('--report', tmp_path / 'first.json')
+    with open(tmp_path / 'first.json') as f:
+        first = json.load(f)
+    assert first['success'] is True
+    assert first['counters']['files_copied'] == 2 and first['counters']['bytes_copied'] == 6
+    assert 'scan' in first['phases']
+    # a failed run is reported too
+    run_script('incrementalBackup.py', tmp_path / 'missing', tmp_path / 'other' / 'LATEST', '--report',
+               tmp_path / 'failed.prom', check=False)
+    assert 'incremental_backup_success 0' in (tmp_path / 'failed.prom').read_text().splitlines()
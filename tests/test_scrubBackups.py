@@ -0,0 +1,52 @@
+import os
+import shutil
+import time
+
+import backupManifest
+import scrubBackups
+from conftest import snapshots, write_tree
+
+
+def _make_set(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'a/f{}'.format(i): os.urandom(1000) for i in range(10)}, 1600000000)
+    backup('--checksums')
+    write_tree(tmp_path / 'SRC', {'a/new': 'new'})
+    backup('--checksums')
+    return tmp_path / 'store'
+
+
+def test_snapshots_are_walked_once(tmp_path, backup, monkeypatch):
+    store = _make_set(tmp_path, backup)
+    assert scrubBackups.scrub(store).ok == 11
+    walked = []
+    walk_inodes = scrubBackups._walk_inodes
+    monkeypatch.setattr(scrubBackups, '_walk_inodes', lambda top: walked.append(top) or walk_inodes(top))
+    stats = scrubBackups.scrub(store)
+    assert stats.inodes == 11 and stats.ok == 11
+    # only the objects and the packs of the metadata directory
+    assert not any(str(store / name) == top for top in walked for name in snapshots(store))
+
+    # a snapshot changed since it was walked is walked again, a purged one is forgotten
+    old = [name for name in snapshots(store) if name != 'LATEST'][0]
+    shutil.rmtree(store / old)
+    for sidecar in backupManifest.snapshot_sidecars(store / old):
+        os.remove(sidecar)
+    write_tree(tmp_path / 'SRC', {'b': 'b'})
+    backup('--checksums')
+    walked.clear()
+    stats = scrubBackups.scrub(store)
+    assert str(store / 'LATEST') in walked
+    inodes = scrubBackups.unique_inodes(store)
+    assert stats.inodes == len(inodes) and stats.ok == len(inodes)
+    assert sorted(scrubBackups.ScrubLog(store).verified()) == sorted(inodes)
+
+
+def test_time_budget_starts_after_the_walk(tmp_path, backup, monkeypatch):
+    store = _make_set(tmp_path, backup)
+    walk_inodes = scrubBackups._walk_inodes
+
+    def slow_walk(top):
+        time.sleep(0.3)
+        return walk_inodes(top)
+    monkeypatch.setattr(scrubBackups, '_walk_inodes', slow_walk)
+    assert scrubBackups.scrub(store, time_budget=0.5).scrubbed == 11
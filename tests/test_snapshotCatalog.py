@@ -0,0 +1,79 @@
+import os
+import stat
+
+import backupManifest
+import snapshotCatalog
+from conftest import run_script, snapshots, write_tree
+
+
+def _catalog_contents(root) -> dict:
+    catalog = snapshotCatalog.SnapshotCatalog(root, create=False)
+    contents = {name: sorted(catalog.files_at(seq)) for seq, name, _, _ in catalog.snapshots()}
+    catalog.close()
+    return contents
+
+
+def _make_set(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'a/f1': 'one', 'a/b/f2': 'two', 'c/f3': 'three', 'k': 'keep'}, 1600000000)
+    backup('--catalog')
+    write_tree(tmp_path / 'SRC', {'a/f1': 'changed', 'a/b/new': 'new'}, 1600001000)
+    os.remove(tmp_path / 'SRC' / 'c' / 'f3')
+    os.rmdir(tmp_path / 'SRC' / 'c')
+    backup()
+    # nothing changed, the snapshot this makes is a duplicate
+    backup()
+    write_tree(tmp_path / 'SRC', {'a/f1': 'again'}, 1600002000)
+    backup()
+
+
+def test_catalog_runs_match_rebuild(tmp_path, backup):
+    _make_set(tmp_path, backup)
+    store = tmp_path / 'store'
+    incremental = _catalog_contents(store)
+    assert sorted(incremental) == snapshots(store)
+    snapshotCatalog.rebuild(store)
+    assert _catalog_contents(store) == incremental
+
+
+def test_add_snapshot_only_looks_up_changes(tmp_path):
+    catalog = snapshotCatalog.SnapshotCatalog(tmp_path)
+    directory = (0, 1, stat.S_IFDIR | 0o755, 1)
+    old = {'d': directory, **{os.path.join('d', str(i)): (i, 10, stat.S_IFREG | 0o644, i) for i in range(100)}}
+    catalog.add_snapshot('first', 1, old)
+    new = dict(old)
+    new[os.path.join('d', '5')] = (6, 20, stat.S_IFREG | 0o644, 5)
+    del new[os.path.join('d', '7')]
+    new['e'] = (1, 1, stat.S_IFREG | 0o644, 200)
+    looked_up = []
+    current_versions = catalog._current_versions
+    catalog._current_versions = lambda paths=None: looked_up.append(paths) or current_versions(paths)
+    assert catalog.add_snapshot('second', 2, new, previous=({'created_ns': 1}, old)) == (2, 2)
+    assert sorted(looked_up[0]) == sorted([os.path.join('d', '5'), os.path.join('d', '7'), 'e'])
+    # without the manifest of the newest snapshot every current version is loaded
+    catalog.add_snapshot('third', 3, old, previous=({'created_ns': 1}, old))
+    assert looked_up[1] is None
+    assert [len(list(catalog.files_at(seq))) for seq, _, _, _ in catalog.snapshots()] == [101, 101, 101]
+    catalog.close()
+
+
+def test_no_manifest_refused_with_catalog(tmp_path, backup):
+    write_tree(tmp_path / 'SRC', {'f': 'one'}, 1600000000)
+    backup('--catalog')
+    before = snapshots(tmp_path / 'store')
+    result = backup('--no_manifest', check=False)
+    assert result.returncode != 0
+    assert 'catalog' in result.stderr
+    assert snapshots(tmp_path / 'store') == before
+
+
+def test_purge_by_catalog(tmp_path, backup):
+    _make_set(tmp_path, backup)
+    store = tmp_path / 'store'
+    before = snapshots(store)
+    run_script('purgeDuplicateBackups.py', store, '-c', '-d', '-n')
+    after = snapshots(store)
+    # the run that changed nothing made the only duplicate
+    assert len(after) == len(before) - 1
+    assert sorted(_catalog_contents(store)) == after
+    for name in after:
+        assert os.path.isfile(backupManifest.manifest_path(store / name))
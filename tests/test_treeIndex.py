@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import treeIndex
+from conftest import write_tree
+
+
+def _paths(tree_diff) -> dict:
+    left, right = tree_diff.left, tree_diff.right
+    return {'added': sorted(right.path(row) for row in tree_diff.added),
+            'removed': sorted(left.path(row) for row in tree_diff.removed),
+            'changed': sorted(left.path(left_row) for left_row, _ in tree_diff.changed),
+            'same': sorted(left.path(left_row) for left_row, _ in tree_diff.same)}
+
+
+def _diff(left: str, right: str, sizes: dict = None) -> dict:
+    names = treeIndex.NameTable()
+    return _paths(treeIndex.diff(treeIndex.TreeIndex.scan(left, names=names),
+                                 treeIndex.TreeIndex.scan(right, names=names, sizes=sizes)))
+
+
+def _trees(tmp_path):
+    write_tree(tmp_path / 'left', {'same': 'x', 'a/b/c/deep': 'x', 'size': 'x', 'mtime': 'x', 'type': 'x',
+                                   'gone/f': 'x', 'gone/sub/g': 'x', 'a/b/removed': 'x'}, 1600000000)
+    write_tree(tmp_path / 'right', {'same': 'x', 'a/b/c/deep': 'x', 'size': 'xx', 'mtime': 'x', 'type/now': 'x',
+                                    'new/f': 'x', 'new/sub/g': 'x', 'a/b/added': 'x', 'a/b/c/e/f/g/h': 'x'},
+               1600000000)
+    os.utime(tmp_path / 'right' / 'mtime', (1600001000, 1600001000))
+    return str(tmp_path / 'left'), str(tmp_path / 'right')
+
+
+_expected = {'added': [os.path.join('a', 'b', 'added'), os.path.join('a', 'b', 'c', 'e'),
+                       os.path.join('a', 'b', 'c', 'e', 'f'), os.path.join('a', 'b', 'c', 'e', 'f', 'g'),
+                       os.path.join('a', 'b', 'c', 'e', 'f', 'g', 'h'), 'new', os.path.join('new', 'f'),
+                       os.path.join('new', 'sub'), os.path.join('new', 'sub', 'g'), os.path.join('type', 'now')],
+             'removed': [os.path.join('a', 'b', 'removed'), 'gone', os.path.join('gone', 'f'),
+                         os.path.join('gone', 'sub'), os.path.join('gone', 'sub', 'g')],
+             'changed': ['mtime', 'size', 'type'],
+             'same': ['a', os.path.join('a', 'b'), os.path.join('a', 'b', 'c'), os.path.join('a', 'b', 'c', 'deep'),
+                      'same']}
+
+
+@pytest.mark.skipif(treeIndex.numpy is None, reason='numpy is not installed')
+def test_numpy_and_dict_joins_agree(tmp_path, monkeypatch):
+    left, right = _trees(tmp_path)
+    with_numpy = _diff(left, right)
+    monkeypatch.setattr(treeIndex, 'numpy', None)
+    assert _diff(left, right) == with_numpy == _expected
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_diff(tmp_path, monkeypatch, use_numpy):
+    if use_numpy and treeIndex.numpy is None:
+        pytest.skip('numpy is not installed')
+    if not use_numpy:
+        monkeypatch.setattr(treeIndex, 'numpy', None)
+    left, right = _trees(tmp_path)
+    assert _diff(left, right) == _expected
+    identical = _diff(left, left)
+    assert identical['added'] == identical['removed'] == identical['changed'] == []
+    assert len(identical['same']) == 13
+    # an empty tree on either side
+    os.makedirs(tmp_path / 'empty')
+    assert _diff(str(tmp_path / 'empty'), left)['added'] == _diff(left, str(tmp_path / 'empty'))['removed']
+    # a size given for a file stored as blocks replaces the size of the file
+    assert _diff(left, left, {'size': 2})['changed'] == ['size']
@@ -0,0 +1,96 @@
+import os
+
+import backupManifest
+import restoreBackup
+import virtualSnapshot
+from conftest import run_script, write_tree
+
+
+def _read_tree(root) -> dict:
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path) as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+def _make_set(tmp_path, backup) -> list:
+    """
+    :return: (virtual snapshots oldest first, contents of the tree each one was taken from)
+    """
+    src = tmp_path / 'SRC'
+    trees = [{'a': 'one', os.path.join('d', 'b'): 'bee', os.path.join('d', 'e', 'c'): 'sea'}]
+    write_tree(src, trees[0], 1600000000)
+    backup()
+    write_tree(src, {'a': 'ONE!', os.path.join('d', 'new'): 'new'})
+    os.utime(src / 'a', (1600001000, 1600001000))
+    os.remove(src / 'd' / 'b')
+    trees.append(_read_tree(src))
+    backup('--virtual')
+    write_tree(src, {'a': 'ONE!!'})
+    os.remove(src / 'd' / 'e' / 'c')
+    os.rmdir(src / 'd' / 'e')
+    trees.append(_read_tree(src))
+    backup('--virtual')
+    return virtualSnapshot.list_virtual_snapshots(tmp_path / 'store'), trees
+
+
+def test_virtual_snapshots_restore_every_version(tmp_path, backup):
+    vsnaps, trees = _make_set(tmp_path, backup)
+    assert len(vsnaps) == 2
+    assert _read_tree(tmp_path / 'store' / 'LATEST') == trees[2]
+    for i, (vsnap, tree) in enumerate(zip(vsnaps, trees)):
+        run_script('restoreBackup.py', 'restore', tmp_path / 'store', os.path.basename(vsnap), tmp_path / f'copy{i}')
+        assert _read_tree(tmp_path / f'copy{i}') == tree
+        assert restoreBackup.restore_snapshot(tmp_path / 'store', vsnap, str(tmp_path / f'link{i}'), link=True) == []
+        assert _read_tree(tmp_path / f'link{i}') == tree
+    # the restored tree has the digests of the virtual snapshot
+    assert backupManifest.compute_digests(backupManifest.scan_tree(str(tmp_path / 'copy0'))) \
+        == virtualSnapshot.snapshot_digests(vsnaps[0])
+
+
+def test_gc_keeps_the_versions_still_used(tmp_path, backup):
+    vsnaps, trees = _make_set(tmp_path, backup)
+    os.remove(vsnaps[0])
+    result = run_script('restoreBackup.py', 'gc', tmp_path / 'store')
+    # the first a and d/b were only used by the first snapshot
+    assert '[ Removed ] : [ 2 versions ]' in result.stdout
+    assert restoreBackup.restore_snapshot(tmp_path / 'store', vsnaps[1], str(tmp_path / 'out')) == []
+    assert _read_tree(tmp_path / 'out') == trees[1]
+
+
+def test_resolve_finds_the_object_then_latest(tmp_path):
+    latest = tmp_path / 'set' / 'LATEST'
+    write_tree(latest, {'f': 'first'}, 1600000000)
+    entries = backupManifest.scan_tree(str(latest))
+    store = virtualSnapshot.ObjectStore(str(tmp_path / 'set'), entries)
+    assert store.resolve(str(latest), 'f', entries['f']) == str(latest / 'f')
+    store.preserve(str(latest / 'f'), 'f')
+    # replaced by the backup, not written in place
+    os.remove(latest / 'f')
+    write_tree(latest, {'f': 'second version'}, 1600001000)
+    assert store.resolve(str(latest), 'f', entries['f']) == store.object_path('f', entries['f'])
+    with open(store.resolve(str(latest), 'f', entries['f'])) as f:
+        assert f.read() == 'first'
+    # a version that was neither preserved nor is still in LATEST is gone
+    assert store.resolve(str(latest), 'g', (1, 1600000000 * 10 ** 9, 0o100644, 0)) is None
+
+
+def test_same_path_size_and_mtime_is_the_same_object(tmp_path):
+    latest = tmp_path / 'set' / 'LATEST'
+    write_tree(latest, {'f': 'first'}, 1600000000)
+    entries = backupManifest.scan_tree(str(latest))
+    store = virtualSnapshot.ObjectStore(str(tmp_path / 'set'), entries)
+    store.preserve(str(latest / 'f'), 'f')
+    # another file with the path, size and mtime the manifest recorded, the backup sees the same version and so
+    # does the object store: the version preserved first is kept (as when an interrupted run is resumed)
+    os.remove(latest / 'f')
+    write_tree(latest, {'f': 'FIRST'}, 1600000000)
+    store.preserve(str(latest / 'f'), 'f')
+    assert store.preserved == 1
+    with open(store.object_path('f', entries['f'])) as f:
+        assert f.read() == 'first'
+    # the path is part of the name, the same size and mtime elsewhere is another object
+    assert store.object_path('g', entries['f']) != store.object_path('f', entries['f'])
@@ -0,0 +1,295 @@
+# Tree Index
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import array
+import os
+import stat
+
+import runReport
+
+try:
+    import numpy
+except ImportError:
+    # the join falls back to a dict per depth
+    numpy = None
+
+version = '1.0'
+
+_file_type = stat.S_IFMT(0o177777)
+
+
+class NameTable:
+    """
+    Interns the names of the entries of the trees compared, an entry stores the id of its name. Snapshots of the
+    same source share almost every name, one table for all of them stores each name once. Trees are only joined
+    when they were scanned with the same table.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self.names = []
+
+    def intern(self, name: str) -> int:
+        name_id = self._ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self._ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+
+class TreeIndex:
+    """
+    Compact picture of a directory tree for comparing large snapshots: one row per entry stored in columns of
+    machine integers (array module), the row of its parent, the id of its name in a NameTable and its size, mtime,
+    mode and inode, about 36 bytes per entry. Rows are stored breadth first, so every parent comes before its
+    children and the entries of one depth are contiguous (levels). Row 0 is the root.
+    """
+
+    def __init__(self, root: str, names: NameTable = None):
+        self.root = os.path.abspath(root)
+        self.names = names if names is not None else NameTable()
+        self.parent = array.array('i')
+        self.name = array.array('i')
+        self.size = array.array('q')
+        self.mtime_ns = array.array('q')
+        self.mode = array.array('I')
+        self.ino = array.array('Q')
+        # relative path -> size given to scan for the files whose size is not the size of the file
+        self.sizes = {}
+        # first row of each depth
+        self.levels = []
+        self.dev = None
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def _append(self, parent: int, name: str, st: os.stat_result) -> int:
+        row = len(self.parent)
+        self.parent.append(parent)
+        self.name.append(self.names.intern(name))
+        self.size.append(0 if stat.S_ISDIR(st.st_mode) else st.st_size)
+        self.mtime_ns.append(st.st_mtime_ns)
+        self.mode.append(st.st_mode)
+        self.ino.append(st.st_ino)
+        return row
+
+    @classmethod
+    def scan(cls, root: str, ignore_filter=None, names: NameTable = None, sizes: dict = None):
+        """
+        Stats every entry below root with os.scandir, level by level
+        :param ignore_filter: IgnoreFilesFilter, matching entries are skipped (and not descended into)
+        :param names: NameTable shared with the trees this one is joined with
+        :param sizes: dict of relative path -> size used instead of the size of the file (files stored as blocks,
+                      see deltaStorage.snapshot_recipes)
+        """
+        index = cls(root, names)
+        index.sizes = sizes or {}
+        st = os.stat(index.root)
+        index.dev = st.st_dev
+        index.levels.append(0)
+        index._append(-1, '', st)
+        # the columns are appended to in the innermost loop, bound once
+        append_parent, append_name, append_size, append_mtime, append_mode, append_ino = (
+            index.parent.append, index.name.append, index.size.append, index.mtime_ns.append, index.mode.append,
+            index.ino.append)
+        intern = index.names.intern
+        # (row, path, relative path) of the directories of the depth being listed, the relative paths are only
+        # built to match the ignore patterns and the sizes
+        build_rel = ignore_filter is not None or bool(sizes)
+        level = [(0, index.root, '')]
+        while level:
+            index.levels.append(len(index))
+            next_level = []
+            for row, path, rel in level:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        name = entry.name
+                        child_rel = None
+                        if build_rel:
+                            child_rel = os.path.join(rel, name) if rel else name
+                            if ignore_filter is not None and ignore_filter.is_ignored(child_rel, entry.is_dir):
+                                continue
+                        try:
+                            # follows symbolic links, the same as filecmp sees them
+                            st = entry.stat()
+                        except OSError as e:
+                            raise Exception(f'There were funny files found when scanning {index.root}\n'
+                                            f'Funny Files: [{entry.path}] ({e})')
+                        mode = st.st_mode
+                        is_dir = stat.S_ISDIR(mode)
+                        if is_dir:
+                            next_level.append((len(index.parent), entry.path, child_rel))
+                        append_parent(row)
+                        append_name(intern(name))
+                        append_size(0 if is_dir else sizes.get(child_rel, st.st_size) if sizes else st.st_size)
+                        append_mtime(st.st_mtime_ns)
+                        append_mode(mode)
+                        append_ino(st.st_ino)
+                runReport.count('directories_walked')
+            level = next_level
+        runReport.count('files_stated', len(index) - 1)
+        return index
+
+    def level(self, depth: int) -> range:
+        """
+        :return: rows of the entries at depth (1 for the entries of the root)
+        """
+        end = self.levels[depth + 1] if depth + 1 < len(self.levels) else len(self)
+        return range(self.levels[depth], end)
+
+    def is_dir(self, row: int) -> bool:
+        return stat.S_ISDIR(self.mode[row])
+
+    def path(self, row: int) -> str:
+        """
+        :return: path of a row relative to the root
+        """
+        parts = []
+        while row > 0:
+            parts.append(self.names.names[self.name[row]])
+            row = self.parent[row]
+        return os.path.join(*reversed(parts)) if parts else ''
+
+
+class TreeDiff:
+    """
+    Result of joining two trees, rows of the left (old) and right (new) tree:
+    added: right rows with no entry of the same path on the left (every entry below a new directory too),
+    removed: left rows with no entry of the same path on the right,
+    changed: (left, right) rows of the same path whose type, size or mtime differ (the os.stat signature
+    filecmp compares, directories only by type),
+    same: (left, right) rows of the same path with the same signature.
+    """
+
+    def __init__(self, left: TreeIndex, right: TreeIndex, added, removed, changed, same):
+        self.left = left
+        self.right = right
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.same = same
+
+    def identical(self) -> bool:
+        return not (len(self.added) or len(self.removed) or len(self.changed))
+
+    def summary(self) -> str:
+        return '{} added, {} removed, {} changed, {} same'.format(len(self.added), len(self.removed),
+                                                                 len(self.changed), len(self.same))
+
+
+def _join_level(left_keys, right_keys):
+    """
+    :return: (left positions, right positions) of the keys found on both sides
+    """
+    if numpy is not None:
+        order = numpy.argsort(left_keys, kind='stable')
+        sorted_keys = left_keys[order]
+        found = numpy.searchsorted(sorted_keys, right_keys)
+        found[found == len(sorted_keys)] = 0
+        matched = (sorted_keys[found] == right_keys) if len(sorted_keys) else numpy.zeros(len(right_keys), bool)
+        return order[found[matched]], numpy.nonzero(matched)[0]
+    by_key = {key: position for position, key in enumerate(left_keys)}
+    left_positions = []
+    right_positions = []
+    for position, key in enumerate(right_keys):
+        found = by_key.get(key)
+        if found is not None:
+            left_positions.append(found)
+            right_positions.append(position)
+    return left_positions, right_positions
+
+
+def _columns(index: TreeIndex):
+    if numpy is not None:
+        return (numpy.frombuffer(index.parent, numpy.int32).astype(numpy.int64),
+                numpy.frombuffer(index.name, numpy.int32).astype(numpy.int64),
+                numpy.frombuffer(index.size, numpy.int64), numpy.frombuffer(index.mtime_ns, numpy.int64),
+                numpy.frombuffer(index.mode, numpy.uint32))
+    return index.parent, index.name, index.size, index.mtime_ns, index.mode
+
+
+def diff(left: TreeIndex, right: TreeIndex) -> TreeDiff:
+    """
+    Joins two trees scanned with the same NameTable, depth by depth: an entry is keyed by the row of its parent
+    on the left and the id of its name (parent << 32 | name), the right rows are keyed by the left row their
+    parent matched, so a path is never built. With numpy each depth is one sort and search, without it a dict per
+    depth.
+    :return: TreeDiff
+    """
+    if left.names is not right.names:
+        raise Exception('Trees can only be joined when they were scanned with the same NameTable')
+    left_parent, left_name, left_size, left_mtime, left_mode = _columns(left)
+    right_parent, right_name, right_size, right_mtime, right_mode = _columns(right)
+    if numpy is not None:
+        right_to_left = numpy.full(len(right), -1, numpy.int64)
+        left_matched = numpy.zeros(len(left), bool)
+    else:
+        right_to_left = array.array('q', [-1]) * len(right)
+        left_matched = bytearray(len(left))
+    right_to_left[0] = 0
+    left_matched[0] = True
+    pairs_left = []
+    pairs_right = []
+
+    for depth in range(1, min(len(left.levels), len(right.levels))):
+        left_rows = left.level(depth)
+        right_rows = right.level(depth)
+        if not len(left_rows) or not len(right_rows):
+            break
+        if numpy is not None:
+            left_rows = numpy.arange(left_rows.start, left_rows.stop)
+            right_rows = numpy.arange(right_rows.start, right_rows.stop)
+            mapped = right_to_left[right_parent[right_rows]]
+            # entries below a directory only found on the right are added
+            right_rows = right_rows[mapped >= 0]
+            left_keys = (left_parent[left_rows] << 32) | left_name[left_rows]
+            right_keys = (mapped[mapped >= 0] << 32) | right_name[right_rows]
+            left_positions, right_positions = _join_level(left_keys, right_keys)
+            matched_left = left_rows[left_positions]
+            matched_right = right_rows[right_positions]
+            right_to_left[matched_right] = matched_left
+            left_matched[matched_left] = True
+        else:
+            right_rows = [row for row in right_rows if right_to_left[right_parent[row]] >= 0]
+            left_keys = [(left_parent[row] << 32) | left_name[row] for row in left_rows]
+            right_keys = [(right_to_left[right_parent[row]] << 32) | right_name[row] for row in right_rows]
+            left_positions, right_positions = _join_level(left_keys, right_keys)
+            matched_left = [left_rows[position] for position in left_positions]
+            matched_right = [right_rows[position] for position in right_positions]
+            for left_row, right_row in zip(matched_left, matched_right):
+                right_to_left[right_row] = left_row
+                left_matched[left_row] = True
+        pairs_left.append(matched_left)
+        pairs_right.append(matched_right)
+
+    if numpy is not None:
+        pairs_left = numpy.concatenate(pairs_left) if pairs_left else numpy.zeros(0, numpy.int64)
+        pairs_right = numpy.concatenate(pairs_right) if pairs_right else numpy.zeros(0, numpy.int64)
+        left_type = left_mode[pairs_left] & _file_type
+        right_type = right_mode[pairs_right] & _file_type
+        same = (left_type == right_type) & ((left_type == stat.S_IFDIR) |
+                                            ((left_size[pairs_left] == right_size[pairs_right]) &
+                                             (left_mtime[pairs_left] == right_mtime[pairs_right])))
+        added = numpy.nonzero(right_to_left < 0)[0]
+        removed = numpy.nonzero(~left_matched)[0]
+        changed = numpy.stack((pairs_left[~same], pairs_right[~same]), axis=1)
+        same = numpy.stack((pairs_left[same], pairs_right[same]), axis=1)
+        return TreeDiff(left, right, added, removed, changed, same)
+
+    changed = []
+    same = []
+    for left_rows, right_rows in zip(pairs_left, pairs_right):
+        for left_row, right_row in zip(left_rows, right_rows):
+            left_type = left_mode[left_row] & _file_type
+            if left_type == right_mode[right_row] & _file_type and (
+                    left_type == stat.S_IFDIR or (left_size[left_row] == right_size[right_row] and
+                                                  left_mtime[left_row] == right_mtime[right_row])):
+                same.append((left_row, right_row))
+            else:
+                changed.append((left_row, right_row))
+    added = [row for row in range(len(right)) if right_to_left[row] < 0]
+    removed = [row for row in range(len(left)) if not left_matched[row]]
+    return TreeDiff(left, right, added, removed, changed, same)
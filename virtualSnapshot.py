@@ -0,0 +1,278 @@
+# Virtual Snapshot
+# Author: Gregory J. Bootsma
+# Version: 1.0
+# Copyright (C) 2026
+
+import hashlib
+import os
+
+import backupManifest
+import deltaStorage
+import fileUtilities
+
+version = '1.0'
+
+vsnap_suffix = '.vsnap'
+
+
+def snapshot_path(storage_root: str, name: str) -> str:
+    return os.path.join(storage_root, name + vsnap_suffix)
+
+
+def is_virtual_snapshot(path: str) -> bool:
+    return path.endswith(vsnap_suffix) and os.path.isfile(path)
+
+
+def list_virtual_snapshots(storage_root: str) -> list:
+    """
+    :return: paths of the virtual snapshots of a backup set, oldest first
+    """
+    root = os.path.abspath(storage_root)
+    paths = [os.path.join(root, name) for name in os.listdir(root) if name.endswith(vsnap_suffix)]
+    return sorted(paths, key=snapshot_time)
+
+
+def snapshot_time(path: str) -> float:
+    """
+    :return: time a snapshot (virtual or directory) was taken, the scan time of its manifest when it has one and
+             the ctime of the directory otherwise
+    """
+    manifest = path if path.endswith(vsnap_suffix) else backupManifest.manifest_path(path)
+    if os.path.isfile(manifest):
+        try:
+            return backupManifest.read_manifest_header(manifest)['created_ns'] / 1e9
+        except (OSError, ValueError, EOFError, KeyError):
+            pass
+    return os.path.getctime(path)
+
+
+def write_virtual_snapshot(path: str, latest: str, manifest):
+    """
+    Records the snapshot LATEST holds as a manifest only, written before LATEST is updated
+    :param path: virtual snapshot to write, see snapshot_path
+    :param latest: the LATEST directory the manifest describes
+    :param manifest: (header, entries) of LATEST, see backupManifest.load_manifest
+    """
+    header, entries = manifest
+    backupManifest.write_manifest(path, header['source'], entries, header['ignore_list'], header['created_ns'],
+                                  {'latest': os.path.basename(os.path.normpath(latest))})
+
+
+def read_virtual_snapshot(path: str):
+    """
+    :return: (header, entries) of a virtual snapshot, see backupManifest.read_manifest
+    """
+    return backupManifest.read_manifest(path)
+
+
+class ObjectStore:
+    """
+    Versions of files replaced or removed from LATEST, kept as hard links in the metadata directory of the backup
+    set so virtual snapshots can still reach them. An object is named by the path, size and mtime the manifest
+    recorded for the file, which is how a virtual snapshot entry finds it: an entry without an object is still the
+    file in LATEST. Preserving a file is a single link() and nothing is copied, unchanged files cost nothing.
+    """
+
+    def __init__(self, storage_root: str, entries: dict = None, create: bool = True):
+        """
+        :param storage_root: directory holding LATEST and the snapshots
+        :param entries: manifest entries of LATEST before it is updated, the versions preserve records
+        :param create: create the objects directory if it does not exist
+        """
+        self._path = os.path.join(fileUtilities.metadata_dir(storage_root, create),
+                                  fileUtilities.objects_dir_name)
+        self._entries = entries if entries is not None else {}
+        self.preserved = 0
+
+    @staticmethod
+    def key(rel: str, entry: tuple) -> str:
+        return hashlib.sha1('{}\0{}\0{}'.format(rel, entry[0], entry[1])
+                            .encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def object_path(self, rel: str, entry: tuple) -> str:
+        key = self.key(rel, entry)
+        return os.path.join(self._path, key[:2], key)
+
+    def preserve(self, path: str, rel: str):
+        """
+        Keeps the version of a file (or every file below a directory) of LATEST that is about to be replaced or
+        removed, files the manifest does not know were not part of the previous snapshot and are skipped
+        :param path: the file or directory in LATEST
+        :param rel: its path relative to LATEST
+        """
+        stack = [(path, rel)]
+        while stack:
+            curr_path, curr_rel = stack.pop()
+            entry = self._entries.get(curr_rel)
+            if entry is None:
+                continue
+            if backupManifest.entry_is_dir(entry):
+                with os.scandir(curr_path) as it:
+                    stack.extend((item.path, os.path.join(curr_rel, item.name)) for item in it)
+                continue
+            object_path = self.object_path(curr_rel, entry)
+            if os.path.lexists(object_path):
+                # a run interrupted after the link, or the same version preserved by an earlier run
+                continue
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.link(curr_path, object_path)
+            self.preserved += 1
+
+    def resolve(self, latest: str, rel: str, entry: tuple):
+        """
+        :return: path holding the version of rel described by entry, None if it is gone
+        """
+        object_path = self.object_path(rel, entry)
+        if os.path.lexists(object_path):
+            return object_path
+        path = os.path.join(latest, rel)
+        try:
+            if os.stat(path).st_mtime_ns == entry[1]:
+                return path
+        except FileNotFoundError:
+            pass
+        return None
+
+    def collect_garbage(self, snapshots: list, verbose: bool = False) -> int:
+        """
+        Removes the objects none of the virtual snapshots refers to any more (e.g. after some were purged)
+        :param snapshots: paths of every virtual snapshot kept
+        :return: number of objects removed
+        """
+        used = set()
+        for snapshot in snapshots:
+            _, entries = read_virtual_snapshot(snapshot)
+            used.update(self.key(rel, entry) for rel, entry in entries.items()
+                        if not backupManifest.entry_is_dir(entry))
+
+        removed = 0
+        if not os.path.isdir(self._path):
+            return removed
+        for dirpath, _, filenames in os.walk(self._path):
+            for name in filenames:
+                if name not in used:
+                    os.remove(os.path.join(dirpath, name))
+                    removed += 1
+                    if verbose:
+                        print(f'Removed object {name}')
+        return removed
+
+
+def snapshot_recipes(path: str) -> dict:
+    """
+    :return: dict of relative path -> size of the files of a virtual snapshot stored as blocks, from its recipe
+             index, or found (and the index saved) by resolving every file of a snapshot written without one
+    """
+    recipes = deltaStorage.read_recipe_index(path)
+    if recipes is not None:
+        return recipes
+    storage_root = os.path.dirname(os.path.abspath(path))
+    if not deltaStorage.has_block_store(storage_root):
+        return {}
+    header, entries = read_virtual_snapshot(path)
+    latest = os.path.join(storage_root, header['latest'])
+    store = ObjectStore(storage_root, create=False)
+    recipes = {}
+    for rel, entry in entries.items():
+        if not backupManifest.entry_is_dir(entry):
+            resolved = store.resolve(latest, rel, entry)
+            if resolved is not None and deltaStorage.has_recipe_header(resolved):
+                recipes[rel] = entry[0]
+    deltaStorage.write_recipe_index(path, recipes)
+    return recipes
+
+
+def recipe_paths(path: str) -> list:
+    """
+    :return: paths of the recipes a virtual snapshot refers to, in LATEST or kept as objects
+    """
+    recipes = snapshot_recipes(path)
+    if not recipes:
+        return []
+    storage_root = os.path.dirname(os.path.abspath(path))
+    header, entries = read_virtual_snapshot(path)
+    latest = os.path.join(storage_root, header['latest'])
+    store = ObjectStore(storage_root, create=False)
+    paths = []
+    for rel in recipes:
+        resolved = store.resolve(latest, rel, entries[rel]) if rel in entries else None
+        if resolved is not None:
+            paths.append(resolved)
+    return paths
+
+
+def snapshot_digests(path: str, ignore_filter=None, content_hash: bool = False) -> dict:
+    """
+    Merkle digests of a virtual snapshot (see backupManifest.compute_digests), the same as the digests of the tree
+    it materializes to
+    :param ignore_filter: IgnoreFilesFilter, matching paths are left out
+    :param content_hash: include the content hash of every file (reads every file)
+    """
+    header, entries = read_virtual_snapshot(path)
+    if ignore_filter is not None:
+        entries = {rel: entry for rel, entry in entries.items()
+                   if not ignore_filter.path_excluded(rel, backupManifest.entry_is_dir(entry))}
+    content_hashes = None
+    if content_hash:
+        storage_root = os.path.dirname(os.path.abspath(path))
+        latest = os.path.join(storage_root, header['latest'])
+        store = ObjectStore(storage_root, create=False)
+        recipes = snapshot_recipes(path)
+        content_hashes = {}
+        for rel, entry in entries.items():
+            if not backupManifest.entry_is_dir(entry):
+                resolved = store.resolve(latest, rel, entry)
+                content_hashes[rel] = deltaStorage.hash_logical(resolved, storage_root, rel in recipes) \
+                    if resolved is not None else ''
+    return backupManifest.compute_digests(entries, content_hashes)
+
+
+def materialize(path: str, output: str, link: bool = False, method: str = fileUtilities.default_copy_method,
+                verbose: bool = False):
+    """
+    Rebuilds the directory tree of a virtual snapshot
+    :param path: virtual snapshot
+    :param output: directory to create
+    :param link: hard link the files instead of copying them (nothing is copied, but changing a file changes the
+                 backup), files stored as blocks are always reassembled
+    :param method: copy method, see fileUtilities.copy_methods
+    :return: (CopyStats, list of relative paths whose version is gone)
+    """
+    storage_root = os.path.dirname(os.path.abspath(path))
+    header, entries = read_virtual_snapshot(path)
+    latest = os.path.join(storage_root, header['latest'])
+    store = ObjectStore(storage_root, create=False)
+    recipes = snapshot_recipes(path)
+    stats = fileUtilities.CopyStats()
+    missing = []
+
+    os.makedirs(output)
+    directories = [rel for rel, entry in entries.items() if backupManifest.entry_is_dir(entry)]
+    for rel in sorted(directories):
+        os.makedirs(os.path.join(output, rel), exist_ok=True)
+
+    for rel, entry in entries.items():
+        if backupManifest.entry_is_dir(entry):
+            continue
+        src = store.resolve(latest, rel, entry)
+        if src is None:
+            missing.append(rel)
+            print(f'WARNING: No stored version of {rel} ({entry[0]} bytes)')
+            continue
+        dst = os.path.join(output, rel)
+        if verbose:
+            print(f'Restoring {rel}')
+        if rel in recipes:
+            deltaStorage.restore_file(src, dst, storage_root)
+        elif link:
+            os.link(src, dst)
+        else:
+            fileUtilities.copy_file(src, dst, method, stats)
+
+    # deepest first, restoring the files changed the times of the directories
+    for rel in sorted(directories, key=lambda d: d.count(os.sep), reverse=True):
+        entry = entries[rel]
+        directory = os.path.join(output, rel)
+        os.chmod(directory, entry[2] & 0o7777)
+        os.utime(directory, ns=(entry[1], entry[1]))
+    return stats, missing